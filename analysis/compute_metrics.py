@@ -1,75 +1,140 @@
 import json
-import math
 from pathlib import Path
 from typing import Dict, List
 
+from analysis.evaluation import (
+    evaluate,
+    evaluate_positions,
+    evaluate_stream,
+    gold_ids,
+    gold_positions,
+    rank_matrix,
+)
+from src.run_log import has_records, latest_runs, read_records
 
-# Recal at k for a pipeline 
+
+# Per-record metrics, computed by analysis/evaluation.py
+def _record_metrics(record: Dict, k: int, key: str) -> Dict[str, Dict[str, float]]:
+    position = gold_positions(rank_matrix([record], key, depth=k), gold_ids([record]))
+    return evaluate_positions(position, k, [k], n_boot=0)
+
+
+# Recall at k for one record
 def recall_at_k(record: Dict, k: int, key: str) -> int:
-    gold_id = record.get("gold_chunk_id")
-    if gold_id is None:
-        return 0
+    return int(_record_metrics(record, k, key)[f"recall@{k}"]["mean"])
 
-    ids: List[int] = record.get(key, [])
-    return int(gold_id in ids[:k])
 
-#dcg for a pipeline 
+# DCG at k for one record
 def dcg_at_k(record: Dict, k: int, key: str) -> float:
-    gold_id = record.get("gold_chunk_id")
-    if gold_id is None:
-        return 0.0
+    return _record_metrics(record, k, key)[f"ndcg@{k}"]["mean"]
 
-    ids: List[int] = record.get(key, [])[:k]
-    if gold_id not in ids:
-        return 0.0
 
-    rank = ids.index(gold_id)
-    return 1.0 / math.log2(rank + 2)
-
-#ndcg for a pipeline 
+# nDCG at k for one record
 def ndcg_at_k(record: Dict, k: int, key: str) -> float:
-    # single relevant item → ideal DCG = 1
+    # Single relevant item, so the ideal DCG is 1
     return dcg_at_k(record, k, key)
 
+
+def _metric_format(evaluation: Dict[str, Dict], ks: List[int]) -> Dict[int, Dict[str, float]]:
+    """
+    metrics.json layout from an evaluation of both ranking keys.
+    """
+    retrieved = evaluation["retrieved_chunk_ids"]["metrics"]
+    reranked = evaluation["reranked_chunk_ids"]["metrics"]
+
+    metrics = {}
+
+    for k in ks:
+        metrics[k] = {
+            # Retrieval-only (pre-rerank)
+            "retrieval_recall": retrieved[f"recall@{k}"]["mean"],
+            "retrieval_ndcg": retrieved[f"ndcg@{k}"]["mean"],
+
+            # End-to-end (post-rerank)
+            "reranked_recall": reranked[f"recall@{k}"]["mean"],
+            "reranked_ndcg": reranked[f"ndcg@{k}"]["mean"],
+        }
+
+    return metrics
+
+
+def _retrieval_mode(record: Dict) -> str:
+    # Records from before retrieval modes existed are dense
+    return record.get("retrieval_mode") or "dense"
+
+
+def mean_metrics(records: List[Dict], ks: List[int]) -> Dict[int, Dict[str, float]]:
+    """
+    Retrieval and end-to-end metrics at each k, averaged over the
+    records that have a gold chunk.
+    """
+    return _metric_format(evaluate(records, ks, n_boot=0), ks)
+
+
 if __name__ == "__main__":
 
     KS = [1, 5, 10, 20]
 
     PIPELINES = {
         "baseline": Path("results/baseline"),
-        "querry_fitted": Path("results/query_fitted"),
+        "query_fitted": Path("results/query_fitted"),
     }
 
     for pipeline_name, base_dir in PIPELINES.items():
 
-        result_path = base_dir / "result.json"
         output_path = base_dir / "metrics.json"
 
-        with open(result_path, "r", encoding="utf-8") as f:
-            record = json.load(f)
-
-        metrics = {}
-
-        for k in KS:
-            metrics[k] = {
-                # Retrieval-only (pre-rerank)
-                "retrieval_recall": recall_at_k(
-                    record, k, key="retrieved_chunk_ids"
-                ),
-                "retrieval_ndcg": ndcg_at_k(
-                    record, k, key="retrieved_chunk_ids"
-                ),
-
-                # End-to-end (post-rerank)
-                "reranked_recall": recall_at_k(
-                    record, k, key="reranked_chunk_ids"
-                ),
-                "reranked_ndcg": ndcg_at_k(
-                    record, k, key="reranked_chunk_ids"
+        if not has_records(base_dir):
+            print(f"[SKIP] {pipeline_name}: no run records found")
+            continue
+
+        # Latest run of each first-stage retrieval mode (dense when not
+        # recorded); a legacy file without run headers is read whole
+        runs_by_mode = latest_runs(base_dir, key=lambda run: run["config"].get("retrieval_mode") or "dense")
+
+        # metrics.json is the dense baseline, whichever mode ran last
+        if runs_by_mode and "dense" not in runs_by_mode:
+            print(f"[SKIP] {pipeline_name}: no dense run for metrics.json")
+        else:
+            dense = evaluate_stream(
+                (
+                    record
+                    for record in read_records(
+                        base_dir, run_ids=[runs_by_mode["dense"]] if runs_by_mode else None
+                    )
+                    if _retrieval_mode(record) == "dense"
                 ),
+                KS,
+                n_boot=0,
+            )
+            if not dense:
+                print(f"[SKIP] {pipeline_name}: dense run has no records")
+            else:
+                with open(output_path, "w", encoding="utf-8") as f:
+                    json.dump(_metric_format(dense[None]["keys"], KS), f, indent=2)
+
+                print(f"{pipeline_name} metrics written to {output_path}")
+
+        # Per-mode numbers, streamed and grouped by mode
+        by_mode = evaluate_stream(
+            read_records(base_dir, run_ids=list(runs_by_mode.values()) or None),
+            KS,
+            group_by=_retrieval_mode,
+            n_boot=0,
+        )
+
+        # Recall and first-stage latency side by side for each mode
+        mode_metrics = {
+            mode: {
+                "num_queries": summary["num_records"],
+                "retrieval_seconds": summary["retrieval_seconds"],
+                "metrics": _metric_format(summary["keys"], KS),
             }
+            for mode, summary in by_mode.items()
+        }
 
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(metrics, f, indent=2)
+        mode_path = base_dir / "metrics_by_mode.json"
+        with open(mode_path, "w", encoding="utf-8") as f:
+            json.dump(mode_metrics, f, indent=2)
 
-        print(f"{pipeline_name} metrics written to {output_path}")
\ No newline at end of file
+        print(f"{pipeline_name} per-mode metrics written to {mode_path}")
@@ -1,48 +1,150 @@
 import json
 from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from src.instrumentation import STAGES
+from src.run_log import has_records, latest_records
+
+
+# USD list prices per provider and stage, applied to the calls each
+# provider made in a stage as recorded in the trace. Offline stand-ins
+# and replayed cassettes are free, and local backends make no API calls.
+# Update when provider pricing changes.
+PRICES = {
+    "cohere": {
+        "embed_documents": {"per_million_tokens": 0.10},
+        "embed_query": {"per_million_tokens": 0.10},
+        "rerank": {"per_thousand_calls": 2.00},
+    },
+    "openai": {
+        "query_llm_boundary": {"per_million_tokens": 0.50},
+    },
+    "fake": {},
+    "cassette": {},
+    "local": {},
+}
+
+
+def stage_cost(stage: str, providers: Dict[str, Dict[str, float]]) -> float:
+    """
+    Cost of one stage from its per-provider counters in a trace.
+    """
+    cost = 0.0
+    for provider, counters in providers.items():
+        price = PRICES.get(provider, {}).get(stage, {})
+        cost += (
+            counters.get("input_tokens", 0) * price.get("per_million_tokens", 0.0) / 1e6
+            + counters.get("api_calls", 0) * price.get("per_thousand_calls", 0.0) / 1e3
+        )
+    return cost
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "mean": 0.0}
+    p50, p95 = np.percentile(values, [50, 95])
+    return {"p50": float(p50), "p95": float(p95), "mean": float(np.mean(values))}
 
 
 # Cost analysis
 def estimate_costs():
     """
-    Rough cost comparison between baseline and query-fitted pipelines.
+    Latency and cost per query for each pipeline, from the traces in
+    the run records.
+
+    Batch runs split shared stages (chunking, indexing) evenly over
+    their queries, so their rows are amortized costs.
     """
 
-    baseline_path = Path("results/baseline/metrics.json")
-    fitted_path = Path("results/querry_fitted/metrics.json")
+    pipelines = {
+        "baseline": Path("results/baseline"),
+        "query_fitted": Path("results/query_fitted"),
+    }
 
-    if not baseline_path.exists() or not fitted_path.exists():
-        return
+    summary = {}
 
-    with open(baseline_path) as f:
-        baseline_metrics = json.load(f)
+    for pipeline_name, base_dir in pipelines.items():
+        if not has_records(base_dir):
+            print(f"[SKIP] {pipeline_name}: no run records found")
+            continue
 
-    with open(fitted_path) as f:
-        fitted_metrics = json.load(f)
+        wall: List[float] = []
+        cost: List[float] = []
+        peak_mb: List[float] = []
+        num_chunks: List[int] = []
+        stages: Dict[str, Dict[str, List[float]]] = {}
 
-    summary = {
-        "baseline": {},
-        "querry_fitted": {},
-    }
+        # Latest run only, so repeated runs are not pooled
+        for record in latest_records(base_dir):
+            trace = record.get("trace")
+            if trace is None:
+                continue
 
-    for k, metrics in baseline_metrics.items():
-        summary["baseline"][k] = {
-            "num_chunks": metrics.get("num_chunks", 0),
-            "recall": metrics.get("recall", 0.0),
-        }
+            wall.append(trace["wall_seconds"])
+            num_chunks.append(record.get("num_chunks", 0))
+            if trace.get("peak_rss_mb") is not None:
+                peak_mb.append(trace["peak_rss_mb"])
 
-    for k, metrics in fitted_metrics.items():
-        summary["querry_fitted"][k] = {
-            "num_chunks": metrics.get("num_chunks", 0),
-            "recall": metrics.get("recall", 0.0),
+            record_cost = 0.0
+            for stage, counters in trace["stages"].items():
+                rows = stages.setdefault(stage, {
+                    "seconds": [], "api_calls": [], "input_tokens": [], "retries": [], "cost": [],
+                })
+                # Traces without per-provider counters are not priced
+                stage_usd = stage_cost(stage, trace.get("providers", {}).get(stage, {}))
+                record_cost += stage_usd
+                rows["cost"].append(stage_usd)
+                for name in ("seconds", "api_calls", "input_tokens", "retries"):
+                    rows[name].append(counters.get(name, 0))
+            cost.append(record_cost)
+
+        if not wall:
+            print(f"[SKIP] {pipeline_name}: no traced records")
+            continue
+
+        # Known stages in pipeline order, then any others
+        order = [s for s in STAGES if s in stages] + sorted(set(stages) - set(STAGES))
+
+        summary[pipeline_name] = {
+            "num_queries": len(wall),
+            "num_chunks": float(np.mean(num_chunks)),
+            "wall_seconds": _percentiles(wall),
+            "cost_usd": _percentiles(cost),
+            "peak_rss_mb": max(peak_mb) if peak_mb else None,
+            "stages": {
+                stage: {
+                    "seconds": _percentiles(stages[stage]["seconds"]),
+                    "cost_usd": _percentiles(stages[stage]["cost"]),
+                    "api_calls": float(np.mean(stages[stage]["api_calls"])),
+                    "input_tokens": float(np.mean(stages[stage]["input_tokens"])),
+                    "retries": float(np.mean(stages[stage]["retries"])),
+                }
+                for stage in order
+            },
         }
 
     output_path = Path("results/cost_summary.json")
     with open(output_path, "w") as f:
         json.dump(summary, f, indent=2)
 
+    for pipeline_name, row in summary.items():
+        print(
+            f"{pipeline_name}: {row['num_queries']} queries, "
+            f"p50 {row['wall_seconds']['p50']:.3f}s p95 {row['wall_seconds']['p95']:.3f}s, "
+            f"p50 ${row['cost_usd']['p50']:.5f} p95 ${row['cost_usd']['p95']:.5f} per query"
+        )
+        for stage, stage_row in row["stages"].items():
+            print(
+                f"  {stage:20s} p50 {stage_row['seconds']['p50']:.4f}s "
+                f"p95 {stage_row['seconds']['p95']:.4f}s  "
+                f"calls {stage_row['api_calls']:.2f}  tokens {stage_row['input_tokens']:.0f}  "
+                f"${stage_row['cost_usd']['mean']:.5f}"
+            )
+
     print(f"Cost summary written to {output_path}")
 
 
 if __name__ == "__main__":
-    estimate_costs()
\ No newline at end of file
+    estimate_costs()
@@ -0,0 +1,333 @@
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.run_log import has_records, latest_records
+
+
+KEYS = ("retrieved_chunk_ids", "reranked_chunk_ids")
+
+# Gold id for records without one; never matches a chunk id or padding
+_NO_GOLD = -2
+
+
+# Rank matrices
+def rank_matrix(records: Sequence[Dict], key: str, depth: Optional[int] = None) -> np.ndarray:
+    """
+    (n_queries, depth) matrix of the ids under key, padded with -1.
+    """
+    lists = [record.get(key) or [] for record in records]
+    lengths = np.fromiter((len(ids) for ids in lists), dtype="int64", count=len(lists))
+    depth = int(lengths.max(initial=0)) if depth is None else depth
+
+    matrix = np.full((len(lists), depth), -1, dtype="int64")
+    lengths = np.minimum(lengths, depth)
+    flat = np.fromiter(
+        (i for ids in lists for i in ids[:depth]),
+        dtype="int64",
+        count=int(lengths.sum()),
+    )
+    matrix[np.arange(depth)[None, :] < lengths[:, None]] = flat
+    return matrix
+
+
+def gold_ids(records: Sequence[Dict]) -> np.ndarray:
+    return np.fromiter(
+        (_NO_GOLD if r.get("gold_chunk_id") is None else r["gold_chunk_id"] for r in records),
+        dtype="int64",
+        count=len(records),
+    )
+
+
+def gold_positions(ranks: np.ndarray, gold: np.ndarray) -> np.ndarray:
+    """
+    0-based rank of each query's gold id, or -1 when it is missing.
+    """
+    if ranks.shape[1] == 0:
+        return np.full(len(ranks), -1)
+    matches = ranks == gold[:, None]
+    found = matches.any(axis=1)
+    return np.where(found, matches.argmax(axis=1), -1)
+
+
+# Metrics from gold positions
+def _metric_table(depth: int, ks: Sequence[int]) -> Tuple[List[str], np.ndarray]:
+    """
+    Value of every metric for each possible gold position.
+
+    Rows are positions 0..depth-1 plus a final "missing" row, so a
+    metric's mean over queries is a dot product with position counts.
+    """
+    position = np.arange(depth + 1)
+    present = position < depth
+
+    names = ["mrr"]
+    columns = [np.where(present, 1.0 / (position + 1), 0.0)]
+
+    for k in ks:
+        hit = present & (position < k)
+        names.append(f"recall@{k}")
+        columns.append(hit.astype("float64"))
+        # Single relevant item, so the ideal DCG is 1
+        names.append(f"ndcg@{k}")
+        columns.append(np.where(hit, 1.0 / np.log2(position + 2), 0.0))
+
+    return names, np.stack(columns, axis=1)
+
+
+def evaluate_counts(
+    counts: np.ndarray,
+    ks: Sequence[int],
+    n_boot: int = 1000,
+    alpha: float = 0.05,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Mean MRR, recall@k and nDCG@k with bootstrap confidence intervals,
+    from a histogram of gold positions.
+
+    counts[p] is the number of queries with the gold id at rank p and
+    the last entry counts queries where it is missing. Every metric
+    depends only on the gold position, so resampling queries with
+    replacement is the same as drawing position counts from a
+    multinomial over this histogram. Each bootstrap replicate then
+    costs O(depth), not O(n_queries).
+    """
+    counts = np.asarray(counts, dtype="float64")
+    names, table = _metric_table(len(counts) - 1, ks)
+    n = int(counts.sum())
+
+    if n == 0:
+        return {
+            name: {"mean": 0.0, "low": 0.0, "high": 0.0}
+            for name in names
+        }
+
+    means = counts @ table / n
+
+    if n_boot > 0:
+        rng = np.random.default_rng(seed)
+        replicates = rng.multinomial(n, counts / n, size=n_boot) @ table / n
+        low, high = np.quantile(replicates, [alpha / 2, 1 - alpha / 2], axis=0)
+    else:
+        low = high = means
+
+    return {
+        name: {"mean": float(means[j]), "low": float(low[j]), "high": float(high[j])}
+        for j, name in enumerate(names)
+    }
+
+
+def position_counts(positions: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Histogram of gold positions for evaluate_counts.
+    """
+    bins = np.where(positions >= 0, np.minimum(positions, depth), depth)
+    return np.bincount(bins, minlength=depth + 1)
+
+
+def evaluate_positions(
+    positions: np.ndarray,
+    depth: int,
+    ks: Sequence[int],
+    n_boot: int = 1000,
+    alpha: float = 0.05,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """
+    evaluate_counts for an array of 0-based gold positions (-1 when missing).
+    """
+    return evaluate_counts(
+        position_counts(positions, depth), ks, n_boot=n_boot, alpha=alpha, seed=seed
+    )
+
+
+# Evaluation
+def evaluate(
+    records: Sequence[Dict],
+    ks: Sequence[int],
+    keys: Sequence[str] = KEYS,
+    n_boot: int = 1000,
+    alpha: float = 0.05,
+    seed: int = 0,
+) -> Dict[str, Dict]:
+    """
+    Metrics for each ranking key over all records that have a gold id.
+
+    For the retrieved key, recall@k is also the reranking ceiling at k.
+    """
+    gold = gold_ids(records)
+    valid = gold != _NO_GOLD
+    results: Dict[str, Dict] = {}
+
+    for key in keys:
+        ranks = rank_matrix(records, key)
+        positions = gold_positions(ranks[valid], gold[valid])
+        results[key] = {
+            "num_queries": int(valid.sum()),
+            "metrics": evaluate_positions(
+                positions, ranks.shape[1], ks, n_boot=n_boot, alpha=alpha, seed=seed
+            ),
+        }
+
+    return results
+
+
+def recall_curve(records: Sequence[Dict], ks: Sequence[int], key: str) -> Dict[int, float]:
+    """
+    Recall@k for every k without bootstrap, counting only records with a gold id.
+    """
+    gold = gold_ids(records)
+    valid = gold != _NO_GOLD
+    if not valid.any():
+        return {k: 0.0 for k in ks}
+
+    positions = gold_positions(rank_matrix(records, key)[valid], gold[valid])
+    found = positions[positions >= 0]
+    return {k: float((found < k).sum() / len(positions)) for k in ks}
+
+
+# Streaming evaluation
+class _PositionHistogram:
+    """
+    Running gold-position counts for one ranking key.
+    """
+
+    def __init__(self):
+        self.found = np.zeros(0, dtype="int64")
+        self.missing = 0
+        self.depth = 0
+
+    def add(self, positions: np.ndarray, depth: int) -> None:
+        found = positions[positions >= 0]
+        self.missing += len(positions) - len(found)
+        self.depth = max(self.depth, depth)
+
+        batch = np.bincount(found, minlength=len(self.found))
+        batch[:len(self.found)] += self.found
+        self.found = batch
+
+    def counts(self) -> np.ndarray:
+        counts = np.zeros(self.depth + 1, dtype="int64")
+        counts[:len(self.found)] = self.found
+        counts[self.depth] = self.missing
+        return counts
+
+
+def evaluate_stream(
+    records: Iterable[Dict],
+    ks: Sequence[int],
+    keys: Sequence[str] = KEYS,
+    group_by: Optional[Callable[[Dict], Hashable]] = None,
+    batch_size: int = 10_000,
+    n_boot: int = 1000,
+    alpha: float = 0.05,
+    seed: int = 0,
+) -> Dict[Hashable, Dict]:
+    """
+    evaluate over a stream of records, in constant memory.
+
+    Records are consumed batch_size at a time and reduced to gold
+    position histograms, which is all the metrics need, so a sweep
+    never has to fit in memory. group_by maps a record to its group
+    (default: one group, None). Each group also reports its record
+    count and mean "retrieval_seconds" where recorded.
+    """
+    group_by = group_by or (lambda record: None)
+    groups: Dict[Hashable, Dict] = {}
+
+    def flush(group: Hashable, batch: List[Dict]) -> None:
+        if not batch:
+            return
+        state = groups[group]
+        gold = gold_ids(batch)
+        valid = gold != _NO_GOLD
+        state["num_queries"] += int(valid.sum())
+
+        for key in keys:
+            ranks = rank_matrix(batch, key)
+            state["histograms"][key].add(gold_positions(ranks[valid], gold[valid]), ranks.shape[1])
+
+        batch.clear()
+
+    for record in records:
+        group = group_by(record)
+        if group not in groups:
+            groups[group] = {
+                "batch": [],
+                "num_records": 0,
+                "num_queries": 0,
+                "latency": [0.0, 0],
+                "histograms": {key: _PositionHistogram() for key in keys},
+            }
+
+        state = groups[group]
+        state["num_records"] += 1
+        if record.get("retrieval_seconds") is not None:
+            state["latency"][0] += record["retrieval_seconds"]
+            state["latency"][1] += 1
+
+        state["batch"].append(record)
+        if len(state["batch"]) >= batch_size:
+            flush(group, state["batch"])
+
+    results: Dict[Hashable, Dict] = {}
+
+    for group, state in groups.items():
+        flush(group, state["batch"])
+        total, timed = state["latency"]
+        results[group] = {
+            "num_records": state["num_records"],
+            "retrieval_seconds": total / timed if timed else None,
+            "keys": {
+                key: {
+                    "num_queries": state["num_queries"],
+                    "metrics": evaluate_counts(
+                        state["histograms"][key].counts(), ks,
+                        n_boot=n_boot, alpha=alpha, seed=seed,
+                    ),
+                }
+                for key in keys
+            },
+        }
+
+    return results
+
+
+if __name__ == "__main__":
+
+    # Configuration
+    KS = [1, 2, 3, 5, 10, 15, 20, 30, 50, 100]
+    N_BOOT = 1000
+
+    PIPELINES = {
+        "baseline": Path("results/baseline"),
+        "query_fitted": Path("results/query_fitted"),
+    }
+
+    for pipeline_name, base_dir in PIPELINES.items():
+
+        output_path = base_dir / "evaluation.json"
+
+        if not has_records(base_dir):
+            print(f"[SKIP] {pipeline_name}: no run records found")
+            continue
+
+        start = time.perf_counter()
+        # Latest run only, so repeated runs are not pooled
+        summary = evaluate_stream(latest_records(base_dir), KS, n_boot=N_BOOT).get(None)
+        if summary is None:
+            print(f"[SKIP] {pipeline_name}: latest run has no records")
+            continue
+        seconds = time.perf_counter() - start
+
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(summary["keys"], f, indent=2)
+
+        print(
+            f"{pipeline_name}: {summary['num_records']} records evaluated in "
+            f"{seconds * 1000:.1f} ms, written to {output_path}"
+        )
@@ -1,6 +1,8 @@
 import json
 from pathlib import Path
 
+from src.run_log import has_records, latest_records
+
 
 # Failure mode analysis
 def analyze_failure_modes():
@@ -11,24 +13,22 @@ def analyze_failure_modes():
     Reranking failure: gold chunk retrieved but ranked poorly after reranking.
     """
 
-    baseline_path = Path("results/baseline/result.json")
-    fitted_path = Path("results/querry_fitted/result.json")
+    pipelines = {
+        "baseline": Path("results/baseline"),
+        "query_fitted": Path("results/query_fitted"),
+    }
 
-    if not baseline_path.exists() or not fitted_path.exists():
+    if not all(has_records(base_dir) for base_dir in pipelines.values()):
         return
 
-    with open(baseline_path) as f:
-        baseline = json.load(f)
-
-    with open(fitted_path) as f:
-        fitted = json.load(f)
-
     failures = []
 
-    for pipeline_name, record in [
-        ("baseline", baseline),
-        ("querry_fitted", fitted),
-    ]:
+    for pipeline_name, record in (
+        (pipeline_name, record)
+        for pipeline_name, base_dir in pipelines.items()
+        # Latest run of each pipeline only
+        for record in latest_records(base_dir)
+    ):
         gold_id = record.get("gold_chunk_id")
 
         retrieved_ids = record.get("retrieved_chunk_ids", [])
@@ -41,6 +41,7 @@ def analyze_failure_modes():
         if gold_id not in retrieved_ids:
             failures.append({
                 "pipeline": pipeline_name,
+                "query_id": record.get("query_id"),
                 "failure_type": "retrieval_failure",
                 "reason": "gold chunk not retrieved",
             })
@@ -52,6 +53,7 @@ def analyze_failure_modes():
         if gold_id not in reranked_ids:
             failures.append({
                 "pipeline": pipeline_name,
+                "query_id": record.get("query_id"),
                 "failure_type": "reranking_failure",
                 "reason": "gold chunk retrieved but lost during reranking",
                 "retrieval_rank": retrieval_rank,
@@ -64,6 +66,7 @@ def analyze_failure_modes():
         if reranked_rank > 0:
             failures.append({
                 "pipeline": pipeline_name,
+                "query_id": record.get("query_id"),
                 "failure_type": "reranking_failure",
                 "reason": "gold chunk retrieved but not ranked first",
                 "retrieval_rank": retrieval_rank,
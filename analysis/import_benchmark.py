@@ -0,0 +1,105 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+
+# Entry points whose cold start is tracked
+ENTRY_POINTS = [
+    "experiments.baseline_pipeline",
+    "experiments.query_fitted_pipeline",
+    "experiments.batch_runner",
+    "experiments.ingest_corpus",
+] + sorted(f"analysis.{p.stem}" for p in Path("analysis").glob("*.py"))
+
+
+def import_time(module: str, repeats: int = 5) -> Dict:
+    """
+    Cold-start cost of importing module in a fresh interpreter.
+
+    Reports the median wall time over repeats, the baseline cost of
+    starting Python itself, and the slowest top-level packages from
+    python -X importtime.
+    """
+    def run(args: List[str]) -> subprocess.CompletedProcess:
+        return subprocess.run(
+            [sys.executable, *args], capture_output=True, text=True, check=True
+        )
+
+    def median_seconds(args: List[str]) -> float:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run(args)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    interpreter = median_seconds(["-c", "pass"])
+    seconds = median_seconds(["-c", f"import {module}"])
+
+    # Cumulative microseconds of each top-level package
+    packages: Dict[str, int] = {}
+    for line in run(["-X", "importtime", "-c", f"import {module}"]).stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith(" ") or name.startswith("  "):
+            continue
+        packages[name.strip()] = int(cumulative)
+
+    slowest = sorted(packages.items(), key=lambda item: -item[1])[:5]
+
+    return {
+        "module": module,
+        "seconds": seconds,
+        "import_seconds": max(0.0, seconds - interpreter),
+        "slowest_packages": {name: us / 1e6 for name, us in slowest},
+    }
+
+
+if __name__ == "__main__":
+
+    # Configuration
+    REPEATS = 5
+    # Fail when an entry point gets this much slower than the saved run
+    TOLERANCE = 1.5
+
+    output_path = Path("results/import_benchmark.json")
+
+    previous = {}
+    if output_path.exists():
+        with open(output_path, "r", encoding="utf-8") as f:
+            previous = {row["module"]: row for row in json.load(f)}
+
+    rows = []
+    regressions = []
+
+    for module in ENTRY_POINTS:
+        try:
+            row = import_time(module, repeats=REPEATS)
+        except subprocess.CalledProcessError as exc:
+            print(f"[SKIP] {module}: {exc.stderr.strip().splitlines()[-1]}")
+            continue
+        rows.append(row)
+
+        before = previous.get(module)
+        # Ignore noise below 50 ms
+        if before and row["import_seconds"] > max(
+            TOLERANCE * before["import_seconds"], before["import_seconds"] + 0.05
+        ):
+            regressions.append(module)
+
+        print(f"{module:45s} {row['import_seconds'] * 1000:8.1f} ms")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+
+    print(f"Import benchmark written to {output_path}")
+
+    if regressions:
+        print(f"Startup regressions: {', '.join(regressions)}")
+        sys.exit(1)
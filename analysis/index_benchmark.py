@@ -0,0 +1,131 @@
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import faiss
+
+from src.retrieval import build_faiss_index, retrieve_top_k_batch, set_search_params
+
+
+def recall_against_exact(
+    exact_ids: np.ndarray,
+    approx_ids: np.ndarray,
+    k: int,
+) -> float:
+    """
+    Fraction of the exact top-k neighbours that the approximate index also returns.
+    """
+    hits = 0
+    for exact_row, approx_row in zip(exact_ids[:, :k], approx_ids[:, :k]):
+        hits += len(np.intersect1d(exact_row, approx_row))
+    return hits / exact_ids[:, :k].size
+
+
+def index_bytes(index: faiss.Index) -> int:
+    """
+    Serialized index size, a close proxy for its resident memory.
+    """
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def benchmark_index(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    configs: List[Dict],
+) -> List[Dict]:
+    """
+    Measure recall@k against the exact index, QPS and index size
+    for each build config. A config may carry nprobe / ef_search
+    lists to sweep query-time operating points on one build, and a
+    rescore_factor to re-rank candidates against the float32 vectors.
+    """
+    exact = build_faiss_index(embeddings, index_type="flat")
+    exact_ids, _ = retrieve_top_k_batch(exact, queries, k)
+
+    rows = []
+
+    for config in configs:
+        config = dict(config)
+        nprobes = config.pop("nprobe", [None])
+        ef_searches = config.pop("ef_search", [None])
+        rescore_factor = config.pop("rescore_factor", None)
+
+        start = time.perf_counter()
+        index = build_faiss_index(embeddings, **config)
+        build_seconds = time.perf_counter() - start
+        size = index_bytes(index)
+
+        for nprobe in nprobes:
+            for ef_search in ef_searches:
+                set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+                start = time.perf_counter()
+                if rescore_factor is None:
+                    ids, _ = retrieve_top_k_batch(index, queries, k)
+                else:
+                    ids, _ = retrieve_top_k_batch(
+                        index,
+                        queries,
+                        k,
+                        rescore_embeddings=embeddings,
+                        rescore_factor=rescore_factor,
+                    )
+                search_seconds = time.perf_counter() - start
+
+                rows.append({
+                    **config,
+                    "nprobe": nprobe,
+                    "ef_search": ef_search,
+                    "rescore_factor": rescore_factor,
+                    "recall_at_k": recall_against_exact(exact_ids, ids, k),
+                    "qps": len(queries) / search_seconds if search_seconds > 0 else float("inf"),
+                    "build_seconds": build_seconds,
+                    "index_bytes": size,
+                    "bytes_per_vector": size / len(embeddings),
+                })
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    # Configuration
+    K = 10
+    NUM_QUERIES = 1000
+    SYNTHETIC_SIZE = 100_000
+
+    embeddings_path = Path("data/processed/baseline/chunk_embeddings.npy")
+    output_path = Path("results/index_benchmark.json")
+
+    embeddings = np.load(embeddings_path).astype("float32")
+
+    # The lecture corpus is tiny, so pad it with noisy copies to get
+    # a corpus large enough for approximate indexes to matter
+    rng = np.random.default_rng(0)
+    if len(embeddings) < SYNTHETIC_SIZE:
+        base = embeddings[rng.integers(0, len(embeddings), SYNTHETIC_SIZE)]
+        embeddings = base + 0.1 * rng.standard_normal(base.shape).astype("float32")
+
+    queries = embeddings[rng.integers(0, len(embeddings), NUM_QUERIES)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype("float32")
+
+    CONFIGS = [
+        {"index_type": "flat"},
+        {"index_type": "sq_fp16"},
+        {"index_type": "sq8"},
+        {"index_type": "sq8", "rescore_factor": 4},
+        {"index_type": "hnsw", "ef_search": [16, 64, 256]},
+        {"index_type": "ivf_flat", "nprobe": [1, 8, 32]},
+        {"index_type": "ivf_pq", "nprobe": [1, 8, 32]},
+    ]
+
+    rows = benchmark_index(embeddings, queries, K, CONFIGS)
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+
+    print(f"Index benchmark written to {output_path}")
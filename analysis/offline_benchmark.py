@@ -0,0 +1,287 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.artifacts import ArtifactStore
+from src.instrumentation import start_trace
+from src.offline_providers import (
+    Cassette,
+    CassetteChatClient,
+    CassetteEmbedder,
+    CassetteReranker,
+    FakeChatClient,
+    HashEmbedder,
+    ScriptedReranker,
+)
+from src.chunking.query_fitted import BOUNDARY_MODEL
+
+import experiments.baseline_pipeline as baseline
+import experiments.query_fitted_pipeline as query_fitted
+
+
+# Synthetic documents
+def synthetic_document(
+    path: Path,
+    size_bytes: int,
+    num_topics: int = 20,
+    words_per_topic: int = 200,
+    seed: int = 0,
+) -> Path:
+    """
+    Write a deterministic document of about size_bytes to path.
+
+    Paragraphs draw most of their words from one topic vocabulary and
+    the topic changes every few paragraphs, so there are real topic
+    shifts for the chunkers (and the fake boundary LLM) to find.
+    """
+    if path.exists() and path.stat().st_size >= size_bytes:
+        return path
+
+    rng = np.random.default_rng(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    vocabulary = [
+        ["".join(rng.choice(letters, rng.integers(3, 10))) for _ in range(words_per_topic)]
+        for _ in range(num_topics + 1)
+    ]
+    common = vocabulary.pop()
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+
+    with open(path, "w", encoding="utf-8") as f:
+        while written < size_bytes:
+            topic = vocabulary[rng.integers(num_topics)]
+            for _ in range(rng.integers(3, 9)):
+                sentences = []
+                for _ in range(rng.integers(3, 7)):
+                    n = rng.integers(8, 16)
+                    from_topic = rng.random(n) < 0.7
+                    words = [
+                        topic[rng.integers(words_per_topic)] if t else common[rng.integers(words_per_topic)]
+                        for t in from_topic
+                    ]
+                    sentences.append(" ".join(words).capitalize() + ".")
+                paragraph = " ".join(sentences) + "\n\n"
+                f.write(paragraph)
+                written += len(paragraph)
+
+    return path
+
+
+def synthetic_queries(path: Path, num_queries: int, seed: int = 0) -> List[str]:
+    """
+    Queries made of words from random paragraphs of the document.
+    """
+    rng = np.random.default_rng(seed)
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(1 << 20).split("\n\n")[:-1]
+
+    queries = []
+    for i in rng.choice(len(head), num_queries, replace=len(head) < num_queries):
+        words = head[i].split()
+        start = rng.integers(max(1, len(words) - 12))
+        queries.append(" ".join(words[start:start + 12]).strip(".").lower())
+    return queries
+
+
+# Providers
+def offline_providers(
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    cassette: Optional[Cassette] = None,
+) -> Dict:
+    """
+    Embedder, reranker and chat client for a benchmark run.
+
+    Without a cassette these are the local fakes. A replay cassette
+    serves recorded responses; a record cassette wraps the real
+    providers (API keys required) and stores their responses.
+    """
+    if cassette is None:
+        return {
+            "embedder": HashEmbedder(latency=latency, error_rate=error_rate),
+            "reranker": ScriptedReranker(latency=latency, error_rate=error_rate),
+            "chat": FakeChatClient(latency=latency, error_rate=error_rate),
+        }
+
+    if cassette.mode == "replay":
+        return {
+            "embedder": CassetteEmbedder(cassette, model=baseline.EMBEDDER.model),
+            "reranker": CassetteReranker(cassette, model=baseline.RERANKER.model),
+            "chat": CassetteChatClient(cassette),
+        }
+
+    from openai import OpenAI
+
+    return {
+        "embedder": CassetteEmbedder(cassette, inner=baseline.EMBEDDER),
+        "reranker": CassetteReranker(cassette, inner=baseline.RERANKER),
+        "chat": CassetteChatClient(cassette, inner=OpenAI()),
+    }
+
+
+def _use_providers(providers: Dict, store_dir: Path) -> None:
+    """
+    Point both pipelines at the providers and a fresh artifact store,
+    with every response cache off so each stage does its work.
+    """
+    for module in (baseline, query_fitted):
+        module.EMBEDDER = providers["embedder"]
+        module.RERANKER = providers["reranker"]
+        module.EMBEDDING_CACHE = None
+        module.RERANK_CACHE = None
+        module.ARTIFACT_STORE = ArtifactStore(store_dir)
+
+    query_fitted.LLM_CACHE = None
+    query_fitted.LLM_CLIENT = providers["chat"]
+    # Cassettes replay the real model's answers; fakes have their own name
+    query_fitted.LLM_MODEL = getattr(providers["chat"], "model", BOUNDARY_MODEL)
+
+
+# Benchmarks
+def benchmark_pipeline(
+    pipeline: str,
+    document_path: Path,
+    queries: List[str],
+    providers: Dict,
+) -> List[Dict]:
+    """
+    One traced run per query of one pipeline on one document.
+
+    The first run starts from an empty artifact store. Later runs
+    reuse what is stored when their chunking does not depend on the
+    query ("warm"), which always holds for the baseline. Rows carry
+    per-stage seconds and call counts from the trace.
+    """
+    size = document_path.stat().st_size
+    # Streaming keeps memory flat on large documents
+    stream = size > 10_000_000
+
+    rows = []
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        _use_providers(providers, Path(store_dir))
+
+        for i, query in enumerate(queries):
+            with start_trace() as trace:
+                if pipeline == "baseline":
+                    record = baseline.run_baseline_pipeline(
+                        document_path, query, embedder=providers["embedder"], stream=stream
+                    )
+                else:
+                    record = query_fitted.run_query_fitted_pipeline(
+                        document_path, query, embedder=providers["embedder"]
+                    )
+
+            traced = trace.as_dict()
+            rows.append({
+                "pipeline": pipeline,
+                "size_bytes": size,
+                "query": i,
+                "warm": record["startup"]["warm"],
+                "stream": stream if pipeline == "baseline" else False,
+                "num_chunks": record["num_chunks"],
+                "wall_seconds": traced["wall_seconds"],
+                "mb_per_second": size / 1e6 / traced["wall_seconds"],
+                "peak_rss_mb": traced["peak_rss_mb"],
+                "api_calls": sum(s["api_calls"] for s in traced["stages"].values()),
+                "retries": sum(s["retries"] for s in traced["stages"].values()),
+                "stages": {
+                    stage: {"seconds": s["seconds"], "count": s["count"], "api_calls": s["api_calls"]}
+                    for stage, s in traced["stages"].items()
+                },
+            })
+
+    return rows
+
+
+def _row_key(row: Dict) -> str:
+    return f"{row['pipeline']}/{row['size_bytes']}/{row['query']}"
+
+
+if __name__ == "__main__":
+
+    # Configuration
+    SIZES = [10_000, 100_000, 1_000_000, 10_000_000, 100_000_000]
+    # Past this, query-fitted chunking leaves one huge remainder chunk
+    # once max_llm_calls is spent, which is not a useful measurement
+    QUERY_FITTED_MAX_BYTES = 10_000_000
+    # At least 2: the first run on a document, then later ones
+    NUM_QUERIES = 3
+    # Fail when a run gets this much slower than the saved benchmark
+    TOLERANCE = 1.5
+
+    # Optional cap on document size in MB, e.g. 1 for a quick run
+    max_bytes = float(sys.argv[1]) * 1e6 if len(sys.argv) > 1 else float("inf")
+
+    # Injected provider latency (seconds per call) and transient error rate
+    latency = float(os.environ.get("BENCHMARK_LATENCY", "0"))
+    error_rate = float(os.environ.get("BENCHMARK_ERROR_RATE", "0"))
+
+    # BENCHMARK_CASSETTE=<path> replays recorded responses, or records
+    # them from the real providers with BENCHMARK_CASSETTE_MODE=record
+    cassette = None
+    if "BENCHMARK_CASSETTE" in os.environ:
+        cassette = Cassette(
+            Path(os.environ["BENCHMARK_CASSETTE"]),
+            mode=os.environ.get("BENCHMARK_CASSETTE_MODE", "replay"),
+        )
+
+    documents_dir = Path("data/benchmark")
+    output_path = Path("results/offline_benchmark.json")
+
+    previous = {}
+    if output_path.exists():
+        with open(output_path, "r", encoding="utf-8") as f:
+            previous = {_row_key(row): row for row in json.load(f)}
+
+    providers = offline_providers(latency=latency, error_rate=error_rate, cassette=cassette)
+
+    rows = []
+    regressions = []
+
+    for size in SIZES:
+        if size > max_bytes:
+            continue
+
+        document_path = synthetic_document(documents_dir / f"synthetic_{size}.txt", size)
+        queries = synthetic_queries(document_path, NUM_QUERIES)
+
+        pipelines = ["baseline"] + (["query_fitted"] if size <= QUERY_FITTED_MAX_BYTES else [])
+
+        for pipeline in pipelines:
+            for row in benchmark_pipeline(pipeline, document_path, queries, providers):
+                rows.append(row)
+
+                before = previous.get(_row_key(row))
+                # Ignore noise below 50 ms
+                if before and row["wall_seconds"] > max(
+                    TOLERANCE * before["wall_seconds"], before["wall_seconds"] + 0.05
+                ):
+                    regressions.append(_row_key(row))
+
+            first, later = rows[-NUM_QUERIES], rows[-NUM_QUERIES + 1:]
+            print(
+                f"{pipeline:13s} {size / 1e6:8.2f} MB  {first['num_chunks']:7d} chunks  "
+                f"first {first['wall_seconds']:7.3f}s ({first['mb_per_second']:6.2f} MB/s)  "
+                f"later {np.median([r['wall_seconds'] for r in later]):7.3f}s"
+            )
+
+    if cassette is not None:
+        cassette.save()
+        print(f"Cassette: {cassette.stats()}")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2)
+
+    print(f"Offline benchmark written to {output_path}")
+
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
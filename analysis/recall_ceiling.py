@@ -2,6 +2,9 @@ from typing import List, Dict
 import json
 from pathlib import Path
 
+from analysis.evaluation import evaluate_stream, recall_curve
+from src.run_log import has_records, latest_records
+
 
 def recall_ceiling(records: List[Dict], k: int, key: str) -> float:
     """
@@ -10,24 +13,7 @@ def recall_ceiling(records: List[Dict], k: int, key: str) -> float:
     Must be computed over retrieved IDs since reranking
     cannot recover missing chunks.
     """
-    if not records:
-        return 0.0
-
-    hits = 0
-    valid = 0
-
-    for record in records:
-        gold_id = record.get("gold_chunk_id")
-        if gold_id is None:
-            continue
-
-        ids = record.get(key, [])
-        valid += 1
-
-        if gold_id in ids[:k]:
-            hits += 1
-
-    return hits / valid if valid > 0 else 0.0
+    return recall_curve(records, [k], key)[k]
 
 
 if __name__ == "__main__":
@@ -38,40 +24,59 @@ if __name__ == "__main__":
 
     PIPELINES = {
         "baseline": Path("results/baseline"),
-        "querry_fitted": Path("results/query_fitted"),
+        "query_fitted": Path("results/query_fitted"),
     }
 
     for pipeline_name, base_dir in PIPELINES.items():
 
-        result_path = base_dir / "result.json"
         output_path = base_dir / "recall_curve.json"
 
-        if not result_path.exists():
-            print(f"[SKIP] {pipeline_name}: result.json not found")
+        if not has_records(base_dir):
+            print(f"[SKIP] {pipeline_name}: no run records found")
             continue
 
-        # Load records
-        with open(result_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Allow both single-record and list-of-records formats
-        if isinstance(data, dict):
-            records = [data]
-        else:
-            records = data
+        # Streamed from the latest run; depths are tallied on the way
+        depths = {"records": 0, "documents": 0}
+
+        def tally(records):
+            for record in records:
+                if "rerank_candidate_ids" in record:
+                    depths["records"] += 1
+                    depths["documents"] += record.get("rerank_depth", 0)
+                yield record
+
+        summary = evaluate_stream(
+            tally(latest_records(base_dir)),
+            KS,
+            keys=(ID_KEY, "rerank_candidate_ids"),
+            n_boot=0,
+        ).get(None)
+
+        if summary is None:
+            print(f"[SKIP] {pipeline_name}: latest run has no records")
+            continue
 
         # Compute recall ceiling curve
-        curve = {}
-
-        for k in KS:
-            curve[k] = recall_ceiling(
-                records=records,
-                k=k,
-                key=ID_KEY,
-            )
+        metrics = summary["keys"][ID_KEY]["metrics"]
+        curve = {k: metrics[f"recall@{k}"]["mean"] for k in KS}
 
         # Save results
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(curve, f, indent=2)
 
-        print(f"{pipeline_name} recall ceiling written to {output_path}")
\ No newline at end of file
+        print(f"{pipeline_name} recall ceiling written to {output_path}")
+
+        # Ceiling over the candidates actually sent to the reranker
+        if depths["records"]:
+            candidates = summary["keys"]["rerank_candidate_ids"]["metrics"]
+            candidate_curve = {
+                "mean_rerank_depth": depths["documents"] / depths["records"],
+                "rerank_documents": depths["documents"],
+                "curve": {k: candidates[f"recall@{k}"]["mean"] for k in KS},
+            }
+
+            candidate_path = base_dir / "rerank_candidate_curve.json"
+            with open(candidate_path, "w", encoding="utf-8") as f:
+                json.dump(candidate_curve, f, indent=2)
+
+            print(f"{pipeline_name} rerank candidate ceiling written to {candidate_path}")
@@ -0,0 +1,128 @@
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from analysis.recall_ceiling import recall_ceiling
+from src.run_log import has_records, latest_records
+from src.rerank_depth import CALIBRATION_NAME, depth_summary, fit_depth_calibration, rerank_depths
+
+# Record fields used by the trade-off
+RECORD_FIELDS = ("retrieved_scores", "retrieved_chunk_ids", "gold_chunk_id")
+
+
+def score_matrix(records: List[Dict], depth: int) -> np.ndarray:
+    """
+    Retrieval scores of each record, padded with -inf to depth.
+    """
+    scores = np.full((len(records), depth), -np.inf)
+    for row, record in enumerate(records):
+        values = (record.get("retrieved_scores") or [])[:depth]
+        scores[row, :len(values)] = values
+    return scores
+
+
+def evaluate_policy(
+    records: List[Dict],
+    scores: np.ndarray,
+    ks: List[int],
+    policy: Dict,
+) -> Dict:
+    """
+    Rerank documents sent and recall ceiling when only each record's
+    adaptive depth of candidates would be reranked.
+    """
+    max_k = scores.shape[1]
+    depths = rerank_depths(scores, max_k=max_k, **policy)
+
+    truncated = [
+        {**record, "candidate_ids": record["retrieved_chunk_ids"][:depth]}
+        for record, depth in zip(records, depths)
+    ]
+
+    return {
+        "policy": {k: v.tolist() if isinstance(v, np.ndarray) else v for k, v in policy.items()},
+        **depth_summary(depths, max_k),
+        "ceiling": {
+            k: recall_ceiling(truncated, k=k, key="candidate_ids") for k in ks
+        },
+    }
+
+
+if __name__ == "__main__":
+
+    # Configuration
+    KS = [1, 5, 10, 20]
+    MIN_K = 5
+
+    POLICIES = [
+        {"policy": "fixed"},
+        {"policy": "gap", "min_gap": 0.01},
+        {"policy": "gap", "min_gap": 0.02},
+        {"policy": "gap", "min_gap": 0.05},
+        {"policy": "relative", "ratio": 0.8},
+        {"policy": "relative", "ratio": 0.9},
+        {"policy": "relative", "ratio": 0.95},
+    ]
+
+    PIPELINES = {
+        "baseline": Path("results/baseline"),
+        "query_fitted": Path("results/query_fitted"),
+    }
+
+    for pipeline_name, base_dir in PIPELINES.items():
+
+        output_path = base_dir / "rerank_depth.json"
+
+        if not has_records(base_dir):
+            print(f"[SKIP] {pipeline_name}: no run records found")
+            continue
+
+        # Every policy needs all scores at once, so only the fields it
+        # reads are kept from the streamed records of the latest run
+        records = []
+        for record in latest_records(base_dir):
+            if record.get("retrieved_scores"):
+                records.append({name: record.get(name) for name in RECORD_FIELDS})
+
+        if not records:
+            print(f"[SKIP] {pipeline_name}: no retrieval scores recorded")
+            continue
+
+        depth = max(len(r["retrieved_scores"]) for r in records)
+        scores = score_matrix(records, depth)
+
+        policies = [{"min_k": MIN_K, **p} for p in POLICIES]
+
+        # A calibration can only be fitted where gold chunks are known
+        relevant = np.zeros_like(scores, dtype=bool)
+        for row, record in enumerate(records):
+            ids = record["retrieved_chunk_ids"][:depth]
+            if record.get("gold_chunk_id") in ids:
+                relevant[row, ids.index(record["gold_chunk_id"])] = True
+
+        if relevant.any():
+            calibration = fit_depth_calibration(scores, relevant)
+            # Loaded by the pipeline when RERANK_DEPTH_POLICY=calibrated
+            np.save(base_dir / CALIBRATION_NAME, calibration)
+            for p in (0.01, 0.05, 0.1):
+                policies.append({
+                    "policy": "calibrated",
+                    "min_k": MIN_K,
+                    "calibration": calibration,
+                    "min_probability": p,
+                })
+
+        rows = [evaluate_policy(records, scores, KS, policy) for policy in policies]
+
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+        print(f"{pipeline_name} rerank depth trade-off written to {output_path}")
+        for row in rows:
+            print(
+                f"  {json.dumps({k: v for k, v in row['policy'].items() if k != 'calibration'}):55s}"
+                f" docs {row['documents_sent']:5d} ({row['fraction_of_fixed']:.0%})"
+                f"  ceiling@{KS[-1]} {row['ceiling'][KS[-1]]:.2f}"
+            )
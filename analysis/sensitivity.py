@@ -1,5 +1,33 @@
 import json
+import os
+import sys
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from analysis.evaluation import evaluate_positions
+from src.artifacts import hash_file
+from src.chunk_store import ChunkStore
+from src.embedding import Embedder, embed_documents, embed_queries, get_embedder
+from src.retrieval import build_faiss_index
+from src.rerank import Reranker, get_reranker, rerank_many
+from src.rerank_depth import rerank_depths
+from src.sparse import BM25Index, hybrid_retrieve
+from src.stage_graph import Stage, StageGraph, grid_points, reuse_summary, sweep
+from src.chunking.semantic import embedding_similarity_splitter
+from src.chunking.static import static_text_splitter
+
+import experiments.baseline_pipeline as baseline
+import experiments.query_fitted_pipeline as query_fitted
+
+# Stage outputs are reused across sweeps when their key is unchanged
+STAGE_CACHE_DIR = Path("data/cache/stages")
+
+# A chunk counts as the gold chunk when it covers at least this much
+# of the gold span, so chunkings with different boundaries compare
+GOLD_COVERAGE = 0.5
 
 
 # Sensitivity analysis
@@ -9,7 +37,7 @@ def run_sensitivity_analysis():
     """
 
     baseline_path = Path("results/baseline/metrics.json")
-    fitted_path = Path("results/querry_fitted/metrics.json")
+    fitted_path = Path("results/query_fitted/metrics.json")
 
     if not baseline_path.exists() or not fitted_path.exists():
         return
@@ -25,8 +53,8 @@ def run_sensitivity_analysis():
     deltas = {}
 
     for k in ks:
-        baseline_recall = baseline_metrics[k]["recall"]
-        fitted_recall = fitted_metrics[k]["recall"]
+        baseline_recall = baseline_metrics[k]["reranked_recall"]
+        fitted_recall = fitted_metrics[k]["reranked_recall"]
 
         deltas[k] = fitted_recall - baseline_recall
 
@@ -37,5 +65,326 @@ def run_sensitivity_analysis():
     print(f"Sensitivity results written to {output_path}")
 
 
+# Pipeline stages
+@lru_cache(maxsize=None)
+def _embedder(backend: str, model: str) -> Embedder:
+    return get_embedder(backend, model=model)
+
+
+@lru_cache(maxsize=None)
+def _reranker(backend: str, model: str) -> Reranker:
+    return get_reranker(backend, model=model)
+
+
+def load_document(document: str, document_hash: str) -> str:
+    # The hash is a parameter only so that editing the file changes the key
+    return Path(document).read_text(encoding="utf-8")
+
+
+def chunk_params(point: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Parameters of the selected chunker only, so sweeping another
+    chunker's settings does not invalidate its chunks.
+    """
+    if point["chunker"] == "static":
+        return {
+            "chunker": "static",
+            "chunk_size": point["chunk_size"],
+            "chunk_overlap": point["chunk_overlap"],
+        }
+    if point["chunker"] == "embedding":
+        return {
+            "chunker": "embedding",
+            "max_chunk_tokens": point["max_chunk_tokens"],
+            "embedding_backend": point["embedding_backend"],
+            "embedding_model": point["embedding_model"],
+        }
+    raise ValueError(f"Unknown chunker: {point['chunker']}")
+
+
+def chunk_document(text: str, chunker: str, **params) -> ChunkStore:
+    if chunker == "static":
+        return static_text_splitter(text, **params)
+
+    return embedding_similarity_splitter(
+        text,
+        max_chunk_tokens=params["max_chunk_tokens"],
+        embedder=_embedder(params["embedding_backend"], params["embedding_model"]),
+        cache=baseline.EMBEDDING_CACHE,
+    )
+
+
+def embed_chunks(chunks: ChunkStore, embedding_backend: str, embedding_model: str) -> np.ndarray:
+    return embed_documents(
+        chunks, cache=baseline.EMBEDDING_CACHE, embedder=_embedder(embedding_backend, embedding_model)
+    )
+
+
+def retrieve_candidates(
+    chunks: ChunkStore,
+    index,
+    queries: Sequence[str],
+    retrieval_mode: str,
+    top_k: int,
+    embedding_backend: str,
+    embedding_model: str,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, scores) of the first-stage candidates of every query.
+    """
+    query_embeddings = None
+    if retrieval_mode != "sparse":
+        query_embeddings = embed_queries(
+            list(queries),
+            cache=baseline.EMBEDDING_CACHE,
+            embedder=_embedder(embedding_backend, embedding_model),
+        )
+
+    bm25 = BM25Index.build(chunks) if retrieval_mode != "dense" else None
+
+    return hybrid_retrieve(
+        retrieval_mode, top_k, list(queries), query_embeddings, index=index, bm25=bm25
+    )
+
+
+def rerank_candidates(
+    chunks: ChunkStore,
+    retrieved: Tuple[np.ndarray, np.ndarray],
+    queries: Sequence[str],
+    top_k: int,
+    rerank_backend: str,
+    rerank_model: str,
+    rerank_depth: Dict[str, Any],
+) -> np.ndarray:
+    """
+    (n_queries, top_k) chunk rows in reranked order, padded with -1.
+    """
+    ids, scores = retrieved
+    depths = rerank_depths(scores, max_k=top_k, **rerank_depth)
+
+    reranked = rerank_many(
+        list(queries),
+        [chunks.texts_for(row_ids[:depth]) for row_ids, depth in zip(ids, depths)],
+        top_n=top_k,
+        cache=baseline.RERANK_CACHE,
+        reranker=_reranker(rerank_backend, rerank_model),
+    )
+
+    rows = np.full((len(queries), top_k), -1, dtype="int64")
+    for q, ranked in enumerate(reranked):
+        rows[q, :len(ranked)] = [ids[q][i] for i, _, _ in ranked]
+    return rows
+
+
+def gold_spans(
+    text: str,
+    gold_chunk_ids: Sequence[Optional[int]],
+    gold_reference: Dict[str, int],
+) -> np.ndarray:
+    """
+    (n_queries, 2) character span of each gold chunk, -1 when there is none.
+
+    Gold ids refer to the baseline's static chunking (gold_reference), so
+    they are turned into spans that any other chunking can be
+    matched against.
+    """
+    chunks = static_text_splitter(text, **gold_reference)
+    spans = np.full((len(gold_chunk_ids), 2), -1, dtype="int64")
+    for q, gold in enumerate(gold_chunk_ids):
+        if gold is not None:
+            spans[q] = chunks.starts[gold], chunks.ends[gold]
+    return spans
+
+
+def covering_positions(chunks: ChunkStore, rows: np.ndarray, gold: np.ndarray) -> np.ndarray:
+    """
+    0-based rank of the first chunk covering GOLD_COVERAGE of each
+    gold span, or -1 when no ranked chunk does.
+    """
+    if rows.shape[1] == 0:
+        return np.full(len(rows), -1)
+
+    safe = np.maximum(rows, 0)
+    overlap = (
+        np.minimum(chunks.ends[safe], gold[:, 1:])
+        - np.maximum(chunks.starts[safe], gold[:, :1])
+    )
+    # Chunks outside the source text (doc 1) never match a span in it
+    hits = (
+        (rows >= 0)
+        & (chunks.doc_ids[safe] == 0)
+        & (overlap >= GOLD_COVERAGE * (gold[:, 1:] - gold[:, :1]))
+    )
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+
+def evaluate_rankings(
+    chunks: ChunkStore,
+    retrieved: Tuple[np.ndarray, np.ndarray],
+    reranked: np.ndarray,
+    gold: np.ndarray,
+    ks: Sequence[int],
+    n_boot: int,
+) -> Dict[str, Any]:
+    valid = gold[:, 0] >= 0
+    results: Dict[str, Any] = {"num_queries": int(valid.sum()), "num_chunks": len(chunks)}
+
+    for key, rows in (("retrieved", retrieved[0]), ("reranked", reranked)):
+        positions = covering_positions(chunks, rows[valid], gold[valid])
+        results[key] = evaluate_positions(positions, rows.shape[1], ks, n_boot=n_boot)
+
+    return results
+
+
+def pipeline_graph(root: Optional[Path] = STAGE_CACHE_DIR) -> StageGraph:
+    """
+    load -> chunk -> embed -> index -> retrieve -> rerank -> evaluate,
+    with gold spans taken from the loaded document.
+    """
+    return StageGraph(
+        [
+            # Reading the file is cheaper than unpickling a copy of it
+            Stage("load", load_document, params=("document", "document_hash"), persist=False),
+            Stage("chunk", chunk_document, ("load",), chunk_params),
+            Stage("embed", embed_chunks, ("chunk",), ("embedding_backend", "embedding_model")),
+            Stage("index", build_faiss_index, ("embed",), ("index_type",)),
+            Stage(
+                "retrieve",
+                retrieve_candidates,
+                ("chunk", "index"),
+                ("queries", "retrieval_mode", "top_k", "embedding_backend", "embedding_model"),
+            ),
+            Stage(
+                "rerank",
+                rerank_candidates,
+                ("chunk", "retrieve"),
+                ("queries", "top_k", "rerank_backend", "rerank_model", "rerank_depth"),
+            ),
+            Stage("gold", gold_spans, ("load",), ("gold_chunk_ids", "gold_reference")),
+            Stage("evaluate", evaluate_rankings, ("chunk", "retrieve", "rerank", "gold"), ("ks", "n_boot")),
+        ],
+        root=root,
+    )
+
+
+def base_point(document_path: Path, entries: List[Dict]) -> Dict[str, Any]:
+    """
+    The settings of the pipelines as they run today; grid values are
+    applied on top of these.
+    """
+    return {
+        "document": str(document_path),
+        "document_hash": hash_file(document_path),
+        "chunker": "static",
+        **baseline.CHUNKER_PARAMS,
+        "max_chunk_tokens": query_fitted.EMBEDDING_CHUNKER_PARAMS["max_chunk_tokens"],
+        "embedding_backend": os.environ.get("EMBEDDING_BACKEND", "cohere"),
+        "embedding_model": baseline.EMBEDDER.model,
+        "index_type": "flat",
+        "retrieval_mode": baseline.RETRIEVAL_MODE,
+        "top_k": 20,
+        "rerank_backend": os.environ.get("RERANK_BACKEND", "cohere"),
+        "rerank_model": baseline.RERANKER.model,
+        "rerank_depth": baseline.RERANK_DEPTH,
+        "queries": [entry["query"] for entry in entries],
+        "gold_chunk_ids": [entry.get("gold_chunk_id") for entry in entries],
+        "gold_reference": baseline.CHUNKER_PARAMS,
+        "ks": [1, 5, 10, 20],
+        "n_boot": 1000,
+    }
+
+
+# Parameter sweep
+def run_parameter_sweep(grid: Dict[str, List[Any]], max_workers: int = 4):
+    """
+    Metrics at every point of a parameter grid.
+
+    Only the stages downstream of a changed parameter are recomputed
+    (a new top_k reuses chunks, embeddings and index), independent
+    points run in parallel and stage outputs stored by earlier sweeps
+    are reused. Reports where each point's stages came from.
+    """
+
+    document_path = Path("data/raw/document.txt")
+    queries_path = Path("data/queries/queries.json")
+
+    if not document_path.exists() or not queries_path.exists():
+        print("[SKIP] sweep: no document or queries found")
+        return
+
+    with open(queries_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    # Overlap must stay below chunk size
+    points = [
+        point
+        for point in grid_points(base_point(document_path, entries), grid)
+        if point["chunk_overlap"] < point["chunk_size"]
+    ]
+    if not points:
+        print("[SKIP] sweep: no valid grid points")
+        return
+
+    graph = pipeline_graph()
+    results = sweep(graph, points, max_workers=max_workers)
+
+    rows = []
+    for point, result in zip(points, results):
+        stages = result["trace"]["stages"]
+        rows.append({
+            "params": {name: point[name] for name in grid},
+            "metrics": result["output"],
+            "sources": result["sources"],
+            "wall_seconds": result["trace"]["wall_seconds"],
+            "api_calls": sum(s["api_calls"] for s in stages.values()),
+        })
+
+    stats = graph.stats()
+    summary = {"grid": grid, "points": rows, "stages": stats, "reuse": reuse_summary(stats)}
+
+    output_path = Path("results/sensitivity_sweep.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    k = points[0]["ks"][0]
+    for row in rows:
+        computed = [stage for stage, source in row["sources"].items() if source == "computed"]
+        print(
+            f"{json.dumps(row['params'])}: "
+            f"reranked recall@{k} {row['metrics']['reranked'][f'recall@{k}']['mean']:.3f}  "
+            f"mrr {row['metrics']['reranked']['mrr']['mean']:.3f}  "
+            f"computed {', '.join(computed) or 'nothing'}"
+        )
+
+    for stage, stage_stats in stats.items():
+        print(
+            f"  {stage:9s} computed {stage_stats['computed']:3d}  "
+            f"memory {stage_stats['memory']:3d}  disk {stage_stats['disk']:3d}  "
+            f"{stage_stats['seconds']:.2f}s spent, {stage_stats['saved_seconds']:.2f}s saved"
+        )
+
+    reuse = summary["reuse"]
+    print(
+        f"Reused {reuse['reused']} of {reuse['computed'] + reuse['reused']} stage outputs "
+        f"({reuse['reuse_rate']:.0%}), saving {reuse['saved_seconds']:.1f}s"
+    )
+    print(f"Sweep results written to {output_path}")
+
+
 if __name__ == "__main__":
-    run_sensitivity_analysis()
\ No newline at end of file
+
+    # Configuration
+    GRID = {
+        "chunk_size": [500, 1000, 2000],
+        "chunk_overlap": [0, 200],
+        "top_k": [10, 20],
+    }
+    # Grid points run at the same time
+    MAX_WORKERS = 4
+
+    run_sensitivity_analysis()
+
+    # A JSON grid replaces GRID, e.g. '{"chunker": ["embedding"], "max_chunk_tokens": [300, 600]}'
+    grid = json.loads(sys.argv[1]) if len(sys.argv) > 1 else GRID
+    run_parameter_sweep(grid, max_workers=MAX_WORKERS)
@@ -1,10 +1,33 @@
-import json
+import os
+import time
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-from src.embedding import embed_documents, embed_query
-from src.retrieval import build_faiss_index, retrieve_top_k
-from src.rerank import rerank
-from src.chunking.static import static_text_splitter
+import numpy as np
+
+from src.artifacts import (
+    Artifacts,
+    ArtifactStore,
+    artifact_key,
+    hash_file,
+)
+from src.cache import EmbeddingCache, RerankCache
+from src.chunk_store import ChunkStore, MappedText
+from src.embedding import (
+    Embedder,
+    embed_document_stream,
+    embed_documents,
+    embed_query,
+    get_embedder,
+)
+from src.instrumentation import peak_rss_mb, profile_run, span, start_trace
+from src.resilience import retry_stats
+from src.retrieval import build_faiss_index
+from src.run_log import RUN_LOG_NAME, RunLog
+from src.sparse import BM25Index, hybrid_retrieve
+from src.rerank import get_reranker, rerank
+from src.rerank_depth import CALIBRATION_NAME, depth_config, rerank_depths
+from src.chunking.static import static_text_splitter, stream_static_chunks
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -14,36 +37,257 @@ DATA_DIR = Path("data")
 RESULTS_DIR = Path("results/baseline")
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Embeddings are reused across runs when the text is unchanged
+EMBEDDING_CACHE = EmbeddingCache(DATA_DIR / "cache/embeddings")
+
+# Rerank scores are reused for repeated (query, chunk) pairs
+RERANK_CACHE = RerankCache(DATA_DIR / "cache/rerank")
+
+# Candidates sent to the reranker; policy from RERANK_DEPTH_POLICY
+# ("fixed", "gap", "relative" or "calibrated"), see src/rerank_depth.py.
+# "calibrated" needs RESULTS_DIR / CALIBRATION_NAME, written by
+# analysis/rerank_depth_tradeoff.py
+RERANK_DEPTH = depth_config(
+    os.environ.get("RERANK_DEPTH_POLICY", "fixed"),
+    calibration_path=RESULTS_DIR / CALIBRATION_NAME,
+    min_k=5,
+)
+
+# Chunks, embeddings and index are reused when this key is unchanged.
+# With ARTIFACT_EMBEDDING_DTYPE ("float16" or "int8"), embeddings are
+# stored quantized (lossy) instead of as float32
+ARTIFACT_STORE = ArtifactStore(
+    DATA_DIR / "processed/store",
+    embedding_dtype=os.environ.get("ARTIFACT_EMBEDDING_DTYPE") or None,
+)
+CHUNKER_PARAMS = {"chunk_size": 1000, "chunk_overlap": 200}
+
+# Backend is chosen by EMBEDDING_BACKEND ("cohere", "local" or "fake")
+EMBEDDER = get_embedder()
+
+# Backend is chosen by RERANK_BACKEND ("cohere", "local" or "fake")
+RERANKER = get_reranker()
+
+# First stage is chosen by RETRIEVAL_MODE ("dense", "sparse", "rrf" or "weighted")
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "dense")
+
+# Query runs are appended to RESULTS_DIR / "runs.jsonl"; with
+# RUN_LOG_CHUNK_DIR set, reranked chunk texts are also stored there
+RUN_LOG_CHUNK_DIR = Path(os.environ["RUN_LOG_CHUNK_DIR"]) if "RUN_LOG_CHUNK_DIR" in os.environ else None
+
+# With RUN_PROFILE set, cProfile stats of the run are dumped to that path
+PROFILE_PATH = Path(os.environ["RUN_PROFILE"]) if "RUN_PROFILE" in os.environ else None
+
+
+def run_config(top_k: int = 20, retrieval_mode: str = RETRIEVAL_MODE) -> Dict:
+    """
+    Settings that identify a baseline run, hashed into its run records.
+    """
+    return {
+        "pipeline": "baseline",
+        "chunker": CHUNKER_PARAMS,
+        "embedding_model": EMBEDDER.model,
+        "rerank_model": RERANKER.model,
+        "rerank_depth": RERANK_DEPTH,
+        "retrieval_mode": retrieval_mode,
+        "top_k": top_k,
+    }
+
+
+def open_run_log(config: Dict) -> RunLog:
+    return RunLog(RESULTS_DIR / RUN_LOG_NAME, config=config, chunk_dir=RUN_LOG_CHUNK_DIR)
+
 
 # Baseline pipeline
+def prepare_baseline(
+    document_path: Path,
+    embedder: Optional[Embedder] = None,
+    stream: bool = False,
+    sparse: bool = False,
+) -> Tuple[Artifacts, Optional[BM25Index], Dict]:
+    """
+    Chunks, embeddings and index for the baseline, plus startup stats.
+
+    None of this depends on the query, so it is shared by every query
+    asked against the same document. With sparse=True the BM25 index
+    over the same chunks is loaded (or built) as well.
+    """
+
+    embedder = embedder or EMBEDDER
+
+    # Reuse stored artifacts when this exact configuration was seen before
+    start = time.perf_counter()
+
+    if stream:
+        store_key = artifact_key(
+            None,
+            "static_stream",
+            CHUNKER_PARAMS,
+            embedder.model,
+            document_hash=hash_file(document_path),
+        )
+    else:
+        # Load document
+        text = document_path.read_text(encoding="utf-8")
+        store_key = artifact_key(
+            text, "static", CHUNKER_PARAMS, embedder.model
+        )
+
+    artifacts = ARTIFACT_STORE.load(store_key)
+    warm = artifacts is not None
+
+    if artifacts is None and stream:
+        bounds = []
+
+        def produce_chunks():
+            spans = iter(stream_static_chunks(document_path, **CHUNKER_PARAMS))
+            while True:
+                # Only the chunker's own work is timed, not the consumer's
+                with span("chunking"):
+                    chunk = next(spans, None)
+                if chunk is None:
+                    return
+                bounds.append((chunk.start, chunk.end))
+                yield chunk.text
+
+        # Embedding of early batches overlaps with chunking of later ones
+        batches = list(embed_document_stream(
+            produce_chunks(), cache=EMBEDDING_CACHE, embedder=embedder
+        ))
+        doc_embeddings = (
+            np.vstack(batches)
+            if batches
+            else np.zeros((0, getattr(embedder, "dim", 0)), dtype="float32")
+        )
+
+        # Chunk texts are sliced from the memory-mapped file on demand,
+        # so the document is never held in memory whole
+        chunks = ChunkStore.from_spans(MappedText(document_path), bounds)
+        index = build_faiss_index(doc_embeddings)
+        ARTIFACT_STORE.save(store_key, chunks, doc_embeddings, index)
+        artifacts = Artifacts(chunks, doc_embeddings, index)
+    elif artifacts is None:
+        # Chunk document without using the query
+        with span("chunking"):
+            chunks = static_text_splitter(text, **CHUNKER_PARAMS)
+
+        # Embed chunks and build index
+        doc_embeddings = embed_documents(
+            chunks, cache=EMBEDDING_CACHE, embedder=embedder
+        )
+        index = build_faiss_index(doc_embeddings)
+        ARTIFACT_STORE.save(store_key, chunks, doc_embeddings, index)
+        artifacts = Artifacts(chunks, doc_embeddings, index)
+
+    bm25 = ARTIFACT_STORE.load_sparse(store_key, artifacts.chunks) if sparse else None
+
+    startup = {
+        "warm": warm,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    return artifacts, bm25, startup
+
+
+def baseline_record(
+    query: str,
+    chunks: ChunkStore,
+    retrieved_ids: np.ndarray,
+    reranked: List[Tuple[int, float, str]],
+    startup: Dict,
+    gold_chunk_id: Optional[int] = 22,
+    retrieved_scores: Optional[np.ndarray] = None,
+    rerank_depth: Optional[int] = None,
+    retrieval_mode: str = "dense",
+    retrieval_seconds: Optional[float] = None,
+) -> Dict:
+    """
+    Result record for one query, in the format read by analysis/.
+    """
+    reranked_rows = [int(retrieved_ids[idx]) for idx, _, _ in reranked]
+    retrieved_chunk_ids = chunks.chunk_ids[retrieved_ids[retrieved_ids >= 0]]
+    if rerank_depth is None:
+        rerank_depth = len(retrieved_chunk_ids)
+
+    # Record results in a simple, inspectable format
+    return {
+        "query": query,
+        "pipeline": "baseline",
+        "num_chunks": len(chunks),
+        "startup": startup,
+        "retrieval_mode": retrieval_mode,
+        "retrieval_seconds": retrieval_seconds,
+        "retrieved_chunk_ids": retrieved_chunk_ids.tolist(),
+        "retrieved_scores": (
+            [float(x) for x in retrieved_scores[retrieved_ids >= 0]]
+            if retrieved_scores is not None
+            else None
+        ),
+        # Only these candidates were sent to the reranker
+        "rerank_depth": int(rerank_depth),
+        "rerank_candidate_ids": retrieved_chunk_ids[:rerank_depth].tolist(),
+        "reranked_chunk_ids": chunks.chunk_ids[reranked_rows].tolist(),
+        # Chunks are referenced by span; the text lives in the artifact
+        # store, and is also kept in the run log's chunk directory if set
+        "reranked_chunks": [
+            {**chunks.span(row), "score": score, **({"text": text} if RUN_LOG_CHUNK_DIR else {})}
+            for row, (_, score, text) in zip(reranked_rows, reranked)
+        ],
+        # Placeholder for controlled experiments
+        "gold_chunk_id": gold_chunk_id,
+    }
+
+
 def run_baseline_pipeline(
     document_path: Path,
     query: str,
     top_k: int = 20,
+    embedder: Optional[Embedder] = None,
+    stream: bool = False,
+    retrieval_mode: Optional[str] = None,
 ):
     """
     Baseline RAG pipeline using static, query-independent chunking.
+
+    With stream=True the document is read incrementally and chunks
+    are embedded while later chunks are still being produced.
+    retrieval_mode is one of RETRIEVAL_MODES; "sparse" needs no
+    query embedding.
     """
 
-    # Load document
-    text = document_path.read_text(encoding="utf-8")
+    embedder = embedder or EMBEDDER
+    retrieval_mode = retrieval_mode or RETRIEVAL_MODE
 
-    # Chunk document without using the query
-    chunks = static_text_splitter(text)
+    (chunks, doc_embeddings, index), bm25, startup = prepare_baseline(
+        document_path,
+        embedder=embedder,
+        stream=stream,
+        sparse=retrieval_mode != "dense",
+    )
 
-    # Embed chunks and build index
-    doc_embeddings = embed_documents(chunks)
-    index = build_faiss_index(doc_embeddings)
+    # Embed query (unless sparse-only) and retrieve candidates
+    start = time.perf_counter()
+    query_embeddings = None
+    if retrieval_mode != "sparse":
+        query_embeddings = embed_query(
+            query, cache=EMBEDDING_CACHE, embedder=embedder
+        )[None, :]
 
-    # Embed query and retrieve candidates
-    query_embedding = embed_query(query)
-    retrieved_ids, scores = retrieve_top_k(index, query_embedding, top_k)
+    ids, scores = hybrid_retrieve(
+        retrieval_mode, top_k, [query], query_embeddings, index=index, bm25=bm25
+    )
+    retrieved_ids = ids[0]
+    retrieval_seconds = time.perf_counter() - start
 
-    retrieved_pairs = [(int(i), chunks[int(i)]) for i in retrieved_ids]
-    retrieved_texts = [text for _, text in retrieved_pairs]
+    # Fewer candidates are reranked when the first stage is confident
+    depth = int(rerank_depths(scores, max_k=top_k, **RERANK_DEPTH)[0])
+    retrieved_texts = chunks.texts_for(retrieved_ids[:depth])
 
     # Rerank retrieved chunks
-    reranked = rerank(query, retrieved_texts, top_n=top_k)
+    reranked = rerank(
+        query, retrieved_texts, top_n=top_k, cache=RERANK_CACHE, reranker=RERANKER
+    )
 
     """
     reranked_chunk_ids = [
@@ -52,27 +296,17 @@ def run_baseline_pipeline(
     ]
     """
 
-    reranked_chunk_ids = [
-        retrieved_pairs[idx][0]
-        for idx, _, _ in reranked
-    ]
-
-    # Record results in a simple, inspectable format
-    record = {
-        "query": query,
-        "pipeline": "baseline",
-        "num_chunks": len(chunks),
-        "retrieved_chunk_ids": retrieved_ids.tolist(),
-        "reranked_chunk_ids": reranked_chunk_ids,
-        "reranked_chunks": [
-            {"text": text, "score": score}
-            for _, score, text in reranked
-        ],
-        # Placeholder for controlled experiments
-        "gold_chunk_id": 22,
-    }
-
-    return record
+    return baseline_record(
+        query,
+        chunks,
+        retrieved_ids,
+        reranked,
+        startup,
+        retrieved_scores=scores[0],
+        rerank_depth=depth,
+        retrieval_mode=retrieval_mode,
+        retrieval_seconds=retrieval_seconds,
+    )
 
 
 if __name__ == "__main__":
@@ -81,13 +315,17 @@ if __name__ == "__main__":
     
     query = "How does averaging over photon directions and polarizations in thermal radiation modify the role of the dipole matrix element, and why does this averaging fundamentally change the structure of the final transition rate?"
 
-    result = run_baseline_pipeline(
-        document_path=document_path,
-        query=query,
-    )
+    with profile_run(PROFILE_PATH), start_trace() as trace:
+        result = run_baseline_pipeline(
+            document_path=document_path,
+            query=query,
+        )
+    result["trace"] = trace.as_dict()
 
-    output_path = RESULTS_DIR / "result.json"
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2)
+    run_log = open_run_log(run_config())
+    run_log.append(result)
 
-    print(f"Baseline results written to {output_path}")
\ No newline at end of file
+    print(f"Baseline run {run_log.run_id} appended to {run_log.path}")
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+    print(f"Rerank cache: {RERANK_CACHE.stats()}")
+    print(f"Remote calls and retries: {retry_stats()}")
\ No newline at end of file
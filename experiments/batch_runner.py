@@ -0,0 +1,277 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from src.artifacts import Artifacts, artifact_key
+from src.cache import EmbeddingCache, RerankCache
+from src.embedding import Embedder, embed_queries
+from src.instrumentation import peak_rss_mb, profile_run, start_trace
+from src.resilience import retry_stats
+from src.sparse import RETRIEVAL_MODES, BM25Index, hybrid_retrieve
+from src.rerank import Reranker, rerank_many
+from src.rerank_depth import rerank_depths
+
+import experiments.baseline_pipeline as baseline
+import experiments.query_fitted_pipeline as query_fitted
+
+# Paths
+DATA_DIR = Path("data")
+QUERIES_PATH = DATA_DIR / "queries/queries.json"
+
+# Queries reranked at the same time
+MAX_CONCURRENCY = 4
+
+# With RUN_PROFILE set, cProfile stats of the whole invocation are dumped to that path
+PROFILE_PATH = Path(os.environ["RUN_PROFILE"]) if "RUN_PROFILE" in os.environ else None
+
+# Worker processes for the local cross-encoder (None keeps it in-process)
+RERANK_PROCESSES = int(os.environ["RERANK_PROCESSES"]) if "RERANK_PROCESSES" in os.environ else None
+
+
+# Helpers
+def load_queries(path: Path = QUERIES_PATH) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _retrieve_and_rerank(
+    artifacts: Artifacts,
+    queries: List[str],
+    top_k: int,
+    embedder: Embedder,
+    max_concurrency: int,
+    rerank_depth: Dict,
+    reranker: Reranker,
+    embedding_cache: EmbeddingCache,
+    rerank_cache: RerankCache,
+    retrieval_mode: str = "dense",
+    bm25: Optional[BM25Index] = None,
+):
+    """
+    Embed all queries in one batch (skipped for sparse-only retrieval),
+    search them together and rerank them concurrently. Each query sends
+    only its adaptive rerank depth of candidates to the reranker.
+
+    rerank_depth, reranker and the caches are the calling pipeline's,
+    so a batch runs what that pipeline's run_config records.
+
+    Returns (retrieved_ids, retrieved_scores, depths, reranked) per
+    query and the mean retrieval seconds.
+    """
+    start = time.perf_counter()
+    query_embeddings = None
+    if retrieval_mode != "sparse":
+        query_embeddings = embed_queries(
+            queries, cache=embedding_cache, embedder=embedder
+        )
+
+    retrieved_ids, retrieved_scores = hybrid_retrieve(
+        retrieval_mode,
+        top_k,
+        queries,
+        query_embeddings,
+        index=artifacts.index,
+        bm25=bm25,
+    )
+    retrieval_seconds = (time.perf_counter() - start) / max(len(queries), 1)
+
+    depths = rerank_depths(retrieved_scores, max_k=top_k, **rerank_depth)
+
+    reranked = rerank_many(
+        queries,
+        [
+            artifacts.chunks.texts_for(ids[:depth])
+            for ids, depth in zip(retrieved_ids, depths)
+        ],
+        top_n=top_k,
+        cache=rerank_cache,
+        reranker=reranker,
+        max_concurrency=max_concurrency,
+        processes=RERANK_PROCESSES,
+    )
+
+    return (
+        list(zip(retrieved_ids, retrieved_scores, depths, reranked)),
+        retrieval_seconds,
+    )
+
+
+# Batch runs
+def run_baseline_batch(
+    document_path: Path,
+    entries: List[Dict],
+    top_k: int = 20,
+    embedder: Optional[Embedder] = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+    retrieval_mode: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Baseline pipeline over many queries.
+
+    The document is chunked, embedded and indexed once, since none of
+    that depends on the query.
+    """
+    embedder = embedder or baseline.EMBEDDER
+    retrieval_mode = retrieval_mode or baseline.RETRIEVAL_MODE
+    artifacts, bm25, startup = baseline.prepare_baseline(
+        document_path, embedder=embedder, sparse=retrieval_mode != "dense"
+    )
+
+    queries = [entry["query"] for entry in entries]
+    results, retrieval_seconds = _retrieve_and_rerank(
+        artifacts,
+        queries,
+        top_k,
+        embedder,
+        max_concurrency,
+        baseline.RERANK_DEPTH,
+        baseline.RERANKER,
+        baseline.EMBEDDING_CACHE,
+        baseline.RERANK_CACHE,
+        retrieval_mode=retrieval_mode,
+        bm25=bm25,
+    )
+
+    records = []
+    for entry, (ids, scores, depth, ranked) in zip(entries, results):
+        record = baseline.baseline_record(
+            entry["query"],
+            artifacts.chunks,
+            ids,
+            ranked,
+            startup,
+            gold_chunk_id=entry.get("gold_chunk_id"),
+            retrieved_scores=scores,
+            rerank_depth=depth,
+            retrieval_mode=retrieval_mode,
+            retrieval_seconds=retrieval_seconds,
+        )
+        records.append({"query_id": entry.get("query_id"), **record})
+
+    return records
+
+
+def run_query_fitted_batch(
+    document_path: Path,
+    entries: List[Dict],
+    top_k: int = 20,
+    embedder: Optional[Embedder] = None,
+    chunker: Optional[str] = None,
+    max_concurrency: int = MAX_CONCURRENCY,
+) -> List[Dict]:
+    """
+    Query-fitted pipeline over many queries.
+
+    The chunking does not depend on the query, so the document is
+    chunked, embedded and indexed once and all queries are embedded,
+    searched and reranked together against it.
+    """
+    embedder = embedder or query_fitted.EMBEDDER
+    text = document_path.read_text(encoding="utf-8")
+    start = time.perf_counter()
+
+    chunker_name, params = query_fitted.chunker_config(chunker)
+    key = artifact_key(text, chunker_name, params, embedder.model)
+    artifacts = query_fitted.ARTIFACT_STORE.load(key)
+    warm = artifacts is not None
+
+    if not warm:
+        chunks = query_fitted.chunk_document(text, embedder=embedder, chunker=chunker)
+        artifacts = query_fitted.index_chunks(chunks, embedder=embedder)
+        query_fitted.ARTIFACT_STORE.save(key, *artifacts)
+
+    startup = {
+        "warm": warm,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    queries = [entry["query"] for entry in entries]
+    results, _ = _retrieve_and_rerank(
+        artifacts,
+        queries,
+        top_k,
+        embedder,
+        max_concurrency,
+        query_fitted.RERANK_DEPTH,
+        query_fitted.RERANKER,
+        query_fitted.EMBEDDING_CACHE,
+        query_fitted.RERANK_CACHE,
+    )
+
+    records = []
+    for entry, (ids, scores, depth, ranked) in zip(entries, results):
+        record = query_fitted.query_fitted_record(
+            entry["query"],
+            chunker_name,
+            artifacts.chunks,
+            ids,
+            ranked,
+            startup,
+            gold_chunk_id=entry.get("gold_chunk_id"),
+            retrieved_scores=scores,
+            rerank_depth=depth,
+        )
+        records.append({"query_id": entry.get("query_id"), **record})
+
+    return records
+
+
+if __name__ == "__main__":
+
+    document_path = DATA_DIR / "raw/document.txt"
+    entries = load_queries()
+
+    pipelines = sys.argv[1:] or ["baseline", "query_fitted"]
+
+    with profile_run(PROFILE_PATH):
+        for pipeline in pipelines:
+            if pipeline == "baseline":
+                runs = [(
+                    baseline,
+                    baseline.run_config(),
+                    lambda: run_baseline_batch(document_path, entries),
+                )]
+            elif pipeline == "baseline_modes":
+                # Every first-stage mode on the same chunks, one run each, for compute_metrics
+                runs = [
+                    (
+                        baseline,
+                        baseline.run_config(retrieval_mode=mode),
+                        lambda mode=mode: run_baseline_batch(document_path, entries, retrieval_mode=mode),
+                    )
+                    for mode in RETRIEVAL_MODES
+                ]
+            elif pipeline == "query_fitted":
+                runs = [(
+                    query_fitted,
+                    query_fitted.run_config(),
+                    lambda: run_query_fitted_batch(document_path, entries),
+                )]
+            else:
+                raise ValueError(f"Unknown pipeline: {pipeline}")
+
+            for module, config, run in runs:
+                with start_trace() as trace:
+                    records = run()
+
+                # Shared and batched stages are split evenly over the queries
+                for record in records:
+                    record["trace"] = trace.as_dict(shared_by=len(records))
+
+                run_log = module.open_run_log(config)
+                run_log.extend(records)
+
+                print(
+                    f"{pipeline}: {len(records)} queries in "
+                    f"{trace.wall_seconds:.1f}s, run {run_log.run_id} appended to {run_log.path}"
+                )
+
+    for name, module in (("baseline", baseline), ("query_fitted", query_fitted)):
+        print(f"{name} embedding cache: {module.EMBEDDING_CACHE.stats()}")
+        print(f"{name} rerank cache: {module.RERANK_CACHE.stats()}")
+    print(f"Remote calls and retries: {retry_stats()}")
+    print(f"LLM cache: {query_fitted.LLM_CACHE.stats()}")
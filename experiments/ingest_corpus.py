@@ -0,0 +1,70 @@
+import json
+import sys
+from pathlib import Path
+
+from src.cache import EmbeddingCache
+from src.embedding import embed_query, get_embedder
+from src.ingest import ingest_corpus
+from src.resilience import retry_stats
+from src.retrieval import retrieve_top_k
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# Paths
+DATA_DIR = Path("data")
+RESULTS_DIR = Path("results/corpus")
+RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Embeddings are reused across runs when the text is unchanged
+EMBEDDING_CACHE = EmbeddingCache(DATA_DIR / "cache/embeddings")
+
+CHUNKER_PARAMS = {"chunk_size": 1000, "chunk_overlap": 200}
+
+# Split the index into shards of this many chunks (None for one index)
+SHARD_SIZE = 100_000
+
+
+if __name__ == "__main__":
+
+    corpus_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else DATA_DIR / "raw"
+
+    query = "How does averaging over photon directions and polarizations in thermal radiation modify the role of the dipole matrix element, and why does this averaging fundamentally change the structure of the final transition rate?"
+
+    embedder = get_embedder()
+    corpus = ingest_corpus(
+        corpus_dir,
+        embedder=embedder,
+        cache=EMBEDDING_CACHE,
+        shard_size=SHARD_SIZE,
+        **CHUNKER_PARAMS,
+    )
+
+    # Retrieval over the whole corpus returns global chunk rows
+    query_embedding = embed_query(query, cache=EMBEDDING_CACHE, embedder=embedder)
+    retrieved_ids, scores = retrieve_top_k(corpus.index, query_embedding, 20)
+
+    result = {
+        "query": query,
+        "pipeline": "corpus",
+        "ingest": corpus.stats,
+        "retrieved_chunks": [
+            {**corpus.chunks.span(int(row)), "score": float(score)}
+            for row, score in zip(retrieved_ids, scores)
+            if row >= 0
+        ],
+    }
+
+    output_path = RESULTS_DIR / "result.json"
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+
+    stats = corpus.stats
+    print(
+        f"Ingested {stats['documents']} documents, {stats['chunks']} chunks "
+        f"({stats['documents_per_second']:.1f} docs/s, "
+        f"{stats['chunks_per_second']:.1f} chunks/s)"
+    )
+    print(f"Corpus results written to {output_path}")
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+    print(f"Remote calls and retries: {retry_stats()}")
@@ -1,11 +1,23 @@
 
-import json
+import os
+import time
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
-from src.embedding import embed_documents, embed_query
+import numpy as np
+
+from src.artifacts import Artifacts, ArtifactStore, artifact_key
+from src.cache import EmbeddingCache, RerankCache, ResponseCache
+from src.chunk_store import ChunkStore
+from src.embedding import Embedder, embed_documents, embed_query, get_embedder
+from src.instrumentation import peak_rss_mb, profile_run, start_trace, traced
+from src.resilience import retry_stats
 from src.retrieval import build_faiss_index, retrieve_top_k
-from src.rerank import rerank
-from src.chunking.query_fitted import query_fitted_splitter
+from src.run_log import RUN_LOG_NAME, RunLog
+from src.rerank import get_reranker, rerank
+from src.rerank_depth import CALIBRATION_NAME, depth_config, rerank_depths
+from src.chunking.query_fitted import BOUNDARY_MODEL, query_fitted_splitter
+from src.chunking.semantic import embedding_similarity_splitter
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,75 +27,272 @@ DATA_DIR = Path("data")
 RESULTS_DIR = Path("results/query_fitted")
 RESULTS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Embeddings are reused across runs when the text is unchanged
+EMBEDDING_CACHE = EmbeddingCache(DATA_DIR / "cache/embeddings")
+
+# Rerank scores are reused for repeated (query, chunk) pairs
+RERANK_CACHE = RerankCache(DATA_DIR / "cache/rerank")
+
+# Candidates sent to the reranker; policy from RERANK_DEPTH_POLICY
+# ("fixed", "gap", "relative" or "calibrated"), see src/rerank_depth.py.
+# "calibrated" needs RESULTS_DIR / CALIBRATION_NAME, written by
+# analysis/rerank_depth_tradeoff.py
+RERANK_DEPTH = depth_config(
+    os.environ.get("RERANK_DEPTH_POLICY", "fixed"),
+    calibration_path=RESULTS_DIR / CALIBRATION_NAME,
+    min_k=5,
+)
+
+# Chunks, embeddings and index are reused when this key is unchanged.
+# With ARTIFACT_EMBEDDING_DTYPE ("float16" or "int8"), embeddings are
+# stored quantized (lossy) instead of as float32
+ARTIFACT_STORE = ArtifactStore(
+    DATA_DIR / "processed/store",
+    embedding_dtype=os.environ.get("ARTIFACT_EMBEDDING_DTYPE") or None,
+)
+CHUNKER_PARAMS = {"max_chunk_tokens": 600, "max_llm_calls": 20}
+EMBEDDING_CHUNKER_PARAMS = {"max_chunk_tokens": 600, "window": 2, "method": "dp"}
+
+# Semantic chunker is chosen by SEMANTIC_CHUNKER ("llm" or "embedding")
+SEMANTIC_CHUNKER = os.environ.get("SEMANTIC_CHUNKER", "llm")
+
+# Boundary answers are reused across queries and runs
+LLM_CACHE = ResponseCache(DATA_DIR / "cache/llm")
+
+# With LLM_BACKEND=fake, boundaries come from an offline stand-in
+# instead of OpenAI (see src/offline_providers.py). LLM_MODEL is part
+# of the LLM cache and artifact keys, so fake answers and chunkings
+# are never served to real runs
+LLM_CLIENT = None
+LLM_MODEL = BOUNDARY_MODEL
+if os.environ.get("LLM_BACKEND") == "fake":
+    from src.offline_providers import FakeChatClient
+
+    LLM_CLIENT = FakeChatClient()
+    LLM_MODEL = LLM_CLIENT.model
+
+# Windows sent to the LLM at once, from LLM_SPECULATION (1 by default).
+# Does not change the chunks produced, but windows guessed wrongly are
+# extra boundary calls
+LLM_SPECULATION = int(os.environ.get("LLM_SPECULATION", "1"))
+
+# Backend is chosen by EMBEDDING_BACKEND ("cohere", "local" or "fake")
+EMBEDDER = get_embedder()
+
+# Backend is chosen by RERANK_BACKEND ("cohere", "local" or "fake")
+RERANKER = get_reranker()
+
+# Query runs are appended to RESULTS_DIR / "runs.jsonl"; with
+# RUN_LOG_CHUNK_DIR set, reranked chunk texts are also stored there
+RUN_LOG_CHUNK_DIR = Path(os.environ["RUN_LOG_CHUNK_DIR"]) if "RUN_LOG_CHUNK_DIR" in os.environ else None
+
+# With RUN_PROFILE set, cProfile stats of the run are dumped to that path
+PROFILE_PATH = Path(os.environ["RUN_PROFILE"]) if "RUN_PROFILE" in os.environ else None
+
+
+def run_config(top_k: int = 20, chunker: Optional[str] = None) -> Dict:
+    """
+    Settings that identify a query-fitted run, hashed into its run records.
+    """
+    chunker = chunker or SEMANTIC_CHUNKER
+    return {
+        "pipeline": "query_fitted",
+        "chunker": chunker,
+        "chunker_params": (
+            {"llm_model": LLM_MODEL, **CHUNKER_PARAMS} if chunker == "llm" else EMBEDDING_CHUNKER_PARAMS
+        ),
+        "embedding_model": EMBEDDER.model,
+        "rerank_model": RERANKER.model,
+        "rerank_depth": RERANK_DEPTH,
+        "top_k": top_k,
+    }
+
+
+def open_run_log(config: Dict) -> RunLog:
+    return RunLog(RESULTS_DIR / RUN_LOG_NAME, config=config, chunk_dir=RUN_LOG_CHUNK_DIR)
+
 
 # Query-fitted pipeline
-def run_query_fitted_pipeline(
-    document_path: Path,
-    query: str,
-    top_k: int = 20,
-):
+def chunker_config(chunker: Optional[str] = None) -> Tuple[str, Dict]:
     """
-    RAG pipeline where chunk boundaries are influenced by the query.
+    Artifact name and parameters of the selected semantic chunker.
+
+    Neither chunker depends on the query (the boundary prompt only
+    shows the document), so one chunking serves every query.
     """
+    chunker = chunker or SEMANTIC_CHUNKER
 
-    # Load document
-    text = document_path.read_text(encoding="utf-8")
+    if chunker == "llm":
+        return "query_fitted", {"llm_model": LLM_MODEL, **CHUNKER_PARAMS}
+    if chunker == "embedding":
+        return "embedding_similarity", EMBEDDING_CHUNKER_PARAMS
+    raise ValueError(f"Unknown semantic chunker: {chunker}")
 
-    # Chunk document using the query
-    chunks = query_fitted_splitter(text, query)
 
-    # Embed chunks and build index
-    doc_embeddings = embed_documents(chunks)
-    index = build_faiss_index(doc_embeddings)
+@traced("chunking")
+def chunk_document(
+    text: str,
+    embedder: Optional[Embedder] = None,
+    chunker: Optional[str] = None,
+) -> ChunkStore:
+    chunker = chunker or SEMANTIC_CHUNKER
 
-    # Embed query and retrieve candidates
-    query_embedding = embed_query(query)
-    retrieved_ids, scores = retrieve_top_k(index, query_embedding, top_k)
+    # Chunk document at the boundaries the LLM suggests
+    if chunker == "llm":
+        return query_fitted_splitter(
+            text,
+            speculation=LLM_SPECULATION,
+            cache=LLM_CACHE,
+            client=LLM_CLIENT,
+            model=LLM_MODEL,
+            **CHUNKER_PARAMS,
+        )
 
-    retrieved_pairs = [(int(i), chunks[int(i)]) for i in retrieved_ids]
-    retrieved_texts = [text for _, text in retrieved_pairs]
+    return embedding_similarity_splitter(
+        text,
+        embedder=embedder or EMBEDDER,
+        cache=EMBEDDING_CACHE,
+        **EMBEDDING_CHUNKER_PARAMS,
+    )
 
-    # Rerank retrieved chunks
-    reranked = rerank(query, retrieved_texts, top_n=top_k)
 
-    reranked_chunk_ids = [
-        retrieved_pairs[idx][0]
-        for idx, _, _ in reranked
-    ]
+def index_chunks(chunks: ChunkStore, embedder: Optional[Embedder] = None) -> Artifacts:
+    # Embed chunks and build index
+    doc_embeddings = embed_documents(
+        chunks, cache=EMBEDDING_CACHE, embedder=embedder or EMBEDDER
+    )
+    index = build_faiss_index(doc_embeddings)
+    return Artifacts(chunks, doc_embeddings, index)
+
+
+def query_fitted_record(
+    query: str,
+    chunker_name: str,
+    chunks: ChunkStore,
+    retrieved_ids: np.ndarray,
+    reranked: List[Tuple[int, float, str]],
+    startup: Dict,
+    gold_chunk_id: Optional[int] = 7,
+    retrieved_scores: Optional[np.ndarray] = None,
+    rerank_depth: Optional[int] = None,
+) -> Dict:
+    """
+    Result record for one query, in the format read by analysis/.
+    """
+    reranked_rows = [int(retrieved_ids[idx]) for idx, _, _ in reranked]
+    retrieved_chunk_ids = chunks.chunk_ids[retrieved_ids[retrieved_ids >= 0]]
+    if rerank_depth is None:
+        rerank_depth = len(retrieved_chunk_ids)
 
     # Record results for analysis
-    record = {
+    return {
         "query": query,
         "pipeline": "query_fitted",
+        "chunker": chunker_name,
         "num_chunks": len(chunks),
-        "retrieved_chunk_ids": retrieved_ids.tolist(),
-        "reranked_chunk_ids" : reranked_chunk_ids,
+        "startup": startup,
+        "retrieved_chunk_ids": retrieved_chunk_ids.tolist(),
+        "retrieved_scores": (
+            [float(x) for x in retrieved_scores[retrieved_ids >= 0]]
+            if retrieved_scores is not None
+            else None
+        ),
+        # Only these candidates were sent to the reranker
+        "rerank_depth": int(rerank_depth),
+        "rerank_candidate_ids": retrieved_chunk_ids[:rerank_depth].tolist(),
+        "reranked_chunk_ids": chunks.chunk_ids[reranked_rows].tolist(),
+        # Chunks are referenced by span; the text lives in the artifact
+        # store, and is also kept in the run log's chunk directory if set
         "reranked_chunks": [
-            {"text": text, "score": score}
-            for _ , score, text in reranked
+            {**chunks.span(row), "score": score, **({"text": text} if RUN_LOG_CHUNK_DIR else {})}
+            for row, (_, score, text) in zip(reranked_rows, reranked)
         ],
         # Same gold reference as baseline for fair comparison
-        "gold_chunk_id": 7,
+        "gold_chunk_id": gold_chunk_id,
+    }
+
+
+def run_query_fitted_pipeline(
+    document_path: Path,
+    query: str,
+    top_k: int = 20,
+    embedder: Optional[Embedder] = None,
+    chunker: Optional[str] = None,
+):
+    """
+    RAG pipeline over semantic chunks of the document.
+
+    chunker selects the LLM boundary finder ("llm") or the faster
+    embedding-similarity splitter ("embedding"). Neither uses the
+    query, so the chunks, embeddings and index are reused across
+    queries; the query only drives retrieval and reranking.
+    """
+
+    embedder = embedder or EMBEDDER
+    chunker_name, chunker_params = chunker_config(chunker)
+
+    # Load document
+    text = document_path.read_text(encoding="utf-8")
+
+    # Reuse stored artifacts when this exact configuration was seen before
+    start = time.perf_counter()
+    store_key = artifact_key(text, chunker_name, chunker_params, embedder.model)
+    artifacts = ARTIFACT_STORE.load(store_key)
+
+    if artifacts is not None:
+        chunks, doc_embeddings, index = artifacts
+    else:
+        chunks = chunk_document(text, embedder=embedder, chunker=chunker)
+        chunks, doc_embeddings, index = index_chunks(chunks, embedder=embedder)
+        ARTIFACT_STORE.save(store_key, chunks, doc_embeddings, index)
+
+    startup = {
+        "warm": artifacts is not None,
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": peak_rss_mb(),
     }
 
-    return record
+    # Embed query and retrieve candidates
+    query_embedding = embed_query(query, cache=EMBEDDING_CACHE, embedder=embedder)
+    retrieved_ids, scores = retrieve_top_k(index, query_embedding, top_k)
+
+    # Fewer candidates are reranked when the dense ranking is confident
+    depth = int(rerank_depths(scores[None, :], max_k=top_k, **RERANK_DEPTH)[0])
+    retrieved_texts = chunks.texts_for(retrieved_ids[:depth])
+
+    # Rerank retrieved chunks
+    reranked = rerank(
+        query, retrieved_texts, top_n=top_k, cache=RERANK_CACHE, reranker=RERANKER
+    )
+
+    return query_fitted_record(
+        query,
+        chunker_name,
+        chunks,
+        retrieved_ids,
+        reranked,
+        startup,
+        retrieved_scores=scores,
+        rerank_depth=depth,
+    )
 
 
 if __name__ == "__main__":
     document_path = DATA_DIR / "raw/document.txt"
     query = "How does averaging over photon directions and polarizations in thermal radiation modify the role of the dipole matrix element, and why does this averaging fundamentally change the structure of the final transition rate?"
 
-    result = run_query_fitted_pipeline(
-        document_path=document_path,
-        query=query,
-    )
-
-    output_path = RESULTS_DIR / "result.json"
-    
-    dump = False;
+    with profile_run(PROFILE_PATH), start_trace() as trace:
+        result = run_query_fitted_pipeline(
+            document_path=document_path,
+            query=query,
+        )
+    result["trace"] = trace.as_dict()
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(result, f, indent=2)
-    
+    run_log = open_run_log(run_config())
+    run_log.append(result)
 
-    print(f"Query-fitted results written to {output_path}")
\ No newline at end of file
+    print(f"Query-fitted run {run_log.run_id} appended to {run_log.path}")
+    print(f"Embedding cache: {EMBEDDING_CACHE.stats()}")
+    print(f"Rerank cache: {RERANK_CACHE.stats()}")
+    print(f"Remote calls and retries: {retry_stats()}")
+    print(f"LLM cache: {LLM_CACHE.stats()}")
\ No newline at end of file
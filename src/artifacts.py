@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+
+from src.chunk_store import ChunkStore
+from src.retrieval import QuantizedEmbeddings, quantize_embeddings
+from src.sparse import BM25Index
+
+# FAISS is imported on first use so importing this module stays cheap
+if TYPE_CHECKING:
+    import faiss
+
+
+class Artifacts(NamedTuple):
+    chunks: ChunkStore
+    embeddings: Union[np.ndarray, QuantizedEmbeddings]
+    index: faiss.Index
+
+
+# Helpers
+def hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file's raw bytes, read in blocks so large documents
+    are never held in memory. This differs from hashing the decoded
+    text whenever decoding changes the bytes (a BOM, CRLF line endings
+    read in text mode), so keys built from it do not match text keys.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def artifact_key(
+    text: Optional[str],
+    chunker: str,
+    params: Dict[str, Any],
+    embedding_model: str,
+    document_hash: Optional[str] = None,
+) -> str:
+    """
+    Stable key for one (document, chunker config, embedding model) combination.
+
+    Pass document_hash instead of text when the document is streamed.
+    """
+    if document_hash is None:
+        if text is None:
+            raise ValueError("Either text or document_hash is required")
+        document_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    payload = json.dumps(
+        {
+            "document": document_hash,
+            "chunker": chunker,
+            "params": params,
+            "embedding_model": embedding_model,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+# Artifact store
+class ArtifactStore:
+    """
+    On-disk store of chunks, chunk embeddings and FAISS index.
+
+    Each entry lives in its own directory, uses the layout of
+    data/processed/baseline with chunks kept as a compact chunks.npz
+    ChunkStore instead of chunks.json, and is written to a temporary directory
+    first so a crash never leaves a partial entry behind. Loads are
+    memory-mapped, so a warm start only opens the files.
+
+    Embeddings are kept at full float32 precision by default, so they
+    can be used for exact rescoring. With embedding_dtype ("float16"
+    halves them, "int8" quarters them) they are stored normalized and
+    quantized instead, and load as a QuantizedEmbeddings view that
+    dequantizes the rows it is asked for. That is lossy; search itself
+    uses the FAISS index either way.
+    """
+
+    def __init__(self, root: Path, embedding_dtype: Optional[str] = None):
+        self.root = Path(root)
+        self.embedding_dtype = embedding_dtype
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def load(self, key: str) -> Optional[Artifacts]:
+        entry = self.path(key)
+        if not (entry / "manifest.json").exists():
+            return None
+
+        import faiss
+
+        # FAISS read flags for memory-mapped, read-only loading
+        mmap_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+        chunks = ChunkStore.load(entry / "chunks.npz")
+
+        embeddings = np.load(entry / "chunk_embeddings.npy", mmap_mode="r")
+        # Entries written before quantization have no scale file
+        if (entry / "embedding_scale.npz").exists():
+            with np.load(entry / "embedding_scale.npz") as scale:
+                embeddings = QuantizedEmbeddings(embeddings, scale["offset"], scale["scale"])
+
+        index = faiss.read_index(str(entry / "faiss.index"), mmap_flags)
+
+        return Artifacts(chunks=chunks, embeddings=embeddings, index=index)
+
+    def save(
+        self,
+        key: str,
+        chunks: Sequence[str],
+        embeddings: np.ndarray,
+        index: faiss.Index,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> Path:
+        import faiss
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key}.", dir=self.root))
+
+        try:
+            if not isinstance(chunks, ChunkStore):
+                chunks = ChunkStore.from_texts(chunks)
+            chunks.save(tmp_dir / "chunks.npz")
+
+            if self.embedding_dtype is None:
+                np.save(tmp_dir / "chunk_embeddings.npy", np.asarray(embeddings, dtype="float32"))
+            else:
+                codes, offset, scale = quantize_embeddings(
+                    np.asarray(embeddings, dtype="float32"), self.embedding_dtype
+                )
+                np.save(tmp_dir / "chunk_embeddings.npy", codes)
+                np.savez(tmp_dir / "embedding_scale.npz", offset=offset, scale=scale)
+            faiss.write_index(index, str(tmp_dir / "faiss.index"))
+
+            # The manifest is written last and marks the entry as complete
+            with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "num_chunks": len(chunks),
+                        "embedding_dtype": self.embedding_dtype or "float32",
+                        **(metadata or {}),
+                    },
+                    f,
+                    indent=2,
+                )
+
+            entry = self.path(key)
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(tmp_dir, entry)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        return entry
+
+    def load_sparse(self, key: str, chunks: Sequence[str]) -> BM25Index:
+        """
+        BM25 index over an entry's chunks, stored next to its FAISS index.
+        Built and saved on first use.
+        """
+        path = self.path(key) / "bm25.npz"
+        if path.exists():
+            return BM25Index.load(path)
+
+        bm25 = BM25Index.build(chunks)
+        if path.parent.exists():
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp.npz")
+            bm25.save(tmp_path)
+            os.replace(tmp_path, path)
+
+        return bm25
@@ -0,0 +1,502 @@
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: index writes are not locked across processes
+    fcntl = None
+
+
+# Helpers
+def text_hash(text: str) -> str:
+    """
+    Content hash used as a cache key for a piece of text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_write_json(path: Path, data: Dict) -> None:
+    """
+    Write JSON to a temporary file and move it into place so
+    readers never see a half-written index.
+    """
+    tmp_path = path.with_suffix(path.suffix + f".{uuid.uuid4().hex[:12]}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _file_lock(path: Path) -> Iterator[None]:
+    """
+    Exclusive lock on path across processes (no-op without fcntl).
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _safe_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+# Embedding cache
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache keyed by (model, input_type, text hash).
+
+    Vectors are stored as float32 .npy shards that are memory-mapped on
+    read. A small JSON index maps text hashes to (shard, row). When the
+    cache grows past max_bytes, the least recently used shards are evicted.
+
+    Several processes can share a cache directory: shard names are
+    unique per writer, and the index is re-read and merged under a
+    file lock before every write. Recency from lookups is kept in
+    memory and written out with the next put or on close().
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 1 << 30):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._indexes: Dict[Path, Dict] = {}
+        self._index_stamps: Dict[Path, Tuple[int, int, int]] = {}
+        self._last_used: Dict[Path, Dict[str, float]] = {}
+        self._shards: Dict[Path, np.ndarray] = {}
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    def _space_dir(self, model: str, input_type: str) -> Path:
+        return self.root / _safe_name(model) / _safe_name(input_type)
+
+    @staticmethod
+    def _index_stamp(space: Path) -> Tuple[int, int, int]:
+        """
+        Changes whenever index.json is replaced (each write is a new file).
+        """
+        try:
+            st = (space / "index.json").stat()
+        except FileNotFoundError:
+            return (0, 0, 0)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _read_index(self, space: Path) -> Dict:
+        stamp = self._index_stamp(space)
+        try:
+            with open(space / "index.json", "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            index = {"entries": {}, "shards": {}}
+        self._index_stamps[space] = stamp
+        return index
+
+    def _load_index(self, space: Path) -> Dict:
+        """
+        The space's index, re-read when another process has rewritten it.
+        """
+        if space not in self._indexes or self._index_stamps.get(space) != self._index_stamp(space):
+            self._indexes[space] = self._read_index(space)
+        return self._indexes[space]
+
+    @contextmanager
+    def _locked(self, space: Path) -> Iterator[None]:
+        """
+        Exclusive lock on a space across processes (no-op without fcntl).
+        """
+        with _file_lock(space / "index.lock"):
+            yield
+
+    def _open_shard(self, space: Path, shard: str) -> Optional[np.ndarray]:
+        path = space / f"{shard}.npy"
+        if path not in self._shards:
+            try:
+                self._shards[path] = np.load(path, mmap_mode="r")
+            except FileNotFoundError:
+                # Evicted by another process since our index was read
+                return None
+        return self._shards[path]
+
+    def get_many(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached vectors for texts.
+        Returns one entry per text, None for misses.
+        """
+        with self._lock:
+            return self._get_many(model, input_type, texts)
+
+    def _get_many(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+    ) -> List[Optional[np.ndarray]]:
+        space = self._space_dir(model, input_type)
+        index = self._load_index(space)
+        entries = index["entries"]
+        last_used = self._last_used.setdefault(space, {})
+        now = time.time()
+
+        results: List[Optional[np.ndarray]] = []
+
+        for text in texts:
+            entry = entries.get(text_hash(text))
+            shard_rows = self._open_shard(space, entry[0]) if entry is not None else None
+            if shard_rows is None:
+                self.misses += 1
+                results.append(None)
+                continue
+
+            results.append(np.array(shard_rows[entry[1]]))
+            last_used[entry[0]] = now
+            self.hits += 1
+
+        return results
+
+    def put_many(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+        vectors: np.ndarray,
+    ) -> None:
+        """
+        Store vectors for texts as a new shard.
+        """
+        with self._lock:
+            self._put_many(model, input_type, texts, vectors)
+
+    def _put_many(
+        self,
+        model: str,
+        input_type: str,
+        texts: List[str],
+        vectors: np.ndarray,
+    ) -> None:
+        if len(texts) != len(vectors):
+            raise ValueError("texts and vectors must have the same length")
+
+        if not texts:
+            return
+
+        space = self._space_dir(model, input_type)
+        space.mkdir(parents=True, exist_ok=True)
+
+        # Unique across processes, so writers never overwrite each other's shards
+        shard = f"shard_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+
+        array = np.ascontiguousarray(vectors, dtype="float32")
+        tmp_path = space / f"{shard}.tmp.npy"
+        np.save(tmp_path, array)
+        os.replace(tmp_path, space / f"{shard}.npy")
+
+        with self._locked(space):
+            index = self._merged_index(space)
+
+            for row, text in enumerate(texts):
+                index["entries"][text_hash(text)] = [shard, row]
+
+            index["shards"][shard] = {
+                "bytes": int(array.nbytes),
+                "last_used": time.time(),
+            }
+
+            self._evict(space, index, keep=shard)
+            self._write_index(space, index)
+
+    def _merged_index(self, space: Path) -> Dict:
+        """
+        The index on disk with our pending recency applied. Call with
+        the space locked.
+        """
+        index = self._read_index(space)
+        for shard, used in self._last_used.pop(space, {}).items():
+            meta = index["shards"].get(shard)
+            if meta is not None:
+                meta["last_used"] = max(meta["last_used"], used)
+        return index
+
+    def _write_index(self, space: Path, index: Dict) -> None:
+        _atomic_write_json(space / "index.json", index)
+        self._indexes[space] = index
+        self._index_stamps[space] = self._index_stamp(space)
+
+    def close(self) -> None:
+        """
+        Write out recency recorded by lookups since the last put.
+        """
+        with self._lock:
+            for space in [s for s, used in self._last_used.items() if used]:
+                with self._locked(space):
+                    self._write_index(space, self._merged_index(space))
+
+    def _evict(self, space: Path, index: Dict, keep: str) -> None:
+        """
+        Drop least recently used shards until the space fits in max_bytes.
+        """
+        shards = index["shards"]
+        total = sum(meta["bytes"] for meta in shards.values())
+
+        for shard in sorted(shards, key=lambda s: shards[s]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if shard == keep:
+                continue
+
+            total -= shards.pop(shard)["bytes"]
+            path = space / f"{shard}.npy"
+            self._shards.pop(path, None)
+            if path.exists():
+                path.unlink()
+
+        index["entries"] = {
+            key: entry
+            for key, entry in index["entries"].items()
+            if entry[0] in shards
+        }
+
+    def clear(self) -> None:
+        """
+        Remove every cached vector.
+        """
+        self._indexes.clear()
+        self._index_stamps.clear()
+        self._last_used.clear()
+        self._shards.clear()
+        if self.root.exists():
+            shutil.rmtree(self.root)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# LLM response cache
+class ResponseCache:
+    """
+    Disk-backed cache of text responses from chat models.
+
+    Each entry is one small JSON file named by a hash of the request,
+    so concurrent writers never touch the same index file. Entries
+    older than ttl_seconds are ignored. Every few hundred writes, the
+    least recently used files beyond max_entries are removed.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        ttl_seconds: Optional[float] = 30 * 24 * 3600,
+        max_entries: int = 100_000,
+    ):
+        self.root = Path(root)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+    ) -> str:
+        payload = json.dumps(
+            [model, system_prompt, text_hash(user_prompt), temperature]
+        )
+        return text_hash(payload)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entry = None
+
+        expired = (
+            entry is not None
+            and self.ttl_seconds is not None
+            and time.time() - entry["created"] > self.ttl_seconds
+        )
+
+        with self._lock:
+            if entry is None or expired:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # Touch the file so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        return entry["response"]
+
+    def put(self, key: str, response: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Unique across threads and processes, so writers never share a temp file
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:12]}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "response": response}, f)
+        os.replace(tmp_path, path)
+
+        # Scanning the directory is not free, so only check now and then
+        with self._lock:
+            self._puts += 1
+            check = self._puts % 256 == 1
+        if check:
+            self._evict()
+
+    def _evict(self) -> None:
+        files = list(self.root.glob("*/*.json"))
+        if len(files) <= self.max_entries:
+            return
+
+        def last_used(path: Path) -> float:
+            try:
+                return path.stat().st_mtime
+            except FileNotFoundError:
+                return 0.0
+
+        files.sort(key=last_used)
+        for path in files[:len(files) - self.max_entries]:
+            # Another process may have removed it already
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Rerank score cache
+class RerankCache:
+    """
+    Disk-backed rerank score cache keyed by (model, query hash, document hash).
+
+    Relevance scores do not depend on the other documents in a request,
+    so each (query, document) pair is cached on its own. All scores for
+    one query live in a single JSON file, re-read and merged under a
+    file lock before every write so concurrent runs, in other threads
+    or processes, do not lose each other's entries.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.hits = 0
+        self.misses = 0
+        self._scores: Dict[Path, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, model: str, query: str) -> Path:
+        key = text_hash(query)
+        return self.root / _safe_name(model) / key[:2] / f"{key}.json"
+
+    def _load(self, path: Path) -> Dict[str, float]:
+        if path not in self._scores:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._scores[path] = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._scores[path] = {}
+        return self._scores[path]
+
+    def get_many(
+        self,
+        model: str,
+        query: str,
+        documents: List[str],
+    ) -> List[Optional[float]]:
+        """
+        Look up cached scores for documents.
+        Returns one entry per document, None for misses.
+        """
+        with self._lock:
+            scores = self._load(self._path(model, query))
+            results = [scores.get(text_hash(doc)) for doc in documents]
+
+            found = sum(score is not None for score in results)
+            self.hits += found
+            self.misses += len(results) - found
+
+        return results
+
+    def put_many(
+        self,
+        model: str,
+        query: str,
+        documents: List[str],
+        scores: List[float],
+    ) -> None:
+        if len(documents) != len(scores):
+            raise ValueError("documents and scores must have the same length")
+
+        if not documents:
+            return
+
+        path = self._path(model, query)
+
+        # One lock per hash prefix directory keeps lock files few
+        with self._lock, _file_lock(path.parent / "scores.lock"):
+            # Pick up entries written by other processes since our load
+            self._scores.pop(path, None)
+            cached = self._load(path)
+            for doc, score in zip(documents, scores):
+                cached[text_hash(doc)] = float(score)
+
+            tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:12]}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cached, f)
+            os.replace(tmp_path, path)
+
+    def clear(self) -> None:
+        """
+        Remove every cached score.
+        """
+        with self._lock:
+            if self.root.exists():
+                shutil.rmtree(self.root)
+            self._scores.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,357 @@
+import bisect
+import hashlib
+import mmap
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+# Helpers
+def paragraph_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    (start, end) offsets of the non-empty paragraphs of text.
+
+    Paragraphs are separated by blank lines, exactly as in
+    text.split("\n\n"), and each span excludes surrounding whitespace.
+    """
+    spans: List[Tuple[int, int]] = []
+    pos = 0
+
+    for part in text.split("\n\n"):
+        start = pos
+        end = pos + len(part)
+        pos = end + 2
+
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+
+        if start < end:
+            spans.append((start, end))
+
+    return spans
+
+
+# Memory-mapped sources
+class MappedText:
+    """
+    Text of a UTF-8 file, sliced by character offsets without decoding
+    the whole file.
+
+    The file is memory-mapped, and a table of checkpoints maps the
+    first character of every block_size bytes to its byte offset, so a
+    slice only decodes from the nearest checkpoint on. Offsets count
+    characters as read with newline="" (no newline translation), like
+    stream_static_chunks.
+    """
+
+    def __init__(self, path: Path, block_size: int = 1 << 16):
+        self.path = Path(path)
+        self.block_size = block_size
+
+        with open(self.path, "rb") as f:
+            size = f.seek(0, 2)
+            # An empty file cannot be mapped
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        self._bytes = np.frombuffer(self._data, dtype="uint8")
+        checkpoint_chars: List[int] = []
+        checkpoint_bytes: List[int] = []
+        chars = 0
+
+        for block_start in range(0, len(self._bytes), block_size):
+            # UTF-8 continuation bytes look like 0b10xxxxxx
+            starts = (self._bytes[block_start:block_start + block_size] & 0xC0) != 0x80
+            first = int(np.argmax(starts))
+            if starts[first]:
+                checkpoint_chars.append(chars)
+                checkpoint_bytes.append(block_start + first)
+            chars += int(starts.sum())
+
+        self._checkpoint_chars = checkpoint_chars or [0]
+        self._checkpoint_bytes = checkpoint_bytes or [0]
+        self._length = chars
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _byte_offset(self, char: int) -> int:
+        if char >= self._length:
+            return len(self._bytes)
+
+        i = bisect.bisect_right(self._checkpoint_chars, char) - 1
+        offset = self._checkpoint_bytes[i]
+        skip = char - self._checkpoint_chars[i]
+
+        # A character is at most 4 bytes
+        window = self._bytes[offset:offset + 4 * (skip + 1)]
+        return offset + int(np.flatnonzero((window & 0xC0) != 0x80)[skip])
+
+    def __getitem__(self, key: Union[int, slice]) -> str:
+        if isinstance(key, int):
+            if key < 0:
+                key += self._length
+            key = slice(key, key + 1)
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("MappedText only supports contiguous slices")
+        if stop <= start:
+            return ""
+        return self._data[self._byte_offset(start):self._byte_offset(stop)].decode("utf-8")
+
+    def byte_array(self) -> np.ndarray:
+        """
+        The raw UTF-8 bytes, as a view of the mapping.
+        """
+        return self._bytes
+
+
+# Chunk store
+class ChunkStore(Sequence[str]):
+    """
+    Chunks stored as spans into shared source texts.
+
+    Each chunk is a row of parallel arrays: a stable chunk id, the
+    index of its source document and [start, end) character offsets.
+    Every source text is held once, so overlapping chunks cost a few
+    integers rather than a copy of their text. A source may also be a
+    MappedText, which keeps a large file on disk. The store behaves
+    like a list of chunk strings, so existing callers keep working.
+    """
+
+    def __init__(
+        self,
+        sources: List[Union[str, MappedText]],
+        doc_ids: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        chunk_ids: Optional[np.ndarray] = None,
+        source_names: Optional[List[str]] = None,
+    ):
+        self.sources = sources
+        self.doc_ids = np.asarray(doc_ids, dtype="int32")
+        self.starts = np.asarray(starts, dtype="int64")
+        self.ends = np.asarray(ends, dtype="int64")
+        self.chunk_ids = (
+            np.arange(len(self.starts), dtype="int64")
+            if chunk_ids is None
+            else np.asarray(chunk_ids, dtype="int64")
+        )
+        self.source_names = source_names or [str(i) for i in range(len(sources))]
+
+        if not (len(self.doc_ids) == len(self.starts) == len(self.ends) == len(self.chunk_ids)):
+            raise ValueError("Chunk arrays must have the same length")
+
+    # Construction
+    @classmethod
+    def from_spans(
+        cls,
+        source: Union[str, MappedText],
+        spans: Sequence[Tuple[int, int]],
+        source_name: str = "0",
+    ) -> "ChunkStore":
+        """
+        Store for chunks of a single source text.
+        """
+        bounds = np.asarray(spans, dtype="int64").reshape(-1, 2)
+        return cls(
+            sources=[source],
+            doc_ids=np.zeros(len(bounds), dtype="int32"),
+            starts=bounds[:, 0],
+            ends=bounds[:, 1],
+            source_names=[source_name],
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: Sequence[str],
+        source: Optional[str] = None,
+        source_name: str = "0",
+    ) -> "ChunkStore":
+        """
+        Store for chunk strings.
+
+        When the source they were cut from is given, each chunk is
+        located in it (in order) and kept as a span. Chunks that are not
+        found verbatim, or all chunks when there is no source, are
+        appended to an extra buffer instead.
+        """
+        spans: List[Tuple[int, int]] = []
+        doc_ids: List[int] = []
+        extra: List[str] = []
+        extra_length = 0
+        cursor = 0
+
+        for text in texts:
+            found = source.find(text, cursor) if source is not None else -1
+
+            if found >= 0:
+                spans.append((found, found + len(text)))
+                doc_ids.append(0)
+                cursor = found + 1
+            else:
+                spans.append((extra_length, extra_length + len(text)))
+                doc_ids.append(1 if source is not None else 0)
+                extra.append(text)
+                extra_length += len(text)
+
+        sources: List[str] = [source] if source is not None else []
+        names: List[str] = [source_name] if source is not None else []
+        if extra or source is None:
+            sources.append("".join(extra))
+            names.append(f"{source_name}:extra" if source is not None else source_name)
+
+        bounds = np.asarray(spans, dtype="int64").reshape(-1, 2)
+        return cls(
+            sources=sources,
+            doc_ids=np.asarray(doc_ids, dtype="int32"),
+            starts=bounds[:, 0],
+            ends=bounds[:, 1],
+            source_names=names,
+        )
+
+    @classmethod
+    def concat(cls, stores: Sequence["ChunkStore"]) -> "ChunkStore":
+        """
+        Join stores from several documents.
+        Chunk ids are renumbered to their global row.
+        """
+        sources: List[str] = []
+        names: List[str] = []
+        doc_ids: List[np.ndarray] = []
+
+        for store in stores:
+            doc_ids.append(store.doc_ids + len(sources))
+            sources.extend(store.sources)
+            names.extend(store.source_names)
+
+        return cls(
+            sources=sources,
+            doc_ids=np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype="int32"),
+            starts=np.concatenate([s.starts for s in stores]) if stores else np.zeros(0),
+            ends=np.concatenate([s.ends for s in stores]) if stores else np.zeros(0),
+            source_names=names,
+        )
+
+    # Sequence interface
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def text(self, row: int) -> str:
+        source = self.sources[self.doc_ids[row]]
+        return source[self.starts[row]:self.ends[row]]
+
+    def __getitem__(self, row: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(row, slice):
+            return [self.text(i) for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("chunk index out of range")
+        return self.text(row)
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield self.text(row)
+
+    # Retrieval id mapping
+    def texts_for(self, rows: Sequence[int]) -> List[str]:
+        """
+        Texts for FAISS result rows. Padding rows (-1) are skipped.
+        """
+        return [self.text(int(row)) for row in rows if row >= 0]
+
+    def span(self, row: int) -> Dict[str, Union[int, str]]:
+        """
+        Compact reference to one chunk for result records.
+        """
+        return {
+            "chunk_id": int(self.chunk_ids[row]),
+            "doc": self.source_names[self.doc_ids[row]],
+            "start": int(self.starts[row]),
+            "end": int(self.ends[row]),
+        }
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the chunk texts, in order.
+        Stores that cut the same chunks share a fingerprint.
+        """
+        digest = hashlib.sha256()
+        for text in self:
+            digest.update(hashlib.sha256(text.encode("utf-8")).digest())
+        return digest.hexdigest()
+
+    # Serialization
+    def save(self, path: Path) -> None:
+        """
+        Write the store as a compressed .npz file.
+        """
+        encoded = [
+            s.byte_array() if isinstance(s, MappedText) else np.frombuffer(s.encode("utf-8"), dtype="uint8")
+            for s in self.sources
+        ]
+        byte_offsets = np.cumsum([0] + [len(b) for b in encoded]).astype("int64")
+
+        # A single mapped source is written from the mapping, not copied
+        np.savez_compressed(
+            path,
+            source_bytes=(
+                encoded[0] if len(encoded) == 1
+                else np.concatenate(encoded) if encoded
+                else np.zeros(0, dtype="uint8")
+            ),
+            source_offsets=byte_offsets,
+            source_names=np.asarray(self.source_names, dtype=str),
+            doc_ids=self.doc_ids,
+            starts=self.starts,
+            ends=self.ends,
+            chunk_ids=self.chunk_ids,
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "ChunkStore":
+        with np.load(path, allow_pickle=False) as data:
+            raw = data["source_bytes"].tobytes()
+            offsets = data["source_offsets"]
+            sources = [
+                raw[offsets[i]:offsets[i + 1]].decode("utf-8")
+                for i in range(len(offsets) - 1)
+            ]
+            return cls(
+                sources=sources,
+                doc_ids=data["doc_ids"],
+                starts=data["starts"],
+                ends=data["ends"],
+                chunk_ids=data["chunk_ids"],
+                source_names=[str(name) for name in data["source_names"]],
+            )
+
+
+def chunks_from_boundaries(
+    text: str,
+    spans: List[Tuple[int, int]],
+    boundaries: List[int],
+) -> ChunkStore:
+    """
+    Group consecutive paragraph spans into chunks.
+
+    boundaries holds the exclusive end paragraph of each chunk, as
+    produced by the semantic chunkers. A chunk's text is its stripped
+    paragraphs joined by a blank line ("\n\n"). Where that text appears
+    verbatim in the source (paragraphs separated by exactly one blank
+    line) the chunk is kept as a span; otherwise it goes to the store's
+    extra buffer, so chunk texts never depend on separator whitespace.
+    """
+    chunk_texts: List[str] = []
+    start = 0
+
+    for end in boundaries:
+        if end > start:
+            chunk_texts.append("\n\n".join(text[s:e] for s, e in spans[start:end]))
+        start = end
+
+    return ChunkStore.from_texts(chunk_texts, source=text)
@@ -1,12 +1,28 @@
+from __future__ import annotations
+
 import os
-import time
 import re
-from typing import List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from src.cache import ResponseCache
+from src.chunk_store import ChunkStore, chunks_from_boundaries, paragraph_spans
+from src.instrumentation import bind, traced
+from src.resilience import call_with_retries, is_retryable
+
+# The OpenAI SDK and .env are loaded on first use, not at import
+if TYPE_CHECKING:
+    from openai import OpenAI
+
 
-from openai import OpenAI
-from dotenv import load_dotenv
+BOUNDARY_MODEL = "gpt-3.5-turbo-0125"
+BOUNDARY_TEMPERATURE = 0.1
 
-load_dotenv()
+BOUNDARY_SYSTEM_PROMPT = (
+    "You will receive a document with paragraphs labeled as "
+    "'ID X: <text>'. Identify the first paragraph (not the first one) "
+    "where the topic clearly shifts. Respond with: Answer: ID X"
+)
 
 
 # Helpers
@@ -19,93 +35,101 @@ def _estimate_tokens(text: str) -> int:
     return int(1.2 * len(text.split()))
 
 
+@traced("query_llm_boundary")
 def _query_llm_boundary(
     client: OpenAI,
     prompt: str,
     max_retries: int = 3,
-    sleep_seconds: int = 10,
+    backoff_seconds: float = 2.0,
+    cache: Optional[ResponseCache] = None,
+    model: str = BOUNDARY_MODEL,
 ) -> Optional[int]:
     """
     Ask the LLM to identify a paragraph boundary.
     Returns the paragraph index if found, otherwise None.
+
+    Responses are memoized in cache under model when one is given.
+    Calls are counted under client.provider, or "openai". Transient
+    errors are retried with backoff and give None once exhausted;
+    errors that cannot succeed on retry are raised immediately.
     """
-    system_prompt = (
-        "You will receive a document with paragraphs labeled as "
-        "'ID X: <text>'. Identify the first paragraph (not the first one) "
-        "where the topic clearly shifts. Respond with: Answer: ID X"
+    cache_key = ResponseCache.key(
+        model, BOUNDARY_SYSTEM_PROMPT, prompt, BOUNDARY_TEMPERATURE
     )
+    content = cache.get(cache_key) if cache is not None else None
 
-    for _ in range(max_retries):
+    if content is None:
         try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo-0125",
-                temperature=0.1,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
+            response = call_with_retries(
+                lambda: client.chat.completions.create(
+                    model=model,
+                    temperature=BOUNDARY_TEMPERATURE,
+                    messages=[
+                        {"role": "system", "content": BOUNDARY_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt},
+                    ],
+                ),
+                provider=getattr(client, "provider", "openai"),
+                tokens=_estimate_tokens(BOUNDARY_SYSTEM_PROMPT + "\n" + prompt),
+                max_retries=max_retries,
+                base_delay=backoff_seconds,
             )
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            return None
 
-            content = response.choices[0].message.content
-            match = re.search(r"Answer:\s*ID\s*(\d+)", content)
+        content = response.choices[0].message.content or ""
 
-            if match:
-                return int(match.group(1))
+        if cache is not None:
+            cache.put(cache_key, content)
 
-            return None
+    match = re.search(r"Answer:\s*ID\s*(\d+)", content)
 
-        except Exception:
-            time.sleep(sleep_seconds)
+    if match:
+        return int(match.group(1))
 
     return None
 
 
-# Query-fitted chunking
-def query_fitted_splitter(
-    text: str,
-    query: str,
-    max_chunk_tokens: int = 600,
-    max_llm_calls: int = 20,
-) -> List[str]:
+def _window_prompt(
+    labeled_paragraphs: List[str],
+    pointer: int,
+    max_chunk_tokens: int,
+) -> str:
     """
-    Split a document into chunks using an LLM to suggest
-    semantic boundary points.
-
-    This is intentionally conservative and limited in scope.
+    Build the prompt for the window of paragraphs starting at pointer.
     """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if api_key is None:
-        raise RuntimeError("OPENAI_API_KEY not set")
+    window: List[str] = []
+    token_count = 0
+    idx = pointer
 
-    client = OpenAI(api_key=api_key)
+    while idx < len(labeled_paragraphs) and token_count < max_chunk_tokens:
+        window.append(labeled_paragraphs[idx])
+        token_count = _estimate_tokens("\n".join(window))
+        idx += 1
 
-    # Split document into paragraphs first
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
+    return "\n".join(window)
 
-    if len(paragraphs) < 3:
-        return ["\n\n".join(paragraphs)]
 
-    labeled_paragraphs = [
-        f"ID {i}: {p}" for i, p in enumerate(paragraphs)
-    ]
+def _walk_boundaries(
+    num_paragraphs: int,
+    max_llm_calls: int,
+    boundary_at: Callable[[int], Optional[int]],
+) -> List[int]:
+    """
+    Follow the chain of boundaries from paragraph 0.
 
+    boundary_at(pointer) returns the LLM answer for the window
+    starting at pointer.
+    """
     boundaries: List[int] = []
     pointer = 0
     llm_calls = 0
 
     # Iteratively search for topic shifts
-    while pointer < len(paragraphs) - 2 and llm_calls < max_llm_calls:
-        window: List[str] = []
-        token_count = 0
-        idx = pointer
-
-        while idx < len(labeled_paragraphs) and token_count < max_chunk_tokens:
-            window.append(labeled_paragraphs[idx])
-            token_count = _estimate_tokens("\n".join(window))
-            idx += 1
-
-        prompt = "\n".join(window)
-        boundary = _query_llm_boundary(client, prompt)
+    while pointer < num_paragraphs - 2 and llm_calls < max_llm_calls:
+        boundary = boundary_at(pointer)
 
         llm_calls += 1
 
@@ -115,19 +139,159 @@ def query_fitted_splitter(
             boundaries.append(boundary)
             pointer = boundary
 
-    boundaries.append(len(paragraphs))
+    boundaries.append(num_paragraphs)
 
-    # Assemble final chunks
-    chunks: List[str] = []
-    start = 0
+    return boundaries
+
+
+class _SpeculativeBoundaries:
+    """
+    Answers boundary_at(pointer) while keeping other windows in flight.
+
+    Besides the requested pointer, it submits windows at the pointers
+    the walk is likely to reach next, guessed from the average jump
+    seen so far and the pointer + 1 fallback. Each pointer is sent to
+    the LLM at most once, so the walk sees exactly the answers a
+    sequential run would.
+    """
 
-    for end in boundaries:
-        chunk = "\n\n".join(paragraphs[start:end])
-        if chunk.strip():
-            chunks.append(chunk)
-        start = end
+    def __init__(
+        self,
+        pool: ThreadPoolExecutor,
+        query_window: Callable[[int], Optional[int]],
+        num_paragraphs: int,
+        speculation: int,
+        initial_stride: int,
+    ):
+        self.pool = pool
+        self.query_window = query_window
+        self.num_paragraphs = num_paragraphs
+        self.speculation = speculation
+        self.jumps: List[int] = [max(1, initial_stride)]
+        self.futures: Dict[int, Future] = {}
+
+    def _submit(self, pointer: int) -> None:
+        if pointer not in self.futures and pointer < self.num_paragraphs - 2:
+            self.futures[pointer] = self.pool.submit(bind(self.query_window), pointer)
+
+    def __call__(self, pointer: int) -> Optional[int]:
+        self._submit(pointer)
+
+        stride = max(1, round(sum(self.jumps) / len(self.jumps)))
+        pending = sum(1 for f in self.futures.values() if not f.done())
+
+        # Most likely next pointers: one stride ahead, the fallback
+        # pointer + 1, the neighbours of the stride guess, then further strides
+        candidates = [
+            pointer + stride,
+            pointer + 1,
+            pointer + stride - 1,
+            pointer + stride + 1,
+        ]
+        candidates += [pointer + step * stride for step in range(2, self.speculation)]
+
+        for candidate in candidates:
+            if pending >= self.speculation:
+                break
+            if candidate > pointer and candidate not in self.futures:
+                self._submit(candidate)
+                pending += 1
+
+        boundary = self.futures[pointer].result()
+
+        if boundary is not None and boundary > pointer:
+            self.jumps.append(boundary - pointer)
+
+        return boundary
 
-    return chunks
+
+# Query-fitted chunking
+def query_fitted_splitter(
+    text: str,
+    query: Optional[str] = None,
+    max_chunk_tokens: int = 600,
+    max_llm_calls: int = 20,
+    speculation: int = 1,
+    cache: Optional[ResponseCache] = None,
+    client: Optional[OpenAI] = None,
+    model: str = BOUNDARY_MODEL,
+) -> ChunkStore:
+    """
+    Split a document into chunks using an LLM to suggest
+    semantic boundary points.
+
+    This is intentionally conservative and limited in scope. Only the
+    document is shown to the LLM, so the chunks do not depend on any
+    query and one chunking can serve them all; query is ignored and
+    kept only so existing positional calls still work.
+
+    With speculation > 1, up to that many windows are sent to the
+    LLM at once. Boundaries are identical to the sequential run, at
+    the cost of some windows whose answers end up unused: those not
+    yet sent when the walk ends are dropped, those already in flight
+    are waited for (and cached, when a cache is given).
+
+    With a cache, windows already answered in earlier runs are not
+    sent to the LLM again. client replaces the OpenAI client built
+    from OPENAI_API_KEY, e.g. with an offline stand-in; model names
+    what answers, and keys the cache, so give a stand-in its own.
+    """
+    if speculation < 1:
+        raise ValueError("speculation must be at least 1")
+
+    if client is None:
+        from openai import OpenAI
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if api_key is None:
+            raise RuntimeError("OPENAI_API_KEY not set")
+
+        client = OpenAI(api_key=api_key)
+
+    # Split document into paragraphs first
+    spans = paragraph_spans(text)
+    paragraphs = [text[start:end] for start, end in spans]
+
+    if len(paragraphs) < 3:
+        return chunks_from_boundaries(text, spans, [len(paragraphs)])
+
+    labeled_paragraphs = [
+        f"ID {i}: {p}" for i, p in enumerate(paragraphs)
+    ]
+
+    def query_window(pointer: int) -> Optional[int]:
+        prompt = _window_prompt(labeled_paragraphs, pointer, max_chunk_tokens)
+        return _query_llm_boundary(client, prompt, cache=cache, model=model)
+
+    if speculation == 1:
+        boundaries = _walk_boundaries(len(paragraphs), max_llm_calls, query_window)
+    else:
+        # Guess the first stride as half a window
+        first_window = _window_prompt(labeled_paragraphs, 0, max_chunk_tokens)
+        initial_stride = first_window.count("\nID ") // 2 + 1
+
+        pool = ThreadPoolExecutor(max_workers=speculation)
+        try:
+            boundaries = _walk_boundaries(
+                len(paragraphs),
+                max_llm_calls,
+                _SpeculativeBoundaries(
+                    pool,
+                    query_window,
+                    len(paragraphs),
+                    speculation,
+                    initial_stride,
+                ),
+            )
+        finally:
+            # Drop speculative windows that never started, and wait for
+            # those in flight so no call outlives the splitter
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    # Assemble final chunks
+    return chunks_from_boundaries(text, spans, boundaries)
 
 
 """
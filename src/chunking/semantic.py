@@ -0,0 +1,165 @@
+from typing import List, Optional
+
+import numpy as np
+
+from src.cache import EmbeddingCache
+from src.chunk_store import ChunkStore, chunks_from_boundaries, paragraph_spans
+from src.embedding import Embedder, embed_documents
+
+
+# Helpers
+def _estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate, matching the query-fitted chunker.
+    """
+    return int(1.2 * len(text.split()))
+
+
+def boundary_similarities(
+    embeddings: np.ndarray,
+    window: int = 2,
+) -> np.ndarray:
+    """
+    Similarity across each gap between consecutive paragraphs.
+
+    Entry i-1 compares the mean of up to `window` paragraphs before
+    paragraph i with the mean of up to `window` paragraphs from i on.
+    Low values mark likely topic shifts. Returns n - 1 values.
+    """
+    n = embeddings.shape[0]
+    if n < 2:
+        return np.zeros(0, dtype="float32")
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.maximum(norms, 1e-12)
+
+    # Prefix sums give every windowed mean in one pass
+    prefix = np.vstack([np.zeros((1, unit.shape[1])), np.cumsum(unit, axis=0)])
+    gaps = np.arange(1, n)
+    left = prefix[gaps] - prefix[np.maximum(gaps - window, 0)]
+    right = prefix[np.minimum(gaps + window, n)] - prefix[gaps]
+
+    left /= np.maximum(np.linalg.norm(left, axis=1, keepdims=True), 1e-12)
+    right /= np.maximum(np.linalg.norm(right, axis=1, keepdims=True), 1e-12)
+
+    return np.einsum("ij,ij->i", left, right).astype("float32")
+
+
+def _threshold_boundaries(
+    similarities: np.ndarray,
+    token_prefix: np.ndarray,
+    threshold: float,
+    max_chunk_tokens: int,
+) -> List[int]:
+    """
+    Cut at every gap below threshold, then split any chunk that is
+    still over budget at its lowest-similarity gap.
+    """
+    n = len(token_prefix) - 1
+    cuts = [int(i) + 1 for i in np.flatnonzero(similarities < threshold)]
+    segments = list(zip([0] + cuts, cuts + [n]))
+
+    boundaries: List[int] = []
+    while segments:
+        start, end = segments.pop(0)
+        too_long = token_prefix[end] - token_prefix[start] > max_chunk_tokens
+
+        if too_long and end - start > 1:
+            split = start + 1 + int(np.argmin(similarities[start:end - 1]))
+            segments[:0] = [(start, split), (split, end)]
+        else:
+            boundaries.append(end)
+
+    return boundaries
+
+
+def _dp_boundaries(
+    similarities: np.ndarray,
+    token_prefix: np.ndarray,
+    threshold: float,
+    max_chunk_tokens: int,
+) -> List[int]:
+    """
+    Choose cuts that minimize the total (similarity - threshold) over
+    cut gaps, subject to every chunk fitting in max_chunk_tokens.
+
+    Gaps below threshold lower the cost and are cut when the budget
+    allows. Single paragraphs over budget become their own chunk.
+    """
+    n = len(token_prefix) - 1
+    cut_cost = np.concatenate([[0.0], similarities - threshold])
+
+    # Earliest start position allowed for a chunk ending at j
+    earliest = np.searchsorted(token_prefix, token_prefix - max_chunk_tokens, side="left")
+
+    best = np.full(n + 1, np.inf)
+    best[0] = 0.0
+    back = np.zeros(n + 1, dtype="int64")
+
+    for j in range(1, n + 1):
+        lo = min(int(earliest[j]), j - 1)
+        candidates = best[lo:j] + cut_cost[lo:j]
+        i = int(np.argmin(candidates))
+        best[j] = candidates[i]
+        back[j] = lo + i
+
+    boundaries: List[int] = []
+    j = n
+    while j > 0:
+        boundaries.append(j)
+        j = int(back[j])
+
+    return boundaries[::-1]
+
+
+# Embedding-similarity chunking
+def embedding_similarity_splitter(
+    text: str,
+    max_chunk_tokens: int = 600,
+    window: int = 2,
+    method: str = "dp",
+    threshold: Optional[float] = None,
+    percentile: float = 25.0,
+    embedder: Optional[Embedder] = None,
+    cache: Optional[EmbeddingCache] = None,
+) -> ChunkStore:
+    """
+    Split a document at topic shifts found from paragraph embeddings.
+
+    A fast alternative to the LLM-driven query-fitted splitter: all
+    paragraphs are embedded in one batch and boundaries are chosen by
+    thresholding gap similarities ("threshold") or by dynamic
+    programming under the token budget ("dp"). Without an explicit
+    threshold, the given percentile of the gap similarities is used.
+    """
+    if method not in ("threshold", "dp"):
+        raise ValueError(f"Unknown method: {method}")
+
+    # Split document into paragraphs first
+    spans = paragraph_spans(text)
+    paragraphs = [text[start:end] for start, end in spans]
+
+    if len(paragraphs) < 3:
+        return chunks_from_boundaries(text, spans, [len(paragraphs)])
+
+    embeddings = embed_documents(paragraphs, embedder=embedder, cache=cache)
+    similarities = boundary_similarities(embeddings, window=window)
+
+    if threshold is None:
+        threshold = float(np.percentile(similarities, percentile))
+
+    token_prefix = np.concatenate(
+        [[0], np.cumsum([_estimate_tokens(p) for p in paragraphs])]
+    )
+
+    if method == "threshold":
+        boundaries = _threshold_boundaries(
+            similarities, token_prefix, threshold, max_chunk_tokens
+        )
+    else:
+        boundaries = _dp_boundaries(
+            similarities, token_prefix, threshold, max_chunk_tokens
+        )
+
+    # Assemble final chunks
+    return chunks_from_boundaries(text, spans, boundaries)
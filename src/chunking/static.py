@@ -1,6 +1,7 @@
-from typing import List
+from pathlib import Path
+from typing import Iterator, List
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from src.chunk_store import ChunkStore
 
 
 # Static chunking
@@ -8,13 +9,20 @@ def static_text_splitter(
     text: str,
     chunk_size: int = 1000,
     chunk_overlap: int = 200,
-) -> List[str]:
+    source_name: str = "0",
+) -> ChunkStore:
     """
     Split text into fixed chunks using a recursive splitter.
+
+    Chunks are returned as spans into text, whose source is named
+    source_name in the store.
     """
     if chunk_overlap >= chunk_size:
         raise ValueError("chunk_overlap must be smaller than chunk_size")
 
+    # Imported lazily since langchain is slow to load
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
@@ -30,4 +38,119 @@ def static_text_splitter(
         if chunk:
             chunks.append(chunk)
 
-    return chunks
\ No newline at end of file
+    return ChunkStore.from_texts(chunks, source=text, source_name=source_name)
+
+
+# Streaming static chunking
+class TextSpan:
+    """
+    A chunk given by [start, end) character offsets into the source.
+
+    The text is sliced from the shared read buffer only when asked
+    for, so overlapping chunks do not each hold a copy.
+    """
+
+    __slots__ = ("start", "end", "_buffer", "_buffer_start")
+
+    def __init__(self, start: int, end: int, buffer: str, buffer_start: int):
+        self.start = start
+        self.end = end
+        self._buffer = buffer
+        self._buffer_start = buffer_start
+
+    @property
+    def text(self) -> str:
+        return self._buffer[self.start - self._buffer_start:self.end - self._buffer_start]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"TextSpan(start={self.start}, end={self.end})"
+
+
+def _chunk_end(
+    buffer: str,
+    pos: int,
+    chunk_size: int,
+    separators: List[str],
+) -> int:
+    """
+    End of the chunk starting at pos: the last separator that keeps
+    the chunk within chunk_size, or a hard cut if there is none.
+    """
+    limit = pos + chunk_size
+    if limit >= len(buffer):
+        return len(buffer)
+
+    for sep in separators:
+        cut = buffer.rfind(sep, pos + 1, limit)
+        if cut > pos:
+            return cut
+
+    return limit
+
+
+def stream_static_chunks(
+    path: Path,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    read_size: int = 1 << 20,
+) -> Iterator[TextSpan]:
+    """
+    Split a file into fixed-size chunks without loading it whole.
+
+    Chunks end on the coarsest separator that fits, like
+    static_text_splitter, and the next chunk starts up to
+    chunk_overlap characters earlier on a word boundary. Only
+    about read_size + chunk_size characters are held at a time.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+
+    separators = ["\n\n", "\n", " "]
+    buffer = ""
+    buffer_start = 0
+    pos = 0
+    eof = False
+
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        while True:
+            # Keep at least one full chunk ahead of pos in the buffer
+            while not eof and len(buffer) - pos < chunk_size + 1:
+                block = f.read(read_size)
+                if not block:
+                    eof = True
+                    break
+                # Drop text before pos; yielded spans keep their own reference
+                buffer_start += pos
+                buffer = buffer[pos:] + block
+                pos = 0
+
+            # Skip leading whitespace
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+
+            if pos >= len(buffer):
+                return
+
+            end = _chunk_end(buffer, pos, chunk_size, separators)
+
+            # Trim trailing whitespace
+            stripped = end
+            while stripped > pos and buffer[stripped - 1].isspace():
+                stripped -= 1
+
+            yield TextSpan(buffer_start + pos, buffer_start + stripped, buffer, buffer_start)
+
+            if end >= len(buffer) and eof:
+                return
+
+            # Back up by the overlap, then move forward to a word start
+            next_pos = end
+            if chunk_overlap > 0:
+                space = buffer.find(" ", end - chunk_overlap, end)
+                if space > pos:
+                    next_pos = space + 1
+
+            pos = next_pos
@@ -1,12 +1,29 @@
+from __future__ import annotations
+
 import os
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Deque, Dict, Iterable, Iterator, List, Optional, Protocol
 
 import numpy as np
-import cohere
+
+from src.cache import EmbeddingCache
+from src.rate_limit import RateLimiter
+from src.instrumentation import bind, span
+from src.resilience import call_with_retries
+
+# The Cohere SDK is imported on first use so importing this module stays cheap
+if TYPE_CHECKING:
+    import cohere
+
+DEFAULT_COHERE_MODEL = "embed-english-v3.0"
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
 
 # Cohere client
 def _get_client() -> cohere.Client:
+    import cohere
+
     api_key = os.environ.get("COHERE_API_KEY")
     if api_key is None:
         raise RuntimeError("COHERE_API_KEY not set")
@@ -14,46 +31,378 @@ def _get_client() -> cohere.Client:
     return cohere.Client(api_key)
 
 
+def _estimate_tokens(texts: List[str]) -> int:
+    """
+    Rough token estimate for rate limiting a batch.
+    """
+    return int(1.2 * sum(len(t.split()) for t in texts))
+
+
+def _embed_batch(
+    client: cohere.Client,
+    batch: List[str],
+    model: str,
+    input_type: str,
+    limiter: Optional[RateLimiter] = None,
+    max_retries: int = 3,
+) -> List[List[float]]:
+    """
+    Embed one batch through the shared retry and rate-limit layer.
+    """
+    response = call_with_retries(
+        lambda: client.embed(
+            model=model,
+            texts=batch,
+            input_type=input_type,
+        ),
+        provider="cohere",
+        tokens=_estimate_tokens(batch),
+        max_retries=max_retries,
+        limiter=limiter,
+    )
+
+    if len(response.embeddings) != len(batch):
+        raise RuntimeError("Embedding count mismatch")
+
+    return response.embeddings
+
+
+# Embedder backends
+class Embedder(Protocol):
+    """
+    Anything that can turn texts into a float32 (n, dim) matrix.
+
+    input_type is either "search_document" or "search_query".
+    """
+
+    model: str
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        ...
+
+
+class CohereEmbedder:
+    """
+    Remote embeddings through the Cohere API.
+
+    The client is created once on first use and reused afterwards.
+    Without a limiter, batches share the process-wide "cohere" bucket.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_COHERE_MODEL,
+        batch_size: int = 96,
+        max_concurrency: int = 1,
+        limiter: Optional[RateLimiter] = None,
+        max_retries: int = 3,
+    ):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.model = model
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._client: Optional[cohere.Client] = None
+
+    @property
+    def client(self) -> cohere.Client:
+        if self._client is None:
+            self._client = _get_client()
+        return self._client
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        """
+        With max_concurrency > 1, up to that many batches are in flight
+        at once. Output rows always follow the input order.
+        """
+        client = self.client
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        def run(batch: List[str]) -> List[List[float]]:
+            return _embed_batch(
+                client,
+                batch,
+                model=self.model,
+                input_type=input_type,
+                limiter=self.limiter,
+                max_retries=self.max_retries,
+            )
+
+        if self.max_concurrency == 1 or len(batches) == 1:
+            batch_results = [run(batch) for batch in batches]
+        else:
+            # map() yields results in submission order
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                batch_results = list(pool.map(bind(run), batches))
+
+        return np.asarray(
+            [vector for result in batch_results for vector in result],
+            dtype="float32",
+        )
+
+
+class SentenceTransformerEmbedder:
+    """
+    Local CPU embeddings through sentence-transformers.
+
+    Texts are sorted by length and grouped into batches whose padded
+    size stays under max_batch_tokens, so short texts are not padded
+    to the length of the longest one in the corpus.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_LOCAL_MODEL,
+        batch_size: int = 64,
+        max_batch_tokens: int = 16384,
+        num_threads: Optional[int] = None,
+        query_prefix: str = "",
+        document_prefix: str = "",
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.num_threads = num_threads
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self._model = None
+
+    def _load(self):
+        if self._model is None:
+            # Imported lazily since torch is slow to load
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            if self.num_threads is not None:
+                torch.set_num_threads(self.num_threads)
+
+            self._model = SentenceTransformer(self.model, device="cpu")
+        return self._model
+
+    def _length_buckets(self, texts: List[str]) -> List[List[int]]:
+        """
+        Group text positions into length-sorted batches under the token budget.
+        """
+        lengths = [_estimate_tokens([t]) + 2 for t in texts]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+        buckets: List[List[int]] = []
+        current: List[int] = []
+
+        for i in order:
+            # Sorted ascending, so the newest item is the longest in the batch
+            padded = (len(current) + 1) * lengths[i]
+            if current and (
+                len(current) >= self.batch_size or padded > self.max_batch_tokens
+            ):
+                buckets.append(current)
+                current = []
+            current.append(i)
+
+        if current:
+            buckets.append(current)
+
+        return buckets
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        model = self._load()
+        prefix = self.query_prefix if input_type == "search_query" else self.document_prefix
+
+        vectors: Optional[np.ndarray] = None
+
+        for bucket in self._length_buckets(texts):
+            batch_vectors = model.encode(
+                [prefix + texts[i] for i in bucket],
+                batch_size=len(bucket),
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            ).astype("float32", copy=False)
+
+            if vectors is None:
+                vectors = np.empty((len(texts), batch_vectors.shape[1]), dtype="float32")
+            vectors[bucket] = batch_vectors
+
+        return vectors
+
+
+def get_embedder(backend: Optional[str] = None, **kwargs) -> Embedder:
+    """
+    Build an embedder by name ("cohere", "local" or "fake").
+
+    Defaults to the EMBEDDING_BACKEND environment variable, then Cohere.
+    """
+    backend = backend or os.environ.get("EMBEDDING_BACKEND", "cohere")
+
+    if backend == "cohere":
+        return CohereEmbedder(**kwargs)
+    if backend == "local":
+        return SentenceTransformerEmbedder(**kwargs)
+    if backend == "fake":
+        from src.offline_providers import HashEmbedder
+
+        return HashEmbedder(**kwargs)
+
+    raise ValueError(f"Unknown embedding backend: {backend}")
+
+
+def _embed_with_cache(
+    texts: List[str],
+    input_type: str,
+    embedder: Embedder,
+    cache: Optional[EmbeddingCache] = None,
+) -> np.ndarray:
+    """
+    Embed texts, sending only cache misses to the embedder.
+    Each distinct text is embedded once and rows follow the input order.
+    """
+    stage = "embed_documents" if input_type == "search_document" else "embed_query"
+
+    with span(stage):
+        if cache is not None:
+            cached = cache.get_many(embedder.model, input_type, texts)
+        else:
+            cached = [None] * len(texts)
+
+        missing: List[str] = []
+        seen = set()
+        for text, vector in zip(texts, cached):
+            if vector is None and text not in seen:
+                seen.add(text)
+                missing.append(text)
+
+        fresh: Dict[str, np.ndarray] = {}
+
+        if missing:
+            new_vectors = embedder.embed(missing, input_type)
+
+            if len(new_vectors) != len(missing):
+                raise RuntimeError("Embedding count mismatch")
+
+            if cache is not None:
+                cache.put_many(embedder.model, input_type, missing, new_vectors)
+
+            fresh = dict(zip(missing, new_vectors))
+
+        return np.stack([
+            vector if vector is not None else fresh[text]
+            for text, vector in zip(texts, cached)
+        ]).astype("float32", copy=False)
+
+
 # Document embeddings
 def embed_documents(
     texts: List[str],
-    model: str = "embed-english-v3.0",
+    model: str = DEFAULT_COHERE_MODEL,
     batch_size: int = 96,
+    cache: Optional[EmbeddingCache] = None,
+    max_concurrency: int = 1,
+    limiter: Optional[RateLimiter] = None,
+    max_retries: int = 3,
+    embedder: Optional[Embedder] = None,
 ) -> np.ndarray:
     """
     Embed document chunks for retrieval.
 
     This is batched to stay within API limits and
-    to keep memory usage predictable.
+    to keep memory usage predictable. When a cache is given,
+    only texts that are not already cached are sent to the embedder.
+
+    Without an explicit embedder, a Cohere embedder is built
+    from the remaining arguments.
     """
+    if embedder is None:
+        embedder = CohereEmbedder(
+            model=model,
+            batch_size=batch_size,
+            max_concurrency=max_concurrency,
+            limiter=limiter,
+            max_retries=max_retries,
+        )
+
     if not texts:
         # Return a consistent empty array to avoid downstream shape issues
         return np.zeros((0, 0), dtype="float32")
 
-    client = _get_client()
-    embeddings: List[List[float]] = []
+    return _embed_with_cache(texts, "search_document", embedder, cache)
 
-    for start in range(0, len(texts), batch_size):
-        batch = texts[start:start + batch_size]
 
-        response = client.embed(
-            model=model,
-            texts=batch,
-            input_type="search_document",
-        )
+def embed_document_stream(
+    texts: Iterable[str],
+    batch_size: int = 96,
+    cache: Optional[EmbeddingCache] = None,
+    embedder: Optional[Embedder] = None,
+    max_in_flight: int = 2,
+) -> Iterator[np.ndarray]:
+    """
+    Embed texts as they arrive, yielding one (batch, dim) array per batch.
+
+    Batches are sent from a background thread while the caller keeps
+    producing texts, so chunking and embedding overlap. Batches are
+    yielded in input order.
+    """
+    embedder = embedder or CohereEmbedder()
+    pending: Deque = deque()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        batch: List[str] = []
+
+        for text in texts:
+            batch.append(text)
+            if len(batch) < batch_size:
+                continue
+
+            pending.append(pool.submit(
+                bind(_embed_with_cache), batch, "search_document", embedder, cache
+            ))
+            batch = []
 
-        if len(response.embeddings) != len(batch):
-            raise RuntimeError("Embedding count mismatch")
+            # Hand back finished work so at most max_in_flight batches wait
+            while len(pending) >= max_in_flight or (pending and pending[0].done()):
+                yield pending.popleft().result()
 
-        embeddings.extend(response.embeddings)
+        if batch:
+            pending.append(pool.submit(
+                bind(_embed_with_cache), batch, "search_document", embedder, cache
+            ))
 
-    return np.asarray(embeddings, dtype="float32")
+        while pending:
+            yield pending.popleft().result()
+
+
+# Query embeddings
+def embed_queries(
+    queries: List[str],
+    model: str = DEFAULT_COHERE_MODEL,
+    cache: Optional[EmbeddingCache] = None,
+    embedder: Optional[Embedder] = None,
+) -> np.ndarray:
+    """
+    Embed many queries in as few API calls as possible.
+    Returns a (len(queries), dim) matrix.
+    """
+    if any(not q.strip() for q in queries):
+        raise ValueError("Queries must be non-empty")
+
+    if not queries:
+        return np.zeros((0, 0), dtype="float32")
+
+    if embedder is None:
+        embedder = CohereEmbedder(model=model)
+
+    return _embed_with_cache(queries, "search_query", embedder, cache)
 
 
-# Query embedding
 def embed_query(
     query: str,
-    model: str = "embed-english-v3.0",
+    model: str = DEFAULT_COHERE_MODEL,
+    cache: Optional[EmbeddingCache] = None,
+    embedder: Optional[Embedder] = None,
 ) -> np.ndarray:
     """
     Embed a single query for retrieval.
@@ -61,15 +410,4 @@ def embed_query(
     if not query.strip():
         raise ValueError("Query must be non-empty")
 
-    client = _get_client()
-
-    response = client.embed(
-        model=model,
-        texts=[query],
-        input_type="search_query",
-    )
-
-    if not response.embeddings:
-        raise RuntimeError("No embedding returned for query")
-
-    return np.asarray(response.embeddings[0], dtype="float32")
\ No newline at end of file
+    return embed_queries([query], model=model, cache=cache, embedder=embedder)[0]
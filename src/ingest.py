@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src.cache import EmbeddingCache
+from src.chunk_store import ChunkStore
+from src.chunking.static import static_text_splitter
+from src.embedding import Embedder, embed_document_stream
+from src.retrieval import build_faiss_index
+
+# FAISS is imported on first use so importing this module stays cheap
+if TYPE_CHECKING:
+    import faiss
+
+
+class Corpus(NamedTuple):
+    chunks: ChunkStore
+    embeddings: np.ndarray
+    index: faiss.Index
+    stats: Dict[str, float]
+
+
+# Helpers
+def _chunk_file(job: Tuple[Path, int, int]) -> ChunkStore:
+    """
+    Chunk one document. Runs in a worker process.
+    """
+    path, chunk_size, chunk_overlap = job
+    text = path.read_text(encoding="utf-8")
+    # Sources are named after the file so spans identify their document
+    return static_text_splitter(
+        text, chunk_size=chunk_size, chunk_overlap=chunk_overlap, source_name=str(path)
+    )
+
+
+def _build_index(
+    embeddings: np.ndarray,
+    shard_size: Optional[int],
+    index_type: str,
+) -> faiss.Index:
+    """
+    One global index, or per-shard indexes joined with IndexShards.
+
+    Shards hold consecutive chunk rows and use successive ids, so
+    search results are global chunk rows either way.
+    """
+    import faiss
+
+    if shard_size is None or len(embeddings) <= shard_size:
+        return build_faiss_index(embeddings, index_type=index_type)
+
+    index = faiss.IndexShards(embeddings.shape[1], True, True)
+    for start in range(0, len(embeddings), shard_size):
+        index.add_shard(
+            build_faiss_index(embeddings[start:start + shard_size], index_type=index_type)
+        )
+
+    return index
+
+
+# Corpus ingestion
+def ingest_corpus(
+    corpus_dir: Path,
+    pattern: str = "*.txt",
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    workers: Optional[int] = None,
+    embedder: Optional[Embedder] = None,
+    cache: Optional[EmbeddingCache] = None,
+    batch_size: int = 96,
+    shard_size: Optional[int] = None,
+    index_type: str = "flat",
+) -> Corpus:
+    """
+    Chunk, embed and index every matching document under corpus_dir.
+
+    Documents are chunked in a process pool. Their chunks are streamed
+    into batched embedding as each document finishes, so embedding
+    overlaps with chunking of the rest. Returns the global ChunkStore
+    (row -> document and span), the chunk embeddings, an index whose
+    ids are those rows, and throughput statistics.
+    """
+    paths = sorted(p for p in Path(corpus_dir).rglob(pattern) if p.is_file())
+    if not paths:
+        raise ValueError(f"No documents matching {pattern} in {corpus_dir}")
+
+    start = time.perf_counter()
+    stores: List[ChunkStore] = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [(path, chunk_size, chunk_overlap) for path in paths]
+
+        def chunk_texts() -> Iterator[str]:
+            # map() returns documents in order as workers finish them
+            for store in pool.map(_chunk_file, jobs):
+                stores.append(store)
+                yield from store
+
+        batches = list(embed_document_stream(
+            chunk_texts(),
+            batch_size=batch_size,
+            cache=cache,
+            embedder=embedder,
+        ))
+
+    embed_done = time.perf_counter()
+
+    chunks = ChunkStore.concat(stores)
+    embeddings = np.vstack(batches)
+    index = _build_index(embeddings, shard_size, index_type)
+
+    done = time.perf_counter()
+    elapsed = done - start
+
+    stats = {
+        "documents": len(paths),
+        "chunks": len(chunks),
+        "shards": index.count() if hasattr(index, "add_shard") else 1,
+        "chunk_and_embed_seconds": embed_done - start,
+        "index_seconds": done - embed_done,
+        "total_seconds": elapsed,
+        "documents_per_second": len(paths) / elapsed,
+        "chunks_per_second": len(chunks) / elapsed,
+    }
+
+    return Corpus(chunks=chunks, embeddings=embeddings, index=index, stats=stats)
@@ -0,0 +1,207 @@
+import contextvars
+import functools
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+# Stage names used by the pipelines, in pipeline order
+STAGES = (
+    "chunking",
+    "query_llm_boundary",
+    "embed_documents",
+    "build_faiss_index",
+    "embed_query",
+    "retrieve_top_k",
+    "rerank",
+)
+
+_COUNTERS = ("count", "seconds", "api_calls", "input_tokens", "retries", "failures")
+
+
+# Helpers
+def peak_rss_mb() -> Optional[float]:
+    """
+    Peak resident memory of this process in MB, if the platform reports it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+# Traces
+class Trace:
+    """
+    Wall time and remote-call counters per stage for one run.
+
+    Stage times are inclusive, so a stage nested in another (a
+    boundary query inside chunking) is counted in both, and spans on
+    concurrent threads add up, so stage seconds can exceed wall time.
+    Remote calls made through call_with_retries are charged to the
+    innermost open stage, and also counted per provider in providers
+    (stage -> provider -> counters). Safe to update from several threads.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.providers: Dict[str, Dict[str, Dict[str, float]]] = {}
+        self.wall_seconds = 0.0
+        self.peak_rss_mb: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, provider: Optional[str] = None, **deltas: float) -> None:
+        with self._lock:
+            counters = self.stages.setdefault(stage, dict.fromkeys(_COUNTERS, 0))
+            for name, delta in deltas.items():
+                counters[name] += delta
+
+            if provider is not None:
+                by_provider = self.providers.setdefault(stage, {}).setdefault(provider, {})
+                for name, delta in deltas.items():
+                    by_provider[name] = by_provider.get(name, 0) + delta
+
+    def as_dict(self, shared_by: int = 1) -> Dict:
+        """
+        Trace as a run record field; with shared_by, every number is
+        this run's share when the trace covers that many queries.
+        """
+        with self._lock:
+            stages = {
+                stage: {name: value / shared_by for name, value in counters.items()}
+                for stage, counters in self.stages.items()
+            }
+            providers = {
+                stage: {
+                    provider: {name: value / shared_by for name, value in counters.items()}
+                    for provider, counters in by_provider.items()
+                }
+                for stage, by_provider in self.providers.items()
+            }
+        return {
+            "wall_seconds": self.wall_seconds / shared_by,
+            "peak_rss_mb": self.peak_rss_mb,
+            "shared_by": shared_by,
+            "stages": stages,
+            "providers": providers,
+        }
+
+
+_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_open_stages: contextvars.ContextVar[Tuple[str, ...]] = contextvars.ContextVar("open_stages", default=())
+
+
+@contextmanager
+def start_trace() -> Iterator[Trace]:
+    """
+    Collect spans and counters from this context into a new Trace.
+
+    Peak memory is the process peak when the trace closes.
+    """
+    trace = Trace()
+    token = _trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace.wall_seconds = time.perf_counter() - start
+        trace.peak_rss_mb = peak_rss_mb()
+        _trace.reset(token)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """
+    Time a stage into the current trace; a no-op without one.
+
+    Re-entering the stage that is already innermost (embed_query
+    calling embed_queries) is not counted twice.
+    """
+    trace = _trace.get()
+    stages = _open_stages.get()
+
+    if trace is None or (stages and stages[-1] == stage):
+        yield
+        return
+
+    token = _open_stages.set(stages + (stage,))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, count=1, seconds=time.perf_counter() - start)
+        _open_stages.reset(token)
+
+
+def traced(stage: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Decorator running every call of a function in span(stage).
+    """
+    def decorate(fn: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs) -> T:
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(provider: Optional[str] = None, **deltas: float) -> None:
+    """
+    Add to the counters of the innermost open stage, if any, and to
+    that stage's counters for provider when one is given.
+    """
+    trace = _trace.get()
+    if trace is not None:
+        stages = _open_stages.get()
+        trace.add(stages[-1] if stages else "other", provider=provider, **deltas)
+
+
+def bind(fn: Callable[..., T]) -> Callable[..., T]:
+    """
+    Run fn in the caller's trace and open stages when it is called
+    from a worker thread. Needed for ThreadPoolExecutor, which does
+    not carry context variables over.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs) -> T:
+        # A context can only be entered by one thread at a time
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+# Profiling
+@contextmanager
+def profile_run(path: Optional[Path]) -> Iterator[None]:
+    """
+    Dump cProfile stats for the enclosed code to path (for pstats or
+    snakeviz). Does nothing when path is None.
+    """
+    if path is None:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(path))
@@ -0,0 +1,383 @@
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.cache import _atomic_write_json, text_hash
+from src.resilience import call_with_retries
+
+_TOKEN = re.compile(r"\w+")
+_PARAGRAPH = re.compile(r"^ID (\d+): (.*)$", re.MULTILINE)
+
+
+# Fault injection
+class FakeProviderError(Exception):
+    """
+    Injected transient failure; retried like a 503 from a real provider.
+    """
+
+    status_code = 503
+
+
+class _Faults:
+    """
+    Fixed latency and a seeded error rate shared by a fake's calls.
+    """
+
+    def __init__(self, latency: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def inject(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            fail = self._rng.random() < self.error_rate
+        if fail:
+            raise FakeProviderError("injected failure")
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+# Fake providers
+class HashEmbedder:
+    """
+    Deterministic embeddings from hashed word counts, for offline runs.
+
+    Each token adds +-1 to one of dim buckets chosen by its CRC32,
+    and vectors are L2-normalized, so texts sharing words are close.
+    Batches go through call_with_retries like the real backends, with
+    optional injected latency and transient errors.
+    """
+
+    def __init__(
+        self,
+        model: str = "fake-hash-embed",
+        dim: int = 256,
+        batch_size: int = 96,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        max_retries: int = 3,
+        retry_delay: float = 0.01,
+    ):
+        self.model = model
+        self.dim = dim
+        self.batch_size = batch_size
+        self.seed = seed
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._faults = _Faults(latency, error_rate, seed)
+        self._buckets: Dict[str, int] = {}
+
+    def _bucket(self, token: str) -> int:
+        """
+        Signed 1-based bucket of a token: the dimension is abs(bucket) - 1.
+        """
+        bucket = self._buckets.get(token)
+        if bucket is None:
+            h = zlib.crc32(token.encode("utf-8"), self.seed)
+            # Low bits pick the dimension, the top bit the sign
+            bucket = (h % self.dim + 1) * (1 if h >> 31 else -1)
+            self._buckets[token] = bucket
+        return bucket
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        self._faults.inject()
+        vectors = np.zeros((len(texts), self.dim), dtype="float32")
+
+        for row, text in enumerate(texts):
+            buckets = np.fromiter((self._bucket(t) for t in _tokens(text)), dtype="int64")
+            if len(buckets) == 0:
+                vectors[row, 0] = 1.0
+                continue
+            vectors[row] = np.bincount(
+                np.abs(buckets) - 1, weights=np.sign(buckets), minlength=self.dim
+            )
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return vectors
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if not batches:
+            return np.zeros((0, self.dim), dtype="float32")
+
+        return np.vstack([
+            call_with_retries(
+                lambda batch=batch: self._embed_batch(batch),
+                provider="fake",
+                tokens=sum(len(t.split()) for t in batch),
+                max_retries=self.max_retries,
+                base_delay=self.retry_delay,
+            )
+            for batch in batches
+        ])
+
+
+class ScriptedReranker:
+    """
+    Reranker returning scripted scores, for offline runs.
+
+    scores[query][document] is used when present; any other pair is
+    scored by word overlap (cosine over word sets), which is
+    deterministic and puts lexically close chunks first.
+    """
+
+    def __init__(
+        self,
+        model: str = "fake-rerank",
+        scores: Optional[Dict[str, Dict[str, float]]] = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+        max_retries: int = 3,
+        retry_delay: float = 0.01,
+    ):
+        self.model = model
+        self.scores = scores or {}
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._faults = _Faults(latency, error_rate, seed)
+
+    def _score(self, query: str, documents: List[str]) -> np.ndarray:
+        self._faults.inject()
+        scripted = self.scores.get(query, {})
+        query_words = set(_tokens(query))
+
+        scores = np.zeros(len(documents))
+        for i, document in enumerate(documents):
+            if document in scripted:
+                scores[i] = scripted[document]
+                continue
+            words = set(_tokens(document))
+            if words and query_words:
+                scores[i] = len(words & query_words) / np.sqrt(len(words) * len(query_words))
+        return scores
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        return call_with_retries(
+            lambda: self._score(query, documents),
+            provider="fake",
+            tokens=sum(len(d.split()) for d in documents),
+            max_retries=self.max_retries,
+            base_delay=self.retry_delay,
+        )
+
+
+def _completion(content: str) -> SimpleNamespace:
+    """
+    Minimal object shaped like an OpenAI chat completion.
+    """
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeChatClient:
+    """
+    Stand-in for the OpenAI client that answers boundary prompts.
+
+    The answer is the first paragraph (after the first) whose word
+    overlap with the one before drops under shift_threshold, or the
+    last paragraph in the window when there is none. answer may
+    replace this with a function of the prompt. Exposes
+    chat.completions.create like the real client; model is the name
+    to cache its answers under, distinct from any real model, and
+    calls are counted under the "fake" provider.
+    """
+
+    provider = "fake"
+
+    def __init__(
+        self,
+        model: str = "fake-boundary",
+        shift_threshold: float = 0.1,
+        answer: Optional[Callable[[str], str]] = None,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.model = model
+        self.shift_threshold = shift_threshold
+        self.answer = answer or self._boundary_answer
+        self.calls = 0
+        self._faults = _Faults(latency, error_rate, seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _boundary_answer(self, prompt: str) -> str:
+        paragraphs = [(int(i), set(_tokens(text))) for i, text in _PARAGRAPH.findall(prompt)]
+        if len(paragraphs) < 2:
+            return "Answer: none"
+
+        for (_, before), (pid, words) in zip(paragraphs, paragraphs[1:]):
+            union = before | words
+            if union and len(before & words) / len(union) < self.shift_threshold:
+                return f"Answer: ID {pid}"
+
+        return f"Answer: ID {paragraphs[-1][0]}"
+
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs) -> SimpleNamespace:
+        self.calls += 1
+        self._faults.inject()
+        return _completion(self.answer(messages[-1]["content"]))
+
+
+# Record/replay cassettes
+class CassetteMiss(KeyError):
+    """
+    A replayed request that was never recorded. Not retried.
+    """
+
+
+class Cassette:
+    """
+    Recorded provider responses, keyed by request.
+
+    In "record" mode responses from the wrapped providers are stored
+    and written out by save(); in "replay" mode they are served from
+    the file and an unrecorded request raises CassetteMiss. Embeddings
+    and rerank scores are stored per text, so replay does not depend
+    on how requests were batched.
+    """
+
+    KINDS = ("embed", "rerank", "chat")
+
+    def __init__(self, path: Path, mode: str = "replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+
+        self.path = Path(path)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.data: Dict[str, Dict] = {kind: {} for kind in self.KINDS}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+        elif mode == "replay":
+            raise FileNotFoundError(f"No cassette at {self.path}")
+
+    @staticmethod
+    def key(*parts) -> str:
+        return text_hash(json.dumps(parts, sort_keys=True))
+
+    def get(self, kind: str, key: str):
+        with self._lock:
+            value = self.data[kind].get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if value is None and self.mode == "replay":
+            raise CassetteMiss(f"{kind} request not in cassette {self.path}")
+        return value
+
+    def put(self, kind: str, key: str, value) -> None:
+        with self._lock:
+            self.data[kind][key] = value
+
+    def save(self) -> None:
+        if self.mode == "record":
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._lock:
+                _atomic_write_json(self.path, self.data)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CassetteEmbedder:
+    """
+    Embedder that records from (or replays instead of) inner.
+    """
+
+    def __init__(self, cassette: Cassette, inner=None, model: Optional[str] = None):
+        self.cassette = cassette
+        self.inner = inner
+        self.model = inner.model if inner is not None else model or "cassette"
+
+    def embed(self, texts: List[str], input_type: str) -> np.ndarray:
+        keys = [Cassette.key(self.model, input_type, t) for t in texts]
+        vectors = [self.cassette.get("embed", k) for k in keys]
+
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = self.inner.embed([texts[i] for i in missing], input_type)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = [float(x) for x in vector]
+                self.cassette.put("embed", keys[i], vectors[i])
+
+        return np.asarray(vectors, dtype="float32")
+
+
+class CassetteReranker:
+    """
+    Reranker that records from (or replays instead of) inner.
+    """
+
+    def __init__(self, cassette: Cassette, inner=None, model: Optional[str] = None):
+        self.cassette = cassette
+        self.inner = inner
+        self.model = inner.model if inner is not None else model or "cassette"
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        keys = [Cassette.key(self.model, query, d) for d in documents]
+        scores = [self.cassette.get("rerank", k) for k in keys]
+
+        missing = [i for i, s in enumerate(scores) if s is None]
+        if missing:
+            fresh = self.inner.score(query, [documents[i] for i in missing])
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                self.cassette.put("rerank", keys[i], scores[i])
+
+        return np.asarray(scores)
+
+
+class CassetteChatClient:
+    """
+    Chat client that records from (or replays instead of) inner.
+
+    Calls are counted under inner's provider when recording and under
+    "cassette" when replaying.
+    """
+
+    def __init__(self, cassette: Cassette, inner=None):
+        self.cassette = cassette
+        self.inner = inner
+        self.provider = getattr(inner, "provider", "openai") if inner is not None else "cassette"
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: List[Dict[str, str]], temperature: float = 1.0, **kwargs):
+        key = Cassette.key(model, messages, temperature)
+        content = self.cassette.get("chat", key)
+
+        if content is None:
+            response = self.inner.chat.completions.create(
+                model=model, messages=messages, temperature=temperature, **kwargs
+            )
+            content = response.choices[0].message.content or ""
+            self.cassette.put("chat", key, content)
+
+        return _completion(content)
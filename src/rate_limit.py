@@ -0,0 +1,83 @@
+import threading
+import time
+from typing import Optional
+
+
+# Token bucket
+class RateLimiter:
+    """
+    Thread-safe limiter for requests per second and tokens per minute.
+
+    Callers block in acquire() until both budgets allow the request.
+    A limit of None disables that budget.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = None,
+        tokens_per_minute: Optional[int] = None,
+    ):
+        if requests_per_second is not None and requests_per_second <= 0:
+            raise ValueError("requests_per_second must be positive")
+        if tokens_per_minute is not None and tokens_per_minute <= 0:
+            raise ValueError("tokens_per_minute must be positive")
+
+        self.requests_per_second = requests_per_second
+        self.tokens_per_minute = tokens_per_minute
+
+        # Allow a one second burst of requests and a full minute of tokens
+        self._request_capacity = max(1.0, requests_per_second or 0.0)
+        self._request_allowance = self._request_capacity
+        self._token_allowance = float(tokens_per_minute or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last
+        self._last = now
+
+        if self.requests_per_second is not None:
+            self._request_allowance = min(
+                self._request_capacity,
+                self._request_allowance + elapsed * self.requests_per_second,
+            )
+
+        if self.tokens_per_minute is not None:
+            self._token_allowance = min(
+                float(self.tokens_per_minute),
+                self._token_allowance + elapsed * self.tokens_per_minute / 60.0,
+            )
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Block until one request of the given token size may be sent.
+        Returns the number of seconds spent waiting.
+        """
+        if self.tokens_per_minute is not None:
+            # A single request larger than the bucket would wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+
+                wait = 0.0
+                if self.requests_per_second is not None and self._request_allowance < 1:
+                    wait = (1 - self._request_allowance) / self.requests_per_second
+                if self.tokens_per_minute is not None and self._token_allowance < tokens:
+                    wait = max(
+                        wait,
+                        (tokens - self._token_allowance) * 60.0 / self.tokens_per_minute,
+                    )
+
+                if wait == 0.0:
+                    if self.requests_per_second is not None:
+                        self._request_allowance -= 1
+                    if self.tokens_per_minute is not None:
+                        self._token_allowance -= tokens
+                    return waited
+
+            time.sleep(wait)
+            waited += wait
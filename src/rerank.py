@@ -1,37 +1,333 @@
+from __future__ import annotations
+
 import os
-import cohere
-from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+from src.cache import RerankCache
+from src.instrumentation import bind, traced
+from src.resilience import call_with_retries
+
+# The Cohere SDK and .env are loaded on first use, not at import
+if TYPE_CHECKING:
+    import cohere
+
+DEFAULT_RERANK_MODEL = "rerank-english-v3.0"
+DEFAULT_LOCAL_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+_client: Optional[cohere.Client] = None
+
+
+# Cohere client
+def _get_client() -> cohere.Client:
+    """
+    Build the Cohere client on first use and reuse it afterwards.
+    """
+    global _client
+
+    if _client is None:
+        import cohere
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = os.environ.get("COHERE_API_KEY")
+        if api_key is None:
+            raise RuntimeError("COHERE_API_KEY not set")
+        _client = cohere.Client(api_key)
+
+    return _client
+
+
+# Helpers
+def truncate_document(document: str, max_tokens: int) -> str:
+    """
+    Cut a document to roughly max_tokens, using the same 1.2 tokens
+    per word estimate as the chunkers.
+    """
+    words = document.split()
+    max_words = max(1, int(max_tokens / 1.2))
+    if len(words) <= max_words:
+        return document
+    return " ".join(words[:max_words])
+
+
+def _estimate_tokens(text: str) -> int:
+    return int(1.2 * len(text.split()))
+
+
+# Reranker backends
+class Reranker(Protocol):
+    """
+    Anything that can score documents against a query.
+
+    score returns one relevance score per document, in input order;
+    higher is more relevant.
+    """
+
+    model: str
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        ...
+
+
+class CohereReranker:
+    """
+    Remote reranking through the Cohere API.
+    """
+
+    def __init__(self, model: str = DEFAULT_RERANK_MODEL, max_retries: int = 3):
+        self.model = model
+        self.max_retries = max_retries
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        co = _get_client()
+
+        resp = call_with_retries(
+            lambda: co.rerank(
+                model=self.model,
+                query=query,
+                documents=documents,
+                top_n=len(documents),
+            ),
+            provider="cohere",
+            tokens=sum(_estimate_tokens(d) for d in documents),
+            max_retries=self.max_retries,
+        )
+
+        scores = np.zeros(len(documents))
+        for r in resp.results:
+            scores[r.index] = r.relevance_score
+        return scores
+
+
+class CrossEncoderReranker:
+    """
+    Local CPU reranking with a sentence-transformers CrossEncoder.
+
+    (query, document) pairs are sorted by length and grouped into
+    batches whose padded size stays under max_batch_tokens, so short
+    chunks are not padded to the longest one. num_threads caps torch
+    threads in this process.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_LOCAL_RERANK_MODEL,
+        batch_size: int = 32,
+        max_batch_tokens: int = 8192,
+        num_threads: Optional[int] = None,
+    ):
+        self.model = model
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.num_threads = num_threads
+        self._model = None
 
-from dotenv import load_dotenv
-load_dotenv()
+    def _load(self):
+        if self._model is None:
+            # Imported lazily since torch is slow to load
+            import torch
+            from sentence_transformers import CrossEncoder
 
-co = cohere.Client(os.environ["COHERE_API_KEY"])
+            if self.num_threads is not None:
+                torch.set_num_threads(self.num_threads)
 
+            self._model = CrossEncoder(self.model, device="cpu")
+        return self._model
 
+    def _length_buckets(self, query: str, documents: List[str]) -> List[List[int]]:
+        """
+        Group document positions into length-sorted batches under the token budget.
+        """
+        query_tokens = _estimate_tokens(query) + 3
+        lengths = [query_tokens + _estimate_tokens(d) for d in documents]
+        order = sorted(range(len(documents)), key=lambda i: lengths[i])
+
+        buckets: List[List[int]] = []
+        current: List[int] = []
+
+        for i in order:
+            # Sorted ascending, so the newest item is the longest in the batch
+            padded = (len(current) + 1) * lengths[i]
+            if current and (
+                len(current) >= self.batch_size or padded > self.max_batch_tokens
+            ):
+                buckets.append(current)
+                current = []
+            current.append(i)
+
+        if current:
+            buckets.append(current)
+
+        return buckets
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        model = self._load()
+        scores = np.zeros(len(documents))
+
+        for bucket in self._length_buckets(query, documents):
+            scores[bucket] = model.predict(
+                [(query, documents[i]) for i in bucket],
+                batch_size=len(bucket),
+                show_progress_bar=False,
+            )
+
+        return scores
+
+
+def get_reranker(backend: Optional[str] = None, **kwargs) -> Reranker:
+    """
+    Build a reranker by name ("cohere", "local" or "fake").
+
+    Defaults to the RERANK_BACKEND environment variable, then Cohere.
+    """
+    backend = backend or os.environ.get("RERANK_BACKEND", "cohere")
+
+    if backend == "cohere":
+        return CohereReranker(**kwargs)
+    if backend == "local":
+        return CrossEncoderReranker(**kwargs)
+    if backend == "fake":
+        from src.offline_providers import ScriptedReranker
+
+        return ScriptedReranker(**kwargs)
+
+    raise ValueError(f"Unknown rerank backend: {backend}")
+
+
+# Process pool workers for local reranking
+_worker_reranker: Optional[CrossEncoderReranker] = None
+
+
+def _init_worker(model: str, batch_size: int, max_batch_tokens: int, num_threads: int) -> None:
+    global _worker_reranker
+    _worker_reranker = CrossEncoderReranker(
+        model,
+        batch_size=batch_size,
+        max_batch_tokens=max_batch_tokens,
+        num_threads=num_threads,
+    )
+
+
+def _worker_score(job: Tuple[str, List[str]]) -> np.ndarray:
+    query, documents = job
+    return _worker_reranker.score(query, documents)
+
+
+# Reranking
 def rerank(
     query: str,
     documents: List[str],
-    model: str = "rerank-english-v3.0",
+    model: str = DEFAULT_RERANK_MODEL,
     top_n: int = 5,
-) -> List[Tuple[str, float, int]]:
+    max_retries: int = 3,
+    cache: Optional[RerankCache] = None,
+    max_doc_tokens: Optional[int] = None,
+    reranker: Optional[Reranker] = None,
+) -> List[Tuple[int, float, str]]:
     """
-    Rerank candidate documents using Cohere cross-encoder.
+    Rerank candidate documents, by default with the Cohere cross-encoder.
+
+    With a cache, scores already known for (model, query, document)
+    are reused and only the remaining documents are scored. Documents
+    are cut to max_doc_tokens before scoring when it is given.
 
     Returns:
-        List of (document_text, relevance_score)
+        List of (document_index, relevance_score, document_text)
     """
+    return rerank_many(
+        [query],
+        [documents],
+        model=model,
+        top_n=top_n,
+        max_retries=max_retries,
+        cache=cache,
+        max_doc_tokens=max_doc_tokens,
+        reranker=reranker,
+        max_concurrency=1,
+    )[0]
 
-    if len(documents) == 0:
-        return []
 
-    resp = co.rerank(
-        model=model,
-        query=query,
-        documents=documents,
-        top_n=min(top_n, len(documents)),
-    )
+@traced("rerank")
+def rerank_many(
+    queries: Sequence[str],
+    documents: Sequence[List[str]],
+    model: str = DEFAULT_RERANK_MODEL,
+    top_n: int = 5,
+    max_retries: int = 3,
+    cache: Optional[RerankCache] = None,
+    max_doc_tokens: Optional[int] = None,
+    reranker: Optional[Reranker] = None,
+    max_concurrency: int = 4,
+    processes: Optional[int] = None,
+) -> List[List[Tuple[int, float, str]]]:
+    """
+    Rerank the candidates of many queries at once.
+
+    documents[i] holds the candidates for queries[i]. Cached scores are
+    looked up first and only the rest are scored, on up to
+    max_concurrency threads (sharing the Cohere rate limiter) or, for
+    a local CrossEncoderReranker, on a pool of processes that each load
+    the model with their share of the CPU threads. Results are returned
+    in query order.
+    """
+    if len(queries) != len(documents):
+        raise ValueError("queries and documents must have the same length")
+
+    reranker = reranker or CohereReranker(model=model, max_retries=max_retries)
+
+    sent = [
+        [truncate_document(d, max_doc_tokens) for d in docs]
+        if max_doc_tokens is not None
+        else list(docs)
+        for docs in documents
+    ]
+
+    # Look up cached scores; only missing documents are scored
+    scores: List[List[Optional[float]]] = []
+    missing: List[List[int]] = []
+    for query, docs in zip(queries, sent):
+        known = cache.get_many(reranker.model, query, docs) if cache else [None] * len(docs)
+        scores.append(known)
+        missing.append([i for i, score in enumerate(known) if score is None])
+
+    pending = [q for q in range(len(queries)) if missing[q]]
+    jobs = [(queries[q], [sent[q][i] for i in missing[q]]) for q in pending]
+
+    if processes is not None and processes > 1 and len(jobs) > 1:
+        if not isinstance(reranker, CrossEncoderReranker):
+            raise ValueError("Process fan-out needs a local CrossEncoderReranker")
+
+        threads = reranker.num_threads or max(1, (os.cpu_count() or 1) // processes)
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(reranker.model, reranker.batch_size, reranker.max_batch_tokens, threads),
+        ) as pool:
+            fresh = list(pool.map(_worker_score, jobs))
+    elif max_concurrency > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            fresh = list(pool.map(bind(lambda job: reranker.score(*job)), jobs))
+    else:
+        fresh = [reranker.score(*job) for job in jobs]
+
+    for q, new_scores in zip(pending, fresh):
+        for i, score in zip(missing[q], new_scores):
+            scores[q][i] = float(score)
+        if cache is not None:
+            cache.put_many(
+                reranker.model,
+                queries[q],
+                [sent[q][i] for i in missing[q]],
+                [float(s) for s in new_scores],
+            )
+
+    results = []
+    for q, docs in enumerate(documents):
+        # Ties keep the original retrieval order
+        order = sorted(range(len(docs)), key=lambda i: -scores[q][i])
+        results.append([(i, scores[q][i], docs[i]) for i in order[:top_n]])
 
-    return [
-        (r.index,  r.relevance_score ,documents[r.index])
-        for r in resp.results
-    ]
\ No newline at end of file
+    return results
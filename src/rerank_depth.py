@@ -0,0 +1,160 @@
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+
+DEPTH_POLICIES = ("fixed", "gap", "relative", "calibrated")
+
+# Saved next to a pipeline's results by analysis/rerank_depth_tradeoff.py
+CALIBRATION_NAME = "rerank_calibration.npy"
+
+
+# Helpers
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _calibration_features(scores: np.ndarray) -> np.ndarray:
+    """
+    Per-candidate features: score, distance below the top score and a bias.
+    """
+    top = scores[:, :1]
+    return np.stack([scores, top - scores, np.ones_like(scores)], axis=-1)
+
+
+# Adaptive rerank depth
+def rerank_depths(
+    scores: np.ndarray,
+    policy: str = "fixed",
+    min_k: int = 5,
+    max_k: Optional[int] = None,
+    min_gap: float = 0.05,
+    ratio: float = 0.9,
+    calibration: Optional[np.ndarray] = None,
+    min_probability: float = 0.05,
+) -> np.ndarray:
+    """
+    Number of first-stage candidates to send to the reranker, per query.
+
+    scores is the (nq, k) score matrix from retrieval, best first and
+    padded with -inf. Policies:
+
+    - "fixed": always max_k.
+    - "gap": cut at the largest drop between consecutive scores in
+      ranks min_k..max_k, if that drop is at least min_gap.
+    - "relative": keep candidates scoring at least ratio of the way
+      from 0 to the top score.
+    - "calibrated": keep candidates whose relevance probability under
+      a fitted calibration (see fit_depth_calibration) is at least
+      min_probability.
+
+    Depths are clipped to [min_k, max_k] and to the candidates present.
+    """
+    if policy not in DEPTH_POLICIES:
+        raise ValueError(f"Unknown rerank depth policy: {policy}")
+
+    scores = np.asarray(scores, dtype="float64")
+    nq, k = scores.shape
+    max_k = min(max_k or k, k)
+    min_k = min(min_k, max_k)
+    available = np.isfinite(scores).sum(axis=1)
+
+    if policy == "fixed" or nq == 0:
+        depths = np.full(nq, max_k)
+
+    elif policy == "gap":
+        window = scores[:, :max_k]
+        with np.errstate(invalid="ignore"):
+            drops = window[:, :-1] - window[:, 1:]
+        # Cutting after rank c (keeping c candidates) uses drop c - 1
+        drops[:, :max(min_k - 1, 0)] = -np.inf
+        drops[~np.isfinite(drops)] = -np.inf
+
+        if drops.shape[1] == 0:
+            depths = np.full(nq, max_k)
+        else:
+            best = np.argmax(drops, axis=1)
+            largest = drops[np.arange(nq), best]
+            depths = np.where(largest >= min_gap, best + 1, max_k)
+
+    elif policy == "relative":
+        top = scores[:, :1]
+        threshold = top - (1 - ratio) * np.abs(top)
+        depths = (scores[:, :max_k] >= threshold).sum(axis=1)
+
+    else:
+        if calibration is None:
+            raise ValueError("The calibrated policy needs a calibration")
+        finite = np.where(np.isfinite(scores), scores, -1e9)
+        probabilities = _sigmoid(_calibration_features(finite) @ calibration)
+        keep = probabilities[:, :max_k] >= min_probability
+        # Depth reaches the last candidate that is still likely enough
+        depths = np.where(keep.any(axis=1), max_k - np.argmax(keep[:, ::-1], axis=1), 0)
+
+    depths = np.clip(depths, min_k, max_k)
+    return np.minimum(depths, available).astype("int64")
+
+
+def fit_depth_calibration(
+    scores: np.ndarray,
+    relevant: np.ndarray,
+    iterations: int = 25,
+    l2: float = 1e-3,
+) -> np.ndarray:
+    """
+    Logistic calibration of relevance from retrieval scores.
+
+    relevant marks the gold candidates in the (nq, k) score matrix.
+    Fitted with Newton steps on the score and gap-to-top features;
+    returns the weights used by the "calibrated" policy.
+    """
+    valid = np.isfinite(scores)
+    features = _calibration_features(np.where(valid, scores, 0.0))[valid]
+    labels = np.asarray(relevant, dtype="float64")[valid]
+
+    weights = np.zeros(features.shape[1])
+    for _ in range(iterations):
+        p = _sigmoid(features @ weights)
+        gradient = features.T @ (p - labels) + l2 * weights
+        hessian = (features * (p * (1 - p))[:, None]).T @ features + l2 * np.eye(len(weights))
+        weights -= np.linalg.solve(hessian, gradient)
+
+    return weights
+
+
+def depth_config(policy: str, calibration_path: Optional[Path] = None, **params) -> Dict[str, Any]:
+    """
+    Keyword arguments for rerank_depths under a named policy.
+
+    The calibrated policy loads its weights from calibration_path and
+    fails here, not on the first query, when none have been saved.
+    """
+    if policy not in DEPTH_POLICIES:
+        raise ValueError(f"Unknown rerank depth policy: {policy}")
+
+    config: Dict[str, Any] = {"policy": policy, **params}
+
+    if policy == "calibrated":
+        if calibration_path is None or not Path(calibration_path).exists():
+            raise FileNotFoundError(
+                f"The calibrated policy needs a calibration at {calibration_path}; "
+                "fit one with analysis/rerank_depth_tradeoff.py"
+            )
+        # A list keeps the config JSON-serializable for run logs
+        config["calibration"] = np.load(calibration_path).tolist()
+
+    return config
+
+
+def depth_summary(depths: np.ndarray, max_k: int) -> Dict[str, float]:
+    """
+    Rerank documents sent under a policy compared with a fixed max_k.
+    """
+    sent = int(depths.sum())
+    return {
+        "queries": len(depths),
+        "documents_sent": sent,
+        "mean_depth": float(depths.mean()) if len(depths) else 0.0,
+        "fraction_of_fixed": sent / (max_k * len(depths)) if len(depths) else 0.0,
+    }
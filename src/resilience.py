@@ -0,0 +1,190 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional, TypeVar
+
+from src.instrumentation import count
+from src.rate_limit import RateLimiter
+
+
+T = TypeVar("T")
+
+# HTTP statuses worth retrying besides 5xx: request timeout, throttling
+RETRYABLE_STATUSES = {408, 429}
+
+
+# Error classification
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _headers(exc: BaseException) -> Dict[str, str]:
+    headers = getattr(exc, "headers", None)
+    if headers is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+    return {str(k).lower(): str(v) for k, v in dict(headers or {}).items()}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Decide whether a failed call is worth retrying.
+
+    Only transient errors are retried: throttling (429), timeouts,
+    dropped connections and 5xx responses. Everything else, other HTTP
+    errors (bad request, auth, not found) and local errors alike,
+    fails fast.
+    """
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or 500 <= status < 600
+
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+
+    # SDK network errors carry no status code but name themselves
+    name = type(exc).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """
+    Server-requested delay from a Retry-After header, if any.
+    """
+    value = _headers(exc).get("retry-after")
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Shared per-provider state
+class ProviderStats:
+    """
+    Counters for one provider, updated by every caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.retry_seconds = 0.0
+        self.throttle_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, **deltas: float) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "retry_seconds": self.retry_seconds,
+            "throttle_seconds": self.throttle_seconds,
+        }
+
+
+_LIMITERS: Dict[str, RateLimiter] = {}
+_STATS: Dict[str, ProviderStats] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def configure_provider(
+    provider: str,
+    requests_per_second: Optional[float] = None,
+    tokens_per_minute: Optional[int] = None,
+) -> RateLimiter:
+    """
+    Set the shared token bucket used by every call to provider.
+    """
+    limiter = RateLimiter(requests_per_second, tokens_per_minute)
+    with _REGISTRY_LOCK:
+        _LIMITERS[provider] = limiter
+    return limiter
+
+
+def get_limiter(provider: str) -> RateLimiter:
+    """
+    Shared token bucket for provider. Unlimited until configured.
+    """
+    with _REGISTRY_LOCK:
+        if provider not in _LIMITERS:
+            _LIMITERS[provider] = RateLimiter()
+        return _LIMITERS[provider]
+
+
+def get_stats(provider: str) -> ProviderStats:
+    with _REGISTRY_LOCK:
+        if provider not in _STATS:
+            _STATS[provider] = ProviderStats()
+        return _STATS[provider]
+
+
+def retry_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Snapshot of call, retry and wait counters for every provider.
+    """
+    with _REGISTRY_LOCK:
+        providers = list(_STATS.items())
+    return {name: stats.as_dict() for name, stats in providers}
+
+
+# Retrying calls
+def call_with_retries(
+    fn: Callable[[], T],
+    provider: str,
+    tokens: int = 0,
+    max_retries: int = 3,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    limiter: Optional[RateLimiter] = None,
+) -> T:
+    """
+    Call fn, retrying retryable errors with full-jitter exponential backoff.
+
+    Every attempt first takes a slot from the provider's shared token
+    bucket (or the given limiter), so concurrent callers are paced
+    together. A Retry-After header overrides the backoff when longer.
+    """
+    limiter = limiter or get_limiter(provider)
+    stats = get_stats(provider)
+
+    for attempt in range(max_retries + 1):
+        waited = limiter.acquire(tokens)
+        stats.add(calls=1, throttle_seconds=waited)
+        count(provider=provider, api_calls=1)
+
+        try:
+            result = fn()
+            count(provider=provider, input_tokens=tokens)
+            return result
+        except Exception as exc:
+            if attempt == max_retries or not is_retryable(exc):
+                stats.add(failures=1)
+                count(provider=provider, failures=1)
+                raise
+
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            requested = retry_after_seconds(exc)
+            if requested is not None:
+                delay = max(delay, min(requested, max_delay))
+
+            stats.add(retries=1, retry_seconds=delay)
+            count(provider=provider, retries=1)
+            time.sleep(delay)
+
+    raise RuntimeError("unreachable")
@@ -1,27 +1,310 @@
-from typing import Tuple
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional, Sequence, Tuple, Union
 
 import numpy as np
-import faiss
+
+from src.instrumentation import traced
+
+# FAISS is imported on first use so importing this module stays cheap
+if TYPE_CHECKING:
+    import faiss
+
+
+INDEX_TYPES = ("flat", "sq_fp16", "sq8", "ivf_flat", "ivf_pq", "hnsw", "auto")
+
+# Names of faiss.ScalarQuantizer code types
+_SCALAR_QUANTIZERS = {
+    "sq_fp16": "QT_fp16",
+    "sq8": "QT_8bit",
+}
+
+# Corpora smaller than this are searched exactly in "auto" mode
+AUTO_FLAT_MAX = 50_000
+# HNSW is only chosen in "auto" mode up to this many vectors
+AUTO_HNSW_MAX = 2_000_000
+
+
+# Index sizing helpers
+def _default_nlist(n: int) -> int:
+    """
+    Number of IVF lists: about 4 * sqrt(n), with at least 39
+    training points per list so k-means stays well posed.
+    """
+    nlist = int(4 * np.sqrt(n))
+    return max(1, min(nlist, n // 39))
+
+
+def _default_pq_m(dim: int) -> int:
+    """
+    Largest divisor of dim that keeps PQ codes at or under 64 bytes.
+    """
+    for m in range(min(64, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def estimate_index_bytes(
+    index_type: str,
+    n: int,
+    dim: int,
+    hnsw_m: int = 32,
+    pq_m: Optional[int] = None,
+) -> int:
+    """
+    Rough resident size of an index, used for "auto" selection.
+    """
+    if index_type == "flat":
+        return n * dim * 4
+    if index_type == "sq_fp16":
+        return n * dim * 2
+    if index_type == "sq8":
+        return n * dim
+    if index_type == "hnsw":
+        # Vectors plus about 2 * M neighbour ids on the base layer
+        return n * (dim * 4 + hnsw_m * 2 * 4)
+    if index_type == "ivf_flat":
+        return n * (dim * 4 + 8)
+    if index_type == "ivf_pq":
+        return n * ((pq_m or _default_pq_m(dim)) + 8)
+
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def select_index_type(
+    n: int,
+    dim: int,
+    memory_budget_bytes: Optional[int] = None,
+    hnsw_m: int = 32,
+) -> str:
+    """
+    Pick an index type from corpus size and memory budget.
+
+    Small corpora stay exact. Larger ones use HNSW when it fits,
+    then IVF-Flat, and IVF-PQ when nothing uncompressed fits.
+    """
+    def fits(index_type: str) -> bool:
+        if memory_budget_bytes is None:
+            return True
+        return estimate_index_bytes(index_type, n, dim, hnsw_m=hnsw_m) <= memory_budget_bytes
+
+    if n < AUTO_FLAT_MAX and fits("flat"):
+        return "flat"
+    if n <= AUTO_HNSW_MAX and fits("hnsw"):
+        return "hnsw"
+    if fits("ivf_flat"):
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def _training_sample(
+    vectors: np.ndarray,
+    size: int,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Uniform random subset of rows used to train IVF / PQ quantizers.
+    """
+    if vectors.shape[0] <= size:
+        return vectors
+
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(vectors.shape[0], size=size, replace=False))
+    return vectors[rows]
+
+
+def _normalized_float32(embeddings: np.ndarray) -> np.ndarray:
+    """
+    Return embeddings as C-contiguous, L2-normalized float32.
+
+    Input that already satisfies this is returned as-is, so large
+    pre-normalized matrices are not copied again.
+    """
+    if embeddings.dtype == np.float32 and embeddings.flags.c_contiguous:
+        norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        if np.allclose(norms, 1.0, atol=1e-4):
+            return embeddings
+
+    import faiss
+
+    vectors = np.array(embeddings, dtype="float32", order="C", copy=True)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def quantize_embeddings(
+    embeddings: np.ndarray,
+    dtype: str = "float16",
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compact storage for normalized embeddings.
+
+    dtype "float16" halves the size; "int8" quarters it using a
+    per-dimension affine scale. Returns (codes, offset, scale) such
+    that codes * scale + offset approximates the normalized vectors.
+    """
+    vectors = _normalized_float32(embeddings)
+    dim = vectors.shape[1]
+
+    if dtype == "float16":
+        return (
+            vectors.astype("float16"),
+            np.zeros(dim, dtype="float32"),
+            np.ones(dim, dtype="float32"),
+        )
+
+    if dtype == "int8":
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        scale = np.maximum(high - low, 1e-12) / 255.0
+        codes = np.round((vectors - low) / scale) - 128
+        return codes.astype("int8"), (low + 128 * scale).astype("float32"), scale.astype("float32")
+
+    raise ValueError(f"Unknown quantized dtype: {dtype}")
+
+
+def dequantize_embeddings(
+    codes: np.ndarray,
+    offset: np.ndarray,
+    scale: np.ndarray,
+) -> np.ndarray:
+    """
+    Inverse of quantize_embeddings.
+    """
+    return codes.astype("float32") * scale + offset
+
+
+class QuantizedEmbeddings:
+    """
+    Read-only view of quantized embeddings, dequantized on access.
+
+    Indexing with row ids, as rescore_candidates does, only touches
+    those rows, so the codes can stay memory-mapped. np.asarray gives
+    the whole float32 matrix.
+    """
+
+    dtype = np.dtype("float32")
+
+    def __init__(self, codes: np.ndarray, offset: np.ndarray, scale: np.ndarray):
+        self.codes = codes
+        self.offset = offset
+        self.scale = scale
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.codes.shape
+
+    @property
+    def ndim(self) -> int:
+        return self.codes.ndim
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return dequantize_embeddings(self.codes[rows], self.offset, self.scale)
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        vectors = dequantize_embeddings(self.codes, self.offset, self.scale)
+        return vectors if dtype is None else vectors.astype(dtype)
+
+
+def set_search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> faiss.Index:
+    """
+    Set query-time accuracy knobs on IVF and HNSW indexes.
+    Knobs that do not apply to the index type are ignored.
+    """
+    import faiss
+
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+
+    return index
 
 
 # Index construction
-def build_faiss_index(embeddings: np.ndarray) -> faiss.Index:
+@traced("build_faiss_index")
+def build_faiss_index(
+    embeddings: np.ndarray,
+    index_type: str = "flat",
+    memory_budget_bytes: Optional[int] = None,
+    nlist: Optional[int] = None,
+    nprobe: int = 16,
+    pq_m: Optional[int] = None,
+    pq_nbits: int = 8,
+    hnsw_m: int = 32,
+    ef_construction: int = 200,
+    ef_search: int = 128,
+    train_size: Optional[int] = None,
+    seed: int = 0,
+) -> faiss.Index:
     """
     Build a FAISS index for cosine similarity search.
+
+    index_type is one of "flat" (exact), "sq_fp16" / "sq8" (scalar
+    quantized codes), "ivf_flat", "ivf_pq", "hnsw" or "auto", which
+    picks a type from corpus size and memory budget.
     """
+    import faiss
+
     if embeddings.ndim != 2:
         raise ValueError("Embeddings must be a 2D array")
 
     if embeddings.shape[0] == 0:
         raise ValueError("Cannot build FAISS index with no embeddings")
 
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+
     # FAISS expects float32 and normalized vectors for inner product similarity
-    vectors = embeddings.astype("float32")
-    faiss.normalize_L2(vectors)
+    vectors = _normalized_float32(embeddings)
+
+    n, dim = vectors.shape
+
+    if index_type == "auto":
+        index_type = select_index_type(n, dim, memory_budget_bytes, hnsw_m=hnsw_m)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+
+    elif index_type in _SCALAR_QUANTIZERS:
+        index = faiss.IndexScalarQuantizer(
+            dim,
+            getattr(faiss.ScalarQuantizer, _SCALAR_QUANTIZERS[index_type]),
+            faiss.METRIC_INNER_PRODUCT,
+        )
+        index.train(_training_sample(vectors, train_size or 65536, seed=seed))
+
+    else:
+        nlist = nlist or _default_nlist(n)
+        if index_type == "ivf_flat":
+            description = f"IVF{nlist},Flat"
+        else:
+            description = f"IVF{nlist},PQ{pq_m or _default_pq_m(dim)}x{pq_nbits}"
+
+        index = faiss.index_factory(dim, description, faiss.METRIC_INNER_PRODUCT)
+
+        # FAISS recommends 30-256 training points per centroid
+        train_size = train_size or max(nlist * 64, 2 ** pq_nbits * 39)
+        index.train(_training_sample(vectors, train_size, seed=seed))
 
-    dim = vectors.shape[1]
-    index = faiss.IndexFlatIP(dim)
     index.add(vectors)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
 
     return index
 
@@ -31,6 +314,8 @@ def retrieve_top_k(
     index: faiss.Index,
     query_embedding: np.ndarray,
     k: int,
+    rescore_embeddings: Optional[np.ndarray] = None,
+    rescore_factor: int = 4,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
     Retrieve the top-k most similar embeddings from the index.
@@ -41,12 +326,100 @@ def retrieve_top_k(
     if k <= 0:
         raise ValueError("k must be positive")
 
-    query = query_embedding.astype("float32").reshape(1, -1)
-    faiss.normalize_L2(query)
+    indices, scores = retrieve_top_k_batch(
+        index,
+        query_embedding.reshape(1, -1),
+        k,
+        rescore_embeddings=rescore_embeddings,
+        rescore_factor=rescore_factor,
+    )
+
+    return indices[0], scores[0]
+
+
+def rescore_candidates(
+    query_embeddings: np.ndarray,
+    candidate_ids: np.ndarray,
+    full_embeddings: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Re-rank candidate ids by exact cosine similarity.
+
+    query_embeddings must already be normalized. Only the candidate
+    rows of full_embeddings are read, so it can be memory-mapped.
+    Padding ids (-1) stay at the end with score -inf.
+    """
+    valid = candidate_ids >= 0
+    rows = full_embeddings[np.where(valid, candidate_ids, 0)].astype("float32")
+    norms = np.linalg.norm(rows, axis=2, keepdims=True)
+    rows /= np.maximum(norms, 1e-12)
+
+    scores = np.einsum("qcd,qd->qc", rows, query_embeddings)
+    scores[~valid] = -np.inf
+
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(candidate_ids, order, axis=1),
+        np.take_along_axis(scores, order, axis=1).astype("float32"),
+    )
+
+
+# Batched retrieval
+@traced("retrieve_top_k")
+def retrieve_top_k_batch(
+    index: faiss.Index,
+    query_embeddings: np.ndarray,
+    k: Union[int, Sequence[int], np.ndarray],
+    rescore_embeddings: Optional[np.ndarray] = None,
+    rescore_factor: int = 4,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Retrieve top-k results for many queries with a single search.
+
+    k may be one value for all queries or one value per query.
+    Returns (ids, scores) arrays of shape (nq, max k). Positions past
+    a query's own k are padded with id -1 and score -inf.
+
+    With rescore_embeddings, rescore_factor * k candidates are taken
+    from a (quantized) index and re-ranked against the full vectors.
+    """
+    if query_embeddings.ndim != 2:
+        raise ValueError("Query embeddings must be a 2D array")
+
+    nq = query_embeddings.shape[0]
+    ks = np.broadcast_to(np.asarray(k, dtype="int64"), (nq,))
+
+    if np.any(ks <= 0):
+        raise ValueError("k must be positive")
 
     # Avoid asking FAISS for more items than exist
-    k = min(k, index.ntotal)
+    ks = np.minimum(ks, index.ntotal)
+    k_max = int(ks.max()) if nq else 0
+
+    if nq == 0 or k_max == 0:
+        return (
+            np.full((nq, k_max), -1, dtype="int64"),
+            np.full((nq, k_max), -np.inf, dtype="float32"),
+        )
+
+    import faiss
+
+    # Normalize the whole matrix once, on a copy of the caller's array
+    queries = np.array(query_embeddings, dtype="float32", order="C", copy=True)
+    faiss.normalize_L2(queries)
+
+    if rescore_embeddings is None:
+        scores, indices = index.search(queries, k_max)
+    else:
+        depth = min(k_max * rescore_factor, index.ntotal)
+        _, candidates = index.search(queries, depth)
+        indices, scores = rescore_candidates(queries, candidates, rescore_embeddings)
+        indices = np.ascontiguousarray(indices[:, :k_max])
+        scores = np.ascontiguousarray(scores[:, :k_max])
 
-    scores, indices = index.search(query, k)
+    # Mask out ranks beyond each query's own k
+    beyond = np.arange(k_max)[None, :] >= ks[:, None]
+    indices[beyond] = -1
+    scores[beyond] = -np.inf
 
-    return indices[0], scores[0]
\ No newline at end of file
+    return indices, scores
@@ -0,0 +1,242 @@
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Sequence
+
+from src.cache import text_hash
+
+try:
+    import fcntl
+except ImportError:  # Windows: O_APPEND alone keeps lines whole
+    fcntl = None
+
+
+RUN_LOG_NAME = "runs.jsonl"
+
+# Written before run logs existed; read when a pipeline has no run log
+LEGACY_RESULT_NAME = "result.json"
+
+
+# Helpers
+def config_hash(config: Dict[str, Any]) -> str:
+    """
+    Stable short hash of a run configuration.
+    """
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return text_hash(payload)[:16]
+
+
+def new_run_id() -> str:
+    """
+    Sortable, collision-free id for one invocation of a pipeline.
+    """
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+# Writer
+class RunLog:
+    """
+    Append-only JSONL log of query runs.
+
+    Each record is one compact line stamped with the run id, the hash
+    of the run config and a timestamp. A batch of records is written
+    with a single O_APPEND write under an exclusive flock, so threads
+    and processes appending to the same file never interleave lines.
+
+    The config itself is logged once per run as a line with
+    "type": "run". With chunk_dir set, any "text" of a reranked chunk
+    is stored there by content hash and the record keeps only its
+    "text_ref"; read_records can put the texts back.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        config: Optional[Dict[str, Any]] = None,
+        run_id: Optional[str] = None,
+        chunk_dir: Optional[Path] = None,
+    ):
+        self.path = Path(path)
+        self.config = config or {}
+        self.config_hash = config_hash(self.config)
+        self.run_id = run_id or new_run_id()
+        self.chunk_dir = Path(chunk_dir) if chunk_dir is not None else None
+        self.records_written = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _store_text(self, text: str) -> str:
+        key = text_hash(text)
+        path = self.chunk_dir / key[:2] / f"{key}.txt"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Content-addressed, so racing writers produce the same file
+            tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        return key
+
+    def _line(self, record: Dict[str, Any]) -> str:
+        record = {
+            "run_id": self.run_id,
+            "config_hash": self.config_hash,
+            "logged_at": time.time(),
+            **record,
+        }
+        if self.chunk_dir is not None and record.get("reranked_chunks"):
+            record["reranked_chunks"] = [
+                {k: v for k, v in chunk.items() if k != "text"}
+                | ({"text_ref": self._store_text(chunk["text"])} if "text" in chunk else {})
+                for chunk in record["reranked_chunks"]
+            ]
+        return json.dumps(record, separators=(",", ":"), default=str) + "\n"
+
+    def _write(self, data: bytes) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+
+    def extend(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Append many records in one write.
+        """
+        lines = [self._line(r) for r in records]
+        count = len(lines)
+
+        with self._lock:
+            if not self._started:
+                header = {
+                    "type": "run",
+                    "run_id": self.run_id,
+                    "config_hash": self.config_hash,
+                    "started_at": time.time(),
+                    "config": self.config,
+                }
+                lines.insert(0, json.dumps(header, separators=(",", ":"), default=str) + "\n")
+                self._started = True
+
+            if lines:
+                self._write("".join(lines).encode("utf-8"))
+            self.records_written += count
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.extend([record])
+
+
+# Reader
+def has_records(base_dir: Path) -> bool:
+    """
+    Whether a pipeline results directory has a run log or legacy result.
+    """
+    return (Path(base_dir) / RUN_LOG_NAME).exists() or (Path(base_dir) / LEGACY_RESULT_NAME).exists()
+
+
+def _resolve_chunks(record: Dict[str, Any], chunk_dir: Path) -> Dict[str, Any]:
+    for chunk in record.get("reranked_chunks") or []:
+        key = chunk.pop("text_ref", None)
+        if key is not None:
+            chunk["text"] = (chunk_dir / key[:2] / f"{key}.txt").read_text(encoding="utf-8")
+    return record
+
+
+def read_records(
+    path: Path,
+    run_ids: Optional[Sequence[str]] = None,
+    chunk_dir: Optional[Path] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream query records from a run log, one line at a time.
+
+    path may be the log itself or a pipeline results directory, in
+    which case its runs.jsonl is read, falling back to a legacy
+    result.json. Run header lines are skipped, as is a trailing line
+    left incomplete by a writer that was killed mid-write. With
+    chunk_dir, out-of-line chunk texts are loaded back into
+    "reranked_chunks".
+    """
+    path = Path(path)
+
+    if path.is_dir():
+        if (path / RUN_LOG_NAME).exists():
+            path = path / RUN_LOG_NAME
+        elif (path / LEGACY_RESULT_NAME).exists():
+            path = path / LEGACY_RESULT_NAME
+        else:
+            return
+
+    if path.suffix == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # Allow both single-record and list-of-records formats
+        yield from [data] if isinstance(data, dict) else data
+        return
+
+    wanted = set(run_ids) if run_ids is not None else None
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            record = json.loads(line)
+            if record.get("type") == "run":
+                continue
+            if wanted is not None and record.get("run_id") not in wanted:
+                continue
+            if chunk_dir is not None:
+                record = _resolve_chunks(record, Path(chunk_dir))
+            yield record
+
+
+def read_runs(path: Path) -> List[Dict[str, Any]]:
+    """
+    Run header lines (run id, config and its hash) of a run log, oldest first.
+    """
+    path = Path(path)
+    if path.is_dir():
+        path = path / RUN_LOG_NAME
+    if not path.exists():
+        return []
+
+    runs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            # Headers are small, so skip record lines without parsing them
+            if line.startswith('{"type":"run"') and line.endswith("\n"):
+                runs.append(json.loads(line))
+    return runs
+
+
+def latest_run_id(path: Path) -> Optional[str]:
+    runs = read_runs(path)
+    return runs[-1]["run_id"] if runs else None
+
+
+def latest_runs(
+    path: Path,
+    key: Optional[Callable[[Dict[str, Any]], Hashable]] = None,
+) -> Dict[Hashable, str]:
+    """
+    Newest run id for each value of key(run header), by default for
+    each config hash.
+    """
+    key = key or (lambda run: run["config_hash"])
+    return {key(run): run["run_id"] for run in read_runs(path)}
+
+
+def latest_records(path: Path, chunk_dir: Optional[Path] = None) -> Iterator[Dict[str, Any]]:
+    """
+    read_records for the newest run only, so repeated runs are not
+    pooled. A legacy result.json is read whole.
+    """
+    run_id = latest_run_id(path)
+    return read_records(path, run_ids=None if run_id is None else [run_id], chunk_dir=chunk_dir)
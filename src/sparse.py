@@ -0,0 +1,271 @@
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.instrumentation import traced
+from src.retrieval import retrieve_top_k_batch
+
+
+RETRIEVAL_MODES = ("dense", "sparse", "rrf", "weighted")
+
+_TOKEN = re.compile(r"\w+")
+
+
+# Helpers
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens, shared by indexing and querying.
+    """
+    return _TOKEN.findall(text.lower())
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Ids and scores of the k best entries, best first, padded with
+    id -1 and score -inf like retrieve_top_k_batch.
+    """
+    ids = np.full(k, -1, dtype="int64")
+    top = np.full(k, -np.inf, dtype="float32")
+
+    # Documents without any query term are not results
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    ids[:len(order)] = order
+    top[:len(order)] = scores[order]
+    return ids, top
+
+
+# Sparse index
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of chunks.
+
+    Postings are held as a CSR matrix with one row per term: row t
+    spans postings[indptr[t]:indptr[t + 1]], holding the ids of the
+    chunks containing t and their precomputed BM25 term weights. A
+    query is scored by gathering its terms' rows and summing weights
+    per chunk with np.bincount, with no Python loop over postings.
+    """
+
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        indptr: np.ndarray,
+        doc_ids: np.ndarray,
+        weights: np.ndarray,
+        num_docs: int,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.vocabulary = vocabulary
+        self.indptr = np.asarray(indptr, dtype="int64")
+        self.doc_ids = np.asarray(doc_ids, dtype="int32")
+        self.weights = np.asarray(weights, dtype="float32")
+        self.ntotal = int(num_docs)
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, chunks: Sequence[str], k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        term_ids: List[np.ndarray] = []
+        lengths = np.zeros(len(chunks), dtype="float32")
+
+        for row, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths[row] = len(tokens)
+            term_ids.append(np.fromiter(
+                (vocabulary.setdefault(t, len(vocabulary)) for t in tokens),
+                dtype="int64",
+                count=len(tokens),
+            ))
+
+        num_docs = len(chunks)
+        rows = np.repeat(np.arange(num_docs, dtype="int64"), [len(t) for t in term_ids])
+        terms = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype="int64")
+
+        # One posting per (term, chunk), sorted by term then chunk
+        keys, tf = np.unique(terms * num_docs + rows, return_counts=True)
+        posting_terms = keys // max(num_docs, 1)
+        doc_ids = keys % max(num_docs, 1)
+
+        df = np.bincount(posting_terms, minlength=len(vocabulary))
+        indptr = np.concatenate([[0], np.cumsum(df)])
+
+        idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+        avgdl = max(float(lengths.mean()) if num_docs else 0.0, 1e-9)
+        norm = k1 * (1 - b + b * lengths[doc_ids] / avgdl)
+        weights = idf[posting_terms] * tf * (k1 + 1) / (tf + norm)
+
+        return cls(vocabulary, indptr, doc_ids, weights, num_docs, k1=k1, b=b)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        BM25 score of every chunk for query.
+        """
+        term_ids, counts = np.unique(
+            [self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary],
+            return_counts=True,
+        )
+        if len(term_ids) == 0:
+            return np.zeros(self.ntotal, dtype="float32")
+
+        starts = self.indptr[term_ids]
+        sizes = self.indptr[term_ids + 1] - starts
+
+        # Positions of every posting of the query terms, without a loop
+        positions = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        repeats = np.repeat(counts, sizes)
+
+        return np.bincount(
+            self.doc_ids[positions],
+            weights=self.weights[positions] * repeats,
+            minlength=self.ntotal,
+        ).astype("float32")
+
+    def search(self, queries: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k chunk ids and scores per query, shaped like
+        retrieve_top_k_batch output.
+        """
+        k = min(k, self.ntotal)
+        ids = np.full((len(queries), k), -1, dtype="int64")
+        scores = np.full((len(queries), k), -np.inf, dtype="float32")
+
+        for i, query in enumerate(queries):
+            ids[i], scores[i] = _top_k(self.scores(query), k)
+
+        return ids, scores
+
+    # Serialization
+    def save(self, path: Path) -> None:
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez_compressed(
+            path,
+            terms=np.asarray(terms, dtype=str),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            weights=self.weights,
+            params=np.asarray([self.ntotal, self.k1, self.b], dtype="float64"),
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        with np.load(path, allow_pickle=False) as data:
+            num_docs, k1, b = data["params"]
+            return cls(
+                vocabulary={str(t): i for i, t in enumerate(data["terms"])},
+                indptr=data["indptr"],
+                doc_ids=data["doc_ids"],
+                weights=data["weights"],
+                num_docs=int(num_docs),
+                k1=float(k1),
+                b=float(b),
+            )
+
+
+# Rank fusion
+def reciprocal_rank_fusion(
+    rankings: Sequence[np.ndarray],
+    k: int,
+    rrf_k: int = 60,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse (nq, depth) id matrices by summing 1 / (rrf_k + rank).
+    Padding ids (-1) are ignored. Returns (ids, scores) of shape (nq, k).
+    """
+    nq = rankings[0].shape[0]
+    ids = np.full((nq, k), -1, dtype="int64")
+    scores = np.full((nq, k), -np.inf, dtype="float32")
+
+    for q in range(nq):
+        fused: Dict[int, float] = {}
+        for ranking in rankings:
+            for rank, doc in enumerate(ranking[q]):
+                if doc >= 0:
+                    fused[int(doc)] = fused.get(int(doc), 0.0) + 1.0 / (rrf_k + rank + 1)
+
+        best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        for j, (doc, score) in enumerate(best):
+            ids[q, j] = doc
+            scores[q, j] = score
+
+    return ids, scores
+
+
+def weighted_fusion(
+    results: Sequence[Tuple[np.ndarray, np.ndarray]],
+    weights: Sequence[float],
+    k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fuse (ids, scores) results by a weighted sum of min-max normalized
+    scores. A chunk missing from one result list gets 0 from it.
+    """
+    nq = results[0][0].shape[0]
+    ids = np.full((nq, k), -1, dtype="int64")
+    scores = np.full((nq, k), -np.inf, dtype="float32")
+
+    for q in range(nq):
+        fused: Dict[int, float] = {}
+        for (result_ids, result_scores), weight in zip(results, weights):
+            valid = result_ids[q] >= 0
+            row_ids = result_ids[q][valid]
+            row_scores = result_scores[q][valid].astype("float64")
+            if len(row_ids) == 0:
+                continue
+
+            low, high = row_scores.min(), row_scores.max()
+            normalized = (row_scores - low) / (high - low) if high > low else np.ones(len(row_scores))
+
+            for doc, score in zip(row_ids, normalized):
+                fused[int(doc)] = fused.get(int(doc), 0.0) + weight * score
+
+        best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        for j, (doc, score) in enumerate(best):
+            ids[q, j] = doc
+            scores[q, j] = score
+
+    return ids, scores
+
+
+@traced("retrieve_top_k")
+def hybrid_retrieve(
+    mode: str,
+    k: int,
+    queries: Sequence[str],
+    query_embeddings: Optional[np.ndarray] = None,
+    index=None,
+    bm25: Optional[BM25Index] = None,
+    depth: Optional[int] = None,
+    alpha: float = 0.5,
+    rrf_k: int = 60,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    First-stage retrieval for many queries in one of RETRIEVAL_MODES.
+
+    "dense" searches the FAISS index, "sparse" the BM25 index; "rrf"
+    and "weighted" take depth candidates (default 2k) from each and
+    fuse them, with alpha the dense weight for "weighted". Sparse
+    mode needs no query embeddings.
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+
+    if mode == "dense":
+        return retrieve_top_k_batch(index, query_embeddings, k)
+    if mode == "sparse":
+        return bm25.search(queries, k)
+
+    depth = depth or 2 * k
+    dense = retrieve_top_k_batch(index, query_embeddings, depth)
+    sparse = bm25.search(queries, depth)
+
+    if mode == "rrf":
+        return reciprocal_rank_fusion([dense[0], sparse[0]], k, rrf_k=rrf_k)
+    return weighted_fusion([dense, sparse], [alpha, 1 - alpha], k)
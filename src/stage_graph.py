@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import product
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from src.instrumentation import bind, start_trace
+
+
+# Where a stage output came from in one run
+SOURCES = ("computed", "memory", "disk")
+
+
+# Stages
+class Stage(NamedTuple):
+    """
+    One step of a stage graph.
+
+    fn is called with the outputs of the input stages, in order, and
+    the stage's parameters as keyword arguments. params names the
+    point parameters the stage uses, or is a function of the point
+    returning them, for stages whose parameters depend on a setting
+    (only the selected chunker's). Bump version when fn changes what
+    it returns, so stored outputs are not reused.
+    """
+
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    params: Union[Sequence[str], Callable[[Dict[str, Any]], Dict[str, Any]]] = ()
+    persist: bool = True
+    version: int = 1
+
+    def params_for(self, point: Dict[str, Any]) -> Dict[str, Any]:
+        if callable(self.params):
+            return self.params(point)
+        return {name: point[name] for name in self.params}
+
+
+def stage_key(stage: Stage, params: Dict[str, Any], input_keys: Sequence[str]) -> str:
+    """
+    Hash of a stage's parameters and the keys of its inputs.
+
+    Input keys are themselves hashes of everything upstream, so a
+    changed parameter changes the key of its stage and of every stage
+    downstream of it, and of nothing else.
+    """
+    payload = json.dumps(
+        {
+            "stage": stage.name,
+            "version": stage.version,
+            "params": params,
+            "inputs": list(input_keys),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+# Stage graph
+class StageGraph:
+    """
+    Stages run in dependency order with every output memoized by key.
+
+    Outputs are kept in memory for the life of the graph and, for
+    persisted stages, pickled under root so later sweeps start warm.
+    Running a point only computes the stages the target needs whose
+    key has not been seen; the rest are loaded. Safe to run points
+    from several threads: a stage that one thread is computing is
+    waited for, not computed again.
+    """
+
+    def __init__(self, stages: Sequence[Stage], root: Optional[Path] = None):
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown or later stages: {missing}")
+            self.stages[stage.name] = stage
+
+        self.root = Path(root) if root is not None else None
+        self._memo: Dict[str, Tuple[Any, float]] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            name: {**dict.fromkeys(SOURCES, 0), "seconds": 0.0, "saved_seconds": 0.0}
+            for name in self.stages
+        }
+
+    def keys(self, point: Dict[str, Any]) -> Dict[str, str]:
+        """
+        Key of every stage for a point, without running anything.
+        """
+        keys: Dict[str, str] = {}
+        for name, stage in self.stages.items():
+            keys[name] = stage_key(stage, stage.params_for(point), [keys[i] for i in stage.inputs])
+        return keys
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.root / stage / key[:2] / f"{key}.pkl"
+
+    def _load(self, stage: Stage, key: str) -> Optional[Tuple[Any, float]]:
+        if self.root is None or not stage.persist:
+            return None
+        path = self._path(stage.name, key)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _store(self, stage: Stage, key: str, entry: Tuple[Any, float]) -> None:
+        if self.root is None or not stage.persist:
+            return
+        path = self._path(stage.name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed so readers never see a partial file
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def _resolve(
+        self,
+        name: str,
+        point: Dict[str, Any],
+        keys: Dict[str, str],
+        values: Dict[str, Any],
+        sources: Dict[str, str],
+    ) -> Any:
+        # Already resolved for this run as the input of another stage
+        if name in values:
+            return values[name]
+
+        stage = self.stages[name]
+        key = keys[name]
+
+        with self._lock:
+            if key in self._memo:
+                value, seconds = self._memo[key]
+                self._stats[name]["memory"] += 1
+                self._stats[name]["saved_seconds"] += seconds
+                values[name], sources[name] = value, "memory"
+                return value
+
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[key] = future
+
+        if not owner:
+            # Another point is computing this stage right now
+            value, seconds = future.result()
+            with self._lock:
+                self._stats[name]["memory"] += 1
+                self._stats[name]["saved_seconds"] += seconds
+            values[name], sources[name] = value, "memory"
+            return value
+
+        try:
+            entry = self._load(stage, key)
+            source = "disk"
+            if entry is None:
+                inputs = [self._resolve(i, point, keys, values, sources) for i in stage.inputs]
+                start = time.perf_counter()
+                value = stage.fn(*inputs, **stage.params_for(point))
+                entry = (value, time.perf_counter() - start)
+                source = "computed"
+                self._store(stage, key, entry)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            self._memo[key] = entry
+            del self._pending[key]
+            stats = self._stats[name]
+            stats[source] += 1
+            stats["seconds" if source == "computed" else "saved_seconds"] += entry[1]
+        future.set_result(entry)
+
+        values[name], sources[name] = entry[0], source
+        return entry[0]
+
+    def run(self, point: Dict[str, Any], target: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Output of target (the last stage by default) for a point.
+
+        Returns the output, the keys of all stages and where each
+        stage touched by this run got its output from ("computed",
+        "memory" or "disk"). Stages upstream of a stored output are
+        not touched at all.
+        """
+        target = target or list(self.stages)[-1]
+        keys = self.keys(point)
+        sources: Dict[str, str] = {}
+        output = self._resolve(target, point, keys, {}, sources)
+        return {"output": output, "keys": keys, "sources": sources}
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per stage: outputs computed, reused from memory or disk, compute
+        seconds spent and the compute seconds the reused outputs saved.
+        """
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+# Sweeps
+def grid_points(base: Dict[str, Any], grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """
+    Every combination of the grid values, each on top of base.
+    """
+    names = list(grid)
+    return [
+        {**base, **dict(zip(names, values))}
+        for values in product(*(grid[name] for name in names))
+    ]
+
+
+def sweep(
+    graph: StageGraph,
+    points: Sequence[Dict[str, Any]],
+    target: Optional[str] = None,
+    max_workers: int = 4,
+) -> List[Dict[str, Any]]:
+    """
+    Run the graph on many points, max_workers at a time.
+
+    Points sharing upstream stages share their outputs, so each
+    distinct stage key is computed once however the points are
+    scheduled. Each result carries the trace of its point; work done
+    for a point that another point then reuses is charged to the
+    first one.
+    """
+    def run_point(point: Dict[str, Any]) -> Dict[str, Any]:
+        with start_trace() as trace:
+            result = graph.run(point, target)
+        return {**result, "trace": trace.as_dict()}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(bind(run_point), points))
+
+
+def reuse_summary(stats: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """
+    Totals over the stages of StageGraph.stats().
+    """
+    computed = sum(s["computed"] for s in stats.values())
+    reused = sum(s["memory"] + s["disk"] for s in stats.values())
+    return {
+        "computed": computed,
+        "reused": reused,
+        "reuse_rate": reused / (computed + reused) if computed + reused else 0.0,
+        "seconds": sum(s["seconds"] for s in stats.values()),
+        "saved_seconds": sum(s["saved_seconds"] for s in stats.values()),
+    }